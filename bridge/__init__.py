@@ -1,6 +1,9 @@
 import platform
 import logging
-from typing import Dict, Type, Any, List
+import importlib
+import threading
+from functools import lru_cache
+from typing import Dict, Type, Any, List, Optional
 
 # プラットフォーム検出
 PLATFORM = platform.system()
@@ -77,7 +80,7 @@ class PhotoshopBridge:
         """現在のドキュメント情報を取得する"""
         raise NotImplementedError()
     
-    async def generate_thumbnail(self, path: str, width: int = 256, height: int = 256, format: str = "jpeg", quality: int = 80) -> dict:
+    async def generate_thumbnail(self, path: str, width: int = 256, height: int = 256, format: str = "jpeg", quality: int = 80, return_bytes: bool = False) -> dict:
         """サムネイルを生成する
         
         Args:
@@ -86,13 +89,14 @@ class PhotoshopBridge:
             height: サムネイルの高さ
             format: 出力形式（jpeg, png）
             quality: 画質（0-100）
+            return_bytes: thumbnailをBase64文字列ではなく画像のバイト列で返すかどうか
             
         Returns:
             サムネイル情報（status, thumbnail, width, height, format）
         """
         raise NotImplementedError()
         
-    async def generate_thumbnail_stream(self, path: str, width: int = 256, height: int = 256, format: str = "jpeg", quality: int = 80, callback=None) -> dict:
+    async def generate_thumbnail_stream(self, path: str, width: int = 256, height: int = 256, format: str = "jpeg", quality: int = 80, callback=None, return_bytes: bool = False) -> dict:
         """サムネイルを生成し、進捗状況をコールバックで通知する
         
         Args:
@@ -102,37 +106,66 @@ class PhotoshopBridge:
             format: 出力形式（jpeg, png）
             quality: 画質（0-100）
             callback: 進捗状況を通知するコールバック関数
+            return_bytes: thumbnailをBase64文字列ではなく画像のバイト列で返すかどうか
             
         Returns:
             サムネイル情報（status, thumbnail, width, height, format）
         """
         raise NotImplementedError()
 
-# UXPバックエンドは常にインポート（プラットフォーム非依存）
-from .uxp_backend import UXPBridge
+# ブリッジモードと実装クラスの対応（"モジュール:クラス名"、初回使用時にインポート）
+_UXP_BRIDGE = f"{__name__}.uxp_backend:UXPBridge"
+_APPLESCRIPT_BRIDGE = f"{__name__}.applescript_backend:AppleScriptBridge"
+_POWERSHELL_BRIDGE = f"{__name__}.powershell_backend:PowerShellBridge"
 
-# プラットフォームに応じた実装クラスのインポート
-_BRIDGES = {
-    "uxp": UXPBridge
+# UXPバックエンドは常に利用可能（プラットフォーム非依存）
+_BRIDGES: Dict[str, str] = {
+    "uxp": _UXP_BRIDGE
 }
 
 # macOS固有のバックエンド
 if PLATFORM == "Darwin":
-    from .applescript_backend import AppleScriptBridge
-    _BRIDGES["applescript"] = AppleScriptBridge
-    _BRIDGES["default"] = AppleScriptBridge
+    _BRIDGES["applescript"] = _APPLESCRIPT_BRIDGE
+    _BRIDGES["default"] = _APPLESCRIPT_BRIDGE
 # Windows固有のバックエンド
 elif PLATFORM == "Windows":
-    from .powershell_backend import PowerShellBridge
-    _BRIDGES["powershell"] = PowerShellBridge
-    _BRIDGES["default"] = PowerShellBridge
+    _BRIDGES["powershell"] = _POWERSHELL_BRIDGE
+    _BRIDGES["default"] = _POWERSHELL_BRIDGE
 else:
     # その他のプラットフォームではUXPバックエンドをデフォルトとして使用
-    _BRIDGES["default"] = UXPBridge
+    _BRIDGES["default"] = _UXP_BRIDGE
+
+# 生成済みブリッジインスタンス（"モジュール:クラス名" -> インスタンス）
+_INSTANCES: Dict[str, PhotoshopBridge] = {}
+_INSTANCES_LOCK = threading.Lock()
+
+@lru_cache(maxsize=None)
+def _load_bridge_class(target: str) -> Type[PhotoshopBridge]:
+    """ブリッジクラスをインポートする
+    
+    Args:
+        target: "モジュール:クラス名"形式のクラス指定
+        
+    Returns:
+        ブリッジクラス
+    """
+    module_name, class_name = target.split(":")
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name)
+
+def __getattr__(name: str) -> Any:
+    """ブリッジクラスの遅延インポート（from photoshop_mcp_server.bridge import UXPBridge との互換性のため）"""
+    for target in (_UXP_BRIDGE, _APPLESCRIPT_BRIDGE, _POWERSHELL_BRIDGE):
+        if target.endswith(f":{name}"):
+            return _load_bridge_class(target)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def get_bridge(bridge_mode: str = "default") -> PhotoshopBridge:
     """指定されたモードのブリッジインスタンスを取得する（改善版）
     
+    ブリッジはモードごとに一度だけ初期化され、以降は同じインスタンスを返します。
+    同じ実装クラスを指すモード（"default"と"uxp"など）はインスタンスを共有します。
+    
     Args:
         bridge_mode: ブリッジモード（"default", "uxp", "applescript"など）
             "default": プラットフォームに応じたデフォルトのバックエンド
@@ -153,11 +186,23 @@ def get_bridge(bridge_mode: str = "default") -> PhotoshopBridge:
             logger.info(f"Falling back to default bridge mode")
             bridge_mode = "default"
             
-        bridge_class = _BRIDGES[bridge_mode]
-        logger.debug(f"Initializing bridge: {bridge_class.__name__}")
+        target = _BRIDGES[bridge_mode]
+        bridge = _INSTANCES.get(target)
+        if bridge is not None:
+            return bridge
         
-        # ブリッジインスタンスの作成
-        bridge = bridge_class()
+        with _INSTANCES_LOCK:
+            # ロック取得待ちの間に他のスレッドが初期化している場合がある
+            bridge = _INSTANCES.get(target)
+            if bridge is not None:
+                return bridge
+            
+            bridge_class = _load_bridge_class(target)
+            logger.debug(f"Initializing bridge: {bridge_class.__name__}")
+            
+            # ブリッジインスタンスの作成
+            bridge = bridge_class()
+            _INSTANCES[target] = bridge
         
         # プラットフォーム互換性チェック
         if (bridge_mode == "applescript" and PLATFORM != "Darwin") or \
@@ -169,6 +214,18 @@ def get_bridge(bridge_mode: str = "default") -> PhotoshopBridge:
         logger.error(f"Failed to initialize bridge: {e}")
         raise RuntimeError(f"Failed to initialize bridge: {e}")
 
+def reset_bridge(bridge_mode: Optional[str] = None) -> None:
+    """キャッシュされたブリッジインスタンスを破棄する（主にテスト用）
+    
+    Args:
+        bridge_mode: 破棄するブリッジモード。Noneの場合はすべてのインスタンスを破棄
+    """
+    with _INSTANCES_LOCK:
+        if bridge_mode is None:
+            _INSTANCES.clear()
+        elif bridge_mode in _BRIDGES:
+            _INSTANCES.pop(_BRIDGES[bridge_mode], None)
+
 def get_available_bridge_modes() -> List[str]:
     """利用可能なブリッジモードのリストを取得する
     
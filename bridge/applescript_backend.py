@@ -1,31 +1,446 @@
 import asyncio
+import hashlib
 import json
-from typing import Dict, Any, Optional
+import time
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from string import Template
+from types import MappingProxyType
+from typing import Dict, Any, List, Mapping, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjsonが利用できない場合は標準のjsonを使用
+    orjson = None
 
 from . import PhotoshopBridge
+from .image_utils import PILLOW_THUMBNAIL_EXTENSIONS, pillow_thumbnail, read_image_file
+from .path_utils import normalize_path
+
+logger = logging.getLogger('photoshop_mcp_server.bridge.applescript')
+
+# 結果のデコードに使う関数（orjsonのデコードエラーはjson.JSONDecodeErrorのサブクラス）
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+# 常駐させるosascript（JXA）のプログラム
+# 標準入力から1行1件のJSONリクエスト {"id", "script"} を読み、NSAppleScriptでAppleScriptを実行して
+# 結果を1行1件のJSON {"id", "stdout", "stderr", "returncode"} で標準出力に書き出す
+_OSASCRIPT_SERVER_JS = r'''
+ObjC.import("Foundation");
+var stdin = $.NSFileHandle.fileHandleWithStandardInput;
+var stdout = $.NSFileHandle.fileHandleWithStandardOutput;
+
+function reply(obj) {
+    stdout.writeData($(JSON.stringify(obj) + "\n").dataUsingEncoding($.NSUTF8StringEncoding));
+}
+
+function describe(desc) {
+    var text = desc.stringValue;
+    if (!text.isNil()) {
+        return text.js;
+    }
+    // 文字列に変換できない真偽値はosascriptと同じ表記にする
+    var type = desc.descriptorType;
+    if (type === 0x74727565) {
+        return "true";
+    }
+    if (type === 0x66616c73) {
+        return "false";
+    }
+    if (type === 0x626f6f6c) {
+        return desc.booleanValue ? "true" : "false";
+    }
+    return "";
+}
+
+function run() {
+    // パイプの読み込みがUTF-8の多バイト文字の途中で区切られても壊れないよう、バイト列のまま行に分割してからデコードする
+    var buffer = $.NSMutableData.data;
+    var newline = $("\n").dataUsingEncoding($.NSUTF8StringEncoding);
+    while (true) {
+        var data = stdin.availableData;
+        if (data.length === 0) {
+            break;
+        }
+        buffer.appendData(data);
+        var found;
+        while ((found = buffer.rangeOfDataOptionsRange(newline, 0, $.NSMakeRange(0, buffer.length))).length > 0) {
+            var lineData = buffer.subdataWithRange($.NSMakeRange(0, found.location));
+            buffer = $.NSMutableData.dataWithData(
+                buffer.subdataWithRange($.NSMakeRange(found.location + 1, buffer.length - found.location - 1))
+            );
+            if (lineData.length === 0) {
+                continue;
+            }
+            var text = $.NSString.alloc.initWithDataEncoding(lineData, $.NSUTF8StringEncoding);
+            if (text.isNil()) {
+                // 応答のIDが一致しないため、呼び出し元はタイムアウトを待たずに失敗として扱う
+                reply({id: null, stdout: "", stderr: "invalid UTF-8 request", returncode: 1});
+                continue;
+            }
+            var request = JSON.parse(text.js);
+            var error = Ref();
+            var result = $.NSAppleScript.alloc.initWithSource(request.script).executeAndReturnError(error);
+            if (result.isNil()) {
+                var info = ObjC.deepUnwrap(error[0]) || {};
+                reply({id: request.id, stdout: "", stderr: String(info.NSAppleScriptErrorMessage || "AppleScript error"), returncode: 1});
+            } else {
+                reply({id: request.id, stdout: describe(result), stderr: "", returncode: 0});
+            }
+        }
+    }
+}
+'''
+
+def _escape_applescript_string(text: str) -> str:
+    """AppleScriptの文字列リテラルに埋め込めるようにエスケープする
+    
+    Args:
+        text: エスケープする文字列
+        
+    Returns:
+        エスケープされた文字列
+    """
+    # バックスラッシュを最初に処理する（str.translateより連続したreplaceの方が高速）
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+
+
+# 常駐osascriptの応答1行あたりの最大サイズ（バイト）
+OSASCRIPT_READ_LIMIT = 16 * 1024 * 1024
+
+def _create_temp_path(format: str) -> str:
+    """Photoshopがサムネイルを保存する一時ファイルを作成し、そのパスを返す
+    
+    Args:
+        format: 出力形式（拡張子に使用）
+        
+    Returns:
+        一時ファイルのパス
+    """
+    fd, temp_path = tempfile.mkstemp(suffix=f".{format}")
+    os.close(fd)
+    return temp_path
+
+
+# ドキュメント情報をJSON文字列で返すJavaScript（AppleScriptの文字列リテラルに埋め込むため二重引用符は使わない）
+_DOCUMENT_INFO_JS = (
+    "app.documents.length ? JSON.stringify({"
+    "name: app.activeDocument.name, "
+    "width: app.activeDocument.width.value, "
+    "height: app.activeDocument.height.value, "
+    "resolution: app.activeDocument.resolution"
+    "}) : 'null'"
+)
+
+# レイヤーをエクスポートするJavaScriptのテンプレート（文字列はJSONリテラルで埋め込む）
+_EXPORT_LAYER_JS_TEMPLATE = Template('''
+// レイヤーの表示状態をActionManagerで一括して切り替える
+function setLayersVisible(layers, visible) {
+    if (layers.length === 0) {
+        return;
+    }
+    var list = new ActionList();
+    for (var i = 0; i < layers.length; i++) {
+        var ref = new ActionReference();
+        ref.putIdentifier(charIDToTypeID("Lyr "), layers[i].id);
+        list.putReference(ref);
+    }
+    var desc = new ActionDescriptor();
+    desc.putList(charIDToTypeID("null"), list);
+    executeAction(charIDToTypeID(visible ? "Shw " : "Hd  "), desc, DialogModes.NO);
+}
+
+function exportLayer() {
+    var doc = app.activeDocument;
+
+    // レイヤーを名前で検索
+    var target;
+    try {
+        target = doc.layers.getByName(${layer_literal});
+    } catch (e) {
+        return false;
+    }
+
+    // 表示中の他のレイヤーを記録して非表示にする
+    var hiddenLayers = [];
+    for (var j = 0; j < doc.layers.length; j++) {
+        var layer = doc.layers[j];
+        if (layer.id !== target.id && layer.visible) {
+            hiddenLayers.push(layer);
+        }
+    }
+    var targetVisible = target.visible;
+
+    try {
+        setLayersVisible(hiddenLayers, false);
+
+        // 対象レイヤーを表示
+        target.visible = true;
+
+        // エクスポート設定
+        var saveOptions;
+        ${save_options}
+
+        // ファイル保存
+        var fileObj = new File(${export_literal});
+        doc.saveAs(fileObj, saveOptions, true);
+    } finally {
+        // レイヤーの表示状態を元に戻す
+        target.visible = targetVisible;
+        setLayersVisible(hiddenLayers, true);
+    }
+
+    return true;
+}
+
+exportLayer();
+''')
+
+# PNGの保存オプション（JavaScriptの文）
+_PNG_SAVE_OPTIONS_JS = ("saveOptions = new PNGSaveOptions();", "saveOptions.compression = 0;", "saveOptions.interlaced = false;")
+
+# レイヤーのエクスポート形式ごとの保存オプション（JavaScriptの文）
+_EXPORT_JPEG_SAVE_OPTIONS_JS = ("saveOptions = new JPEGSaveOptions();", "saveOptions.quality = 12;", "saveOptions.embedColorProfile = true;")
+_EXPORT_SAVE_OPTIONS_JS = MappingProxyType({
+    "png": _PNG_SAVE_OPTIONS_JS,
+    "jpeg": _EXPORT_JPEG_SAVE_OPTIONS_JS,
+    "jpg": _EXPORT_JPEG_SAVE_OPTIONS_JS,
+    "psd": ("saveOptions = new PhotoshopSaveOptions();", "saveOptions.embedColorProfile = true;"),
+})
+# 対応していない形式はPNGで保存する
+_EXPORT_DEFAULT_SAVE_OPTIONS_JS = ("saveOptions = new PNGSaveOptions();",)
+
+# サムネイルの形式ごとの保存オプション（JavaScriptの文、${quality}は画質に置換する）
+_THUMBNAIL_JPEG_SAVE_OPTIONS_JS = (
+    "saveOptions = new JPEGSaveOptions();",
+    "saveOptions.quality = ${quality};",
+    "saveOptions.embedColorProfile = true;",
+    "saveOptions.formatOptions = FormatOptions.STANDARDBASELINE;",
+    "saveOptions.matte = MatteType.NONE;",
+)
+_THUMBNAIL_SAVE_OPTIONS_JS = MappingProxyType({
+    "jpeg": _THUMBNAIL_JPEG_SAVE_OPTIONS_JS,
+    "jpg": _THUMBNAIL_JPEG_SAVE_OPTIONS_JS,
+    "png": _PNG_SAVE_OPTIONS_JS,
+})
+# 対応していない形式はJPEGで保存する
+_THUMBNAIL_DEFAULT_SAVE_OPTIONS_JS = ("saveOptions = new JPEGSaveOptions();", "saveOptions.quality = ${quality};")
+
+
+def _save_options_js(table: Mapping[str, Tuple[str, ...]], default: Tuple[str, ...], format: str, indent: str) -> str:
+    """形式に対応する保存オプションのJavaScriptを、テンプレートの埋め込み位置に合わせて連結する
+    
+    Args:
+        table: 形式ごとの保存オプション
+        default: 対応していない形式の保存オプション
+        format: 出力形式
+        indent: 2行目以降のインデント
+        
+    Returns:
+        保存オプションを設定するJavaScript
+    """
+    return ("\n" + indent).join(table.get(format.lower(), default))
+
+
+# ファイルを開いてサムネイルを保存するJavaScriptのテンプレート（文字列はJSONリテラルで埋め込む）
+_THUMBNAIL_JS_TEMPLATE = Template('''
+function generateThumbnail() {
+    // ファイルを開く
+    var doc = app.open(new File(${path_literal}));
+
+    // ドキュメントのサイズを取得
+    var originalWidth = doc.width.value;
+    var originalHeight = doc.height.value;
+
+    // アスペクト比を維持したサイズを計算
+    var ratio = Math.min(${width} / originalWidth, ${height} / originalHeight);
+    var newWidth = Math.round(originalWidth * ratio);
+    var newHeight = Math.round(originalHeight * ratio);
+
+    // 複製して新しいサイズにリサイズ
+    var docCopy = doc.duplicate();
+    docCopy.resizeImage(UnitValue(newWidth, "px"), UnitValue(newHeight, "px"), null, ResampleMethod.BICUBIC);
+
+    // 保存オプションを設定
+    var saveOptions;
+    ${save_options}
+
+    // ファイル保存
+    var fileObj = new File(${temp_literal});
+    docCopy.saveAs(fileObj, saveOptions, true);
+
+    // 複製を閉じる
+    docCopy.close(SaveOptions.DONOTSAVECHANGES);
+
+    return {
+        width: newWidth,
+        height: newHeight
+    };
+}
+
+JSON.stringify(generateThumbnail());
+''')
+
+# バッチでPillowによるサムネイル生成を同時に行う最大数
+THUMBNAIL_BATCH_CONCURRENCY = os.cpu_count() or 4
+
+# 読み取り専用スクリプトの実行結果をキャッシュする最大件数
+SCRIPT_RESULT_CACHE_SIZE = 64
+
+# ドキュメント情報のキャッシュの有効期間（秒、Photoshop上での直接の編集を反映するまでの最大遅延）
+DOC_INFO_CACHE_TTL = 2.0
 
 class AppleScriptBridge(PhotoshopBridge):
     """AppleScriptを使用してPhotoshopと通信するブリッジ"""
     
-    def __init__(self):
+    def __init__(self, persistent: bool = True):
+        """
+        初期化
+        
+        Args:
+            persistent: osascriptを常駐させて呼び出しごとのプロセス起動を省略するかどうか
+        """
         self.app_name = "Adobe Photoshop 2024"  # デフォルトのアプリケーション名
+        self.persistent = persistent
+        self._osascript: Optional[asyncio.subprocess.Process] = None
+        self._osascript_lock: Optional[asyncio.Lock] = None
+        self._osascript_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._request_id = 0
+        # 現在の常駐osascriptが一度でも応答したかどうか
+        self._osascript_answered = False
+        # ドキュメント情報のキャッシュ（ドキュメントを変更し得る操作で破棄する）
+        self._doc_info_cache: Optional[Dict[str, Any]] = None
+        self._doc_info_expires = 0.0
+        # 読み取り専用スクリプトの実行結果のキャッシュ（スクリプトのハッシュ -> (有効期限, 出力)）
+        self._result_cache: "OrderedDict[bytes, Tuple[float, str]]" = OrderedDict()
+    
+    async def __aenter__(self) -> "AppleScriptBridge":
+        return self
+    
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
     
     def as_quote(self, path: str) -> str:
         """POSIXパスをAppleScript用にクォートする"""
-        return f'POSIX file "{path}"'
+        return f'POSIX file "{_escape_applescript_string(path)}"'
     
     async def _run_applescript(self, script: str) -> tuple[str, str, int]:
         """AppleScriptを実行し、結果を返す"""
+        if self.persistent:
+            try:
+                return await self._run_applescript_persistent(script)
+            except OSError as e:
+                # 常駐プロセスを起動できない環境では呼び出しごとにosascriptを起動する
+                logger.warning(f"常駐osascriptを起動できないため、呼び出しごとに起動します: {e}")
+                self.persistent = False
+        return await self._run_applescript_once(script)
+    
+    async def _run_applescript_once(self, script: str) -> tuple[str, str, int]:
+        """osascriptを起動してAppleScriptを実行し、結果を返す"""
         proc = await asyncio.create_subprocess_exec(
             "/usr/bin/osascript", "-e", script,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE
         )
         stdout, stderr = await proc.communicate()
-        return stdout.decode().strip(), stderr.decode().strip(), proc.returncode
+        # 呼び出し元は失敗時にのみstderrを参照するため、成功時はデコードしない（常駐osascriptの応答と同じく空文字列）
+        if proc.returncode != 0:
+            return stdout.decode().strip(), stderr.decode().strip(), proc.returncode
+        return stdout.decode().strip(), "", proc.returncode
+    
+    async def _ensure_osascript(self) -> asyncio.subprocess.Process:
+        """
+        常駐osascriptを取得（未起動・終了済みの場合は起動する）
+        
+        呼び出し元で_osascript_lockを保持していること。
+        
+        Returns:
+            osascriptのプロセス
+        """
+        if self._osascript is None or self._osascript.returncode is not None:
+            self._osascript = await asyncio.create_subprocess_exec(
+                "/usr/bin/osascript", "-l", "JavaScript", "-e", _OSASCRIPT_SERVER_JS,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+                limit=OSASCRIPT_READ_LIMIT
+            )
+            self._osascript_answered = False
+            logger.debug(f"常駐osascriptを起動しました (pid: {self._osascript.pid})")
+        return self._osascript
+    
+    async def _run_applescript_persistent(self, script: str) -> tuple[str, str, int]:
+        """常駐osascriptでAppleScriptを実行し、結果を返す"""
+        loop = asyncio.get_running_loop()
+        if self._osascript_loop is not loop:
+            # プロセスとロックは作成したイベントループに紐づくため、ループが変わったら作り直す
+            if self._osascript is not None and self._osascript.returncode is None:
+                self._osascript.kill()
+            self._osascript = None
+            self._osascript_lock = asyncio.Lock()
+            self._osascript_loop = loop
+        
+        async with self._osascript_lock:
+            proc = await self._ensure_osascript()
+            self._request_id += 1
+            request_id = self._request_id
+            try:
+                proc.stdin.write(json.dumps({"id": request_id, "script": script}).encode("utf-8") + b"\n")
+                await proc.stdin.drain()
+                line = await proc.stdout.readline()
+            except (ConnectionError, ValueError) as e:
+                line = b""
+                logger.warning(f"常駐osascriptとの通信に失敗しました: {e}")
+            
+            if not line:
+                answered = self._osascript_answered
+                await self._terminate_osascript()
+                if not answered:
+                    # 一度も応答せずに終了した場合は常駐プログラム自体が動作していないため、呼び出しごとの起動に切り替える
+                    logger.warning("常駐osascriptが応答しないため、呼び出しごとに起動します")
+                    self.persistent = False
+                    return await self._run_applescript_once(script)
+                # 途中で終了した場合は次の呼び出しで起動し直す
+                return "", "osascript process exited unexpectedly", 1
+            
+            self._osascript_answered = True
+            response = _json_loads(line)
+            if response.get("id") != request_id:
+                await self._terminate_osascript()
+                return "", "osascript response out of sync", 1
+            return response["stdout"].strip(), response["stderr"].strip(), response["returncode"]
+    
+    async def _terminate_osascript(self) -> None:
+        """常駐osascriptを終了する"""
+        proc, self._osascript = self._osascript, None
+        if proc is None or proc.returncode is not None:
+            return
+        # 標準入力を閉じると常駐プログラムのループが終了する
+        proc.stdin.close()
+        try:
+            await asyncio.wait_for(proc.wait(), timeout=2)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+    
+    def _invalidate_caches(self) -> None:
+        """キャッシュ済みのドキュメント情報とスクリプトの実行結果を破棄する"""
+        self._doc_info_cache = None
+        self._result_cache.clear()
+    
+    async def close(self) -> None:
+        """常駐osascriptを終了する"""
+        if self._osascript_loop is asyncio.get_running_loop():
+            await self._terminate_osascript()
+        elif self._osascript is not None and self._osascript.returncode is None:
+            self._osascript.kill()
+            self._osascript = None
     
     async def open_file(self, path: str) -> bool:
         """ファイルを開く"""
+        self._invalidate_caches()
         script = f'''
             tell application "{self.app_name}"
                 activate
@@ -35,56 +450,97 @@ class AppleScriptBridge(PhotoshopBridge):
         _, _, returncode = await self._run_applescript(script)
         return returncode == 0
     
-    async def execute_script(self, script: str) -> Any:
-        """JavaScriptを実行する"""
-        # バックスラッシュの問題を回避するために文字列を分割
-        escaped_script = script.replace('"', '\\"')
-        applescript = f'''
-            tell application "{self.app_name}"
-                activate
-                do javascript "{escaped_script}"
-            end tell
-        '''
-        stdout, stderr, returncode = await self._run_applescript(applescript)
-        if returncode != 0:
-            raise RuntimeError(f"Script execution failed: {stderr}")
+    async def _run_js(self, js: str, expect_json: bool = False, cache_ttl: float = 0.0) -> Any:
+        """JavaScriptを1回のosascript呼び出し（do javascript）で実行し、結果を返す
+        
+        Args:
+            js: 実行するJavaScript
+            expect_json: 結果が必ずJSONになるスクリプトの場合はTrue（パースできなければ例外を送出）
+            cache_ttl: 0より大きい場合、ドキュメントを変更しないスクリプトとして結果をこの秒数だけキャッシュする
+            
+        Returns:
+            JSONとしてパースした結果（expect_jsonがFalseでJSONでない場合は文字列）
+        """
+        stdout = None
+        cache_key = None
+        if cache_ttl > 0:
+            cache_key = hashlib.blake2b(js.encode("utf-8"), digest_size=16).digest()
+            entry = self._result_cache.get(cache_key)
+            if entry is not None and time.monotonic() < entry[0]:
+                self._result_cache.move_to_end(cache_key)
+                stdout = entry[1]
+        else:
+            # スクリプトでドキュメントが変更される可能性があるため、キャッシュを破棄する
+            self._invalidate_caches()
+        
+        if stdout is None:
+            # AppleScriptの文字列リテラルに埋め込むため、バックスラッシュ・二重引用符・改行をエスケープ
+            escaped_js = _escape_applescript_string(js)
+            applescript = f'''
+                tell application "{self.app_name}"
+                    activate
+                    do javascript "{escaped_js}"
+                end tell
+            '''
+            stdout, stderr, returncode = await self._run_applescript(applescript)
+            if returncode != 0:
+                raise RuntimeError(f"Script execution failed: {stderr}")
+            
+            if cache_key is not None:
+                # 結果は出力文字列のまま保持し、呼び出し元ごとに別のオブジェクトとしてパースする
+                self._result_cache[cache_key] = (time.monotonic() + cache_ttl, stdout)
+                self._result_cache.move_to_end(cache_key)
+                while len(self._result_cache) > SCRIPT_RESULT_CACHE_SIZE:
+                    self._result_cache.popitem(last=False)
+        
+        # JSONを返すスクリプトはそのままパースする（失敗した場合はJSONDecodeErrorを送出）
+        if expect_json:
+            return _json_loads(stdout)
         
         # 結果をJSONとしてパースしてみる
         try:
-            return json.loads(stdout)
+            return _json_loads(stdout)
         except json.JSONDecodeError:
             # JSONでない場合は文字列として返す
             return stdout
     
+    async def execute_script(self, script: str, *, expect_json: bool = False, cache_ttl: float = 0.0) -> Any:
+        """JavaScriptを実行する
+        
+        Args:
+            script: 実行するJavaScript
+            expect_json: 結果が必ずJSONになるスクリプトの場合はTrue（パースできなければ例外を送出）
+            cache_ttl: ドキュメントを変更しないスクリプトの場合、同じスクリプトの結果をこの秒数だけ再利用する
+            
+        Returns:
+            スクリプトの実行結果
+        """
+        return await self._run_js(script, expect_json=expect_json, cache_ttl=cache_ttl)
+    
     async def get_document_info(self) -> Optional[Dict[str, Any]]:
         """現在のドキュメント情報を取得する"""
-        script = f'''
-            tell application "{self.app_name}"
-                if not (exists document 1) then
-                    return "null"
-                end if
-                
-                set docInfo to {{}}
-                set docInfo to docInfo & "{{\\\"name\\\": \\\"" & name of document 1 & "\\\""
-                set docInfo to docInfo & ", \\\"width\\\": " & width of document 1
-                set docInfo to docInfo & ", \\\"height\\\": " & height of document 1
-                set docInfo to docInfo & ", \\\"resolution\\\": " & resolution of document 1
-                set docInfo to docInfo & "}}"
-                
-                return docInfo
-            end tell
-        '''
+        # 直前に取得した情報がまだ有効であればAppleEventを送らずに返す
+        if self._doc_info_cache is not None and time.monotonic() < self._doc_info_expires:
+            return dict(self._doc_info_cache)
+        
+        # JSONはPhotoshopのJavaScriptエンジンで一度に組み立てる
+        script = f'tell application "{self.app_name}" to return do javascript "{_DOCUMENT_INFO_JS}"'
         stdout, _, returncode = await self._run_applescript(script)
         if returncode != 0 or stdout == "null":
             return None
         
         try:
-            return json.loads(stdout)
+            info = _json_loads(stdout)
         except json.JSONDecodeError:
             raise RuntimeError(f"Failed to parse document info: {stdout}")
+        
+        self._doc_info_cache = info
+        self._doc_info_expires = time.monotonic() + DOC_INFO_CACHE_TTL
+        return dict(info)
     
     async def close_file(self, save_changes: bool = False) -> bool:
         """ファイルを閉じる"""
+        self._invalidate_caches()
         save_option = "saving yes" if save_changes else "saving no"
         script = f'''
             tell application "{self.app_name}"
@@ -102,6 +558,7 @@ class AppleScriptBridge(PhotoshopBridge):
     
     async def save_file(self, path: str = None) -> bool:
         """ファイルを保存する"""
+        self._invalidate_caches()
         if path:
             # 指定されたパスに保存
             script = f'''
@@ -133,75 +590,24 @@ class AppleScriptBridge(PhotoshopBridge):
     async def export_layer(self, layer_name: str, export_path: str, format: str = "PNG") -> bool:
         """レイヤーをエクスポートする"""
         # JavaScriptを使用してレイヤーをエクスポート
-        js_script = f'''
-        function exportLayer() {{
-            var doc = app.activeDocument;
-            var layerFound = false;
-            
-            // レイヤーを検索
-            for (var i = 0; i < doc.layers.length; i++) {{
-                if (doc.layers[i].name === "{layer_name}") {{
-                    layerFound = true;
-                    
-                    // 他のレイヤーを非表示にする
-                    var visibilityState = [];
-                    for (var j = 0; j < doc.layers.length; j++) {{
-                        visibilityState.push(doc.layers[j].visible);
-                        doc.layers[j].visible = false;
-                    }}
-                    
-                    // 対象レイヤーを表示
-                    doc.layers[i].visible = true;
-                    
-                    // エクスポート設定
-                    var saveOptions;
-                    var format = "{format}".toLowerCase();
-                    
-                    if (format === "png") {{
-                        saveOptions = new PNGSaveOptions();
-                        saveOptions.compression = 0;
-                        saveOptions.interlaced = false;
-                    }} else if (format === "jpeg" || format === "jpg") {{
-                        saveOptions = new JPEGSaveOptions();
-                        saveOptions.quality = 12;
-                        saveOptions.embedColorProfile = true;
-                    }} else if (format === "psd") {{
-                        saveOptions = new PhotoshopSaveOptions();
-                        saveOptions.embedColorProfile = true;
-                    }} else {{
-                        // デフォルトはPNG
-                        saveOptions = new PNGSaveOptions();
-                    }}
-                    
-                    // ファイル保存
-                    var fileObj = new File("{export_path}");
-                    doc.saveAs(fileObj, saveOptions, true);
-                    
-                    // レイヤーの表示状態を元に戻す
-                    for (var j = 0; j < doc.layers.length; j++) {{
-                        doc.layers[j].visible = visibilityState[j];
-                    }}
-                    
-                    return true;
-                }}
-            }}
-            
-            return layerFound;
-        }}
-        
-        exportLayer();
-        '''
+        # 文字列はJSONでエスケープしてJavaScriptの文字列リテラルにし、保存オプションは形式に対応する文だけを埋め込む
+        js_script = _EXPORT_LAYER_JS_TEMPLATE.substitute(
+            layer_literal=json.dumps(layer_name),
+            save_options=_save_options_js(_EXPORT_SAVE_OPTIONS_JS, _EXPORT_DEFAULT_SAVE_OPTIONS_JS, format, "        "),
+            export_literal=json.dumps(export_path)
+        )
         
         # JavaScriptを実行
         try:
-            result = await self.execute_script(js_script)
+            result = await self.execute_script(js_script, expect_json=True)
             return result is True
         except Exception as e:
-            print(f"Error exporting layer: {e}")
+            logger.error(f"Error exporting layer: {e}")
             return False
     
     async def run_action(self, action_set: str, action_name: str) -> bool:
         """アクションを実行する"""
+        self._invalidate_caches()
         script = f'''
             tell application "{self.app_name}"
                 if not (exists document 1) then
@@ -214,11 +620,35 @@ class AppleScriptBridge(PhotoshopBridge):
         
         stdout, stderr, returncode = await self._run_applescript(script)
         if returncode != 0:
-            print(f"Error running action: {stderr}")
+            logger.error(f"Error running action: {stderr}")
             return False
         return stdout.lower() == "true"
     
-    async def generate_thumbnail(self, path: str, width: int = 256, height: int = 256, format: str = "jpeg", quality: int = 80) -> dict:
+    def _thumbnail_js(self, path: str, temp_path: str, width: int, height: int, format: str, quality: int) -> str:
+        """ファイルを開いてサムネイルを保存するまでを1つにまとめたJavaScriptを構築する
+        
+        Args:
+            path: サムネイルを生成するファイルのパス
+            temp_path: サムネイルの保存先
+            width: サムネイルの幅
+            height: サムネイルの高さ
+            format: 出力形式（jpeg, png）
+            quality: 画質（0-100）
+            
+        Returns:
+            サムネイルのサイズをJSON文字列で返すJavaScript
+        """
+        # パスはJSONでエスケープしてJavaScriptの文字列リテラルにし、保存オプションは形式に対応する文だけを埋め込む
+        save_options = _save_options_js(_THUMBNAIL_SAVE_OPTIONS_JS, _THUMBNAIL_DEFAULT_SAVE_OPTIONS_JS, format, "    ")
+        return _THUMBNAIL_JS_TEMPLATE.substitute(
+            path_literal=json.dumps(normalize_path(path)),
+            temp_literal=json.dumps(temp_path),
+            save_options=Template(save_options).substitute(quality=quality),
+            width=width,
+            height=height
+        )
+    
+    async def generate_thumbnail(self, path: str, width: int = 256, height: int = 256, format: str = "jpeg", quality: int = 80, return_bytes: bool = False) -> dict:
         """サムネイルを生成する
         
         Args:
@@ -227,88 +657,29 @@ class AppleScriptBridge(PhotoshopBridge):
             height: サムネイルの高さ
             format: 出力形式（jpeg, png）
             quality: 画質（0-100）
+            return_bytes: thumbnailをBase64文字列ではなく画像のバイト列で返すかどうか
             
         Returns:
             サムネイル情報（status, thumbnail, width, height, format）
         """
-        import tempfile
-        import base64
-        import os
-        from PIL import Image
-        
-        # 一時ファイルを作成
-        with tempfile.NamedTemporaryFile(suffix=f".{format}", delete=False) as temp_file:
-            temp_path = temp_file.name
+        # Photoshopで生成する場合のみ一時ファイルを使用する
+        temp_path = None
         
         try:
-            # ファイルを開く
-            if not await self.open_file(path):
-                raise RuntimeError(f"Failed to open file: {path}")
-            
-            # JavaScriptを使用してサムネイルを生成
-            js_script = f'''
-            function generateThumbnail() {{
-                var doc = app.activeDocument;
-                
-                // ドキュメントのサイズを取得
-                var originalWidth = doc.width.value;
-                var originalHeight = doc.height.value;
-                
-                // アスペクト比を維持したサイズを計算
-                var ratio = Math.min({width} / originalWidth, {height} / originalHeight);
-                var newWidth = Math.round(originalWidth * ratio);
-                var newHeight = Math.round(originalHeight * ratio);
-                
-                // 複製して新しいサイズにリサイズ
-                var docCopy = doc.duplicate();
-                docCopy.resizeImage(UnitValue(newWidth, "px"), UnitValue(newHeight, "px"), null, ResampleMethod.BICUBIC);
+            # 保存済みの画像はPhotoshopを経由せず、メモリ上で縮小する
+            thumbnail = await asyncio.to_thread(pillow_thumbnail, path, width, height, format, quality, return_bytes)
+            if thumbnail is not None:
+                thumbnail_data, thumbnail_width, thumbnail_height = thumbnail
+                result = {"width": thumbnail_width, "height": thumbnail_height}
+            else:
+                temp_path = _create_temp_path(format)
                 
-                // 保存オプションを設定
-                var saveOptions;
-                var format = "{format}".toLowerCase();
+                # ファイルを開く処理も含めたJavaScriptを1回のosascript呼び出しで実行
+                js_script = self._thumbnail_js(path, temp_path, width, height, format, quality)
+                result = await self._run_js(js_script, expect_json=True)
                 
-                if (format === "jpeg" || format === "jpg") {{
-                    saveOptions = new JPEGSaveOptions();
-                    saveOptions.quality = {quality};
-                    saveOptions.embedColorProfile = true;
-                    saveOptions.formatOptions = FormatOptions.STANDARDBASELINE;
-                    saveOptions.matte = MatteType.NONE;
-                }} else if (format === "png") {{
-                    saveOptions = new PNGSaveOptions();
-                    saveOptions.compression = 0;
-                    saveOptions.interlaced = false;
-                }} else {{
-                    // デフォルトはJPEG
-                    saveOptions = new JPEGSaveOptions();
-                    saveOptions.quality = {quality};
-                }}
-                
-                // ファイル保存
-                var fileObj = new File("{temp_path}");
-                docCopy.saveAs(fileObj, saveOptions, true);
-                
-                // 複製を閉じる
-                docCopy.close(SaveOptions.DONOTSAVECHANGES);
-                
-                return {{
-                    width: newWidth,
-                    height: newHeight
-                }};
-            }}
-            
-            JSON.stringify(generateThumbnail());
-            '''
-            
-            # JavaScriptを実行
-            result = await self.execute_script(js_script)
-            
-            # 結果がJSONでない場合はエラー
-            if not isinstance(result, dict):
-                raise RuntimeError("Failed to generate thumbnail")
-            
-            # 画像ファイルを読み込み、Base64エンコード
-            with open(temp_path, "rb") as img_file:
-                thumbnail_data = base64.b64encode(img_file.read()).decode("utf-8")
+                # 画像ファイルを読み込む（return_bytesでない場合はチャンク単位でBase64エンコード）
+                thumbnail_data = read_image_file(temp_path, return_bytes)
             
             return {
                 "status": "ok",
@@ -322,10 +693,10 @@ class AppleScriptBridge(PhotoshopBridge):
             raise RuntimeError(f"Error generating thumbnail: {e}")
         finally:
             # 一時ファイルを削除
-            if os.path.exists(temp_path):
+            if temp_path is not None and os.path.exists(temp_path):
                 os.remove(temp_path)
                 
-    async def generate_thumbnail_stream(self, path: str, width: int = 256, height: int = 256, format: str = "jpeg", quality: int = 80, callback=None) -> dict:
+    async def generate_thumbnail_stream(self, path: str, width: int = 256, height: int = 256, format: str = "jpeg", quality: int = 80, callback=None, return_bytes: bool = False) -> dict:
         """サムネイルを生成し、進捗状況をコールバックで通知する
         
         Args:
@@ -335,19 +706,13 @@ class AppleScriptBridge(PhotoshopBridge):
             format: 出力形式（jpeg, png）
             quality: 画質（0-100）
             callback: 進捗状況を通知するコールバック関数
+            return_bytes: thumbnailをBase64文字列ではなく画像のバイト列で返すかどうか
             
         Returns:
             サムネイル情報（status, thumbnail, width, height, format）
         """
-        import tempfile
-        import base64
-        import os
-        import time
-        from PIL import Image
-        
-        # 一時ファイルを作成
-        with tempfile.NamedTemporaryFile(suffix=f".{format}", delete=False) as temp_file:
-            temp_path = temp_file.name
+        # Photoshopで生成する場合のみ一時ファイルを使用する
+        temp_path = None
         
         try:
             # 開始通知
@@ -373,16 +738,6 @@ class AppleScriptBridge(PhotoshopBridge):
                     }
                 })
                 
-            if not await self.open_file(path):
-                if callback:
-                    await callback({
-                        "type": "error",
-                        "data": {
-                            "message": f"Failed to open file: {path}"
-                        }
-                    })
-                raise RuntimeError(f"Failed to open file: {path}")
-            
             # JavaScriptを使用してサムネイルを生成
             if callback:
                 await callback({
@@ -394,96 +749,40 @@ class AppleScriptBridge(PhotoshopBridge):
                     }
                 })
                 
-            js_script = f'''
-            function generateThumbnail() {{
-                var doc = app.activeDocument;
-                
-                // ドキュメントのサイズを取得
-                var originalWidth = doc.width.value;
-                var originalHeight = doc.height.value;
-                
-                // アスペクト比を維持したサイズを計算
-                var ratio = Math.min({width} / originalWidth, {height} / originalHeight);
-                var newWidth = Math.round(originalWidth * ratio);
-                var newHeight = Math.round(originalHeight * ratio);
-                
-                // 複製して新しいサイズにリサイズ
-                var docCopy = doc.duplicate();
-                docCopy.resizeImage(UnitValue(newWidth, "px"), UnitValue(newHeight, "px"), null, ResampleMethod.BICUBIC);
-                
-                // 保存オプションを設定
-                var saveOptions;
-                var format = "{format}".toLowerCase();
+            # 保存済みの画像はPhotoshopを経由せず、メモリ上で縮小する
+            thumbnail = await asyncio.to_thread(pillow_thumbnail, path, width, height, format, quality, return_bytes)
+            if thumbnail is not None:
+                thumbnail_data, thumbnail_width, thumbnail_height = thumbnail
+                result = {"width": thumbnail_width, "height": thumbnail_height}
+            else:
+                temp_path = _create_temp_path(format)
+                js_script = self._thumbnail_js(path, temp_path, width, height, format, quality)
                 
-                if (format === "jpeg" || format === "jpg") {{
-                    saveOptions = new JPEGSaveOptions();
-                    saveOptions.quality = {quality};
-                    saveOptions.embedColorProfile = true;
-                    saveOptions.formatOptions = FormatOptions.STANDARDBASELINE;
-                    saveOptions.matte = MatteType.NONE;
-                }} else if (format === "png") {{
-                    saveOptions = new PNGSaveOptions();
-                    saveOptions.compression = 0;
-                    saveOptions.interlaced = false;
-                }} else {{
-                    // デフォルトはJPEG
-                    saveOptions = new JPEGSaveOptions();
-                    saveOptions.quality = {quality};
-                }}
-                
-                // ファイル保存
-                var fileObj = new File("{temp_path}");
-                docCopy.saveAs(fileObj, saveOptions, true);
-                
-                // 複製を閉じる
-                docCopy.close(SaveOptions.DONOTSAVECHANGES);
-                
-                return {{
-                    width: newWidth,
-                    height: newHeight
-                }};
-            }}
-            
-            JSON.stringify(generateThumbnail());
-            '''
-            
-            # JavaScriptを実行
-            if callback:
-                await callback({
-                    "type": "progress",
-                    "data": {
-                        "step": "executing_script",
-                        "progress": 50,
-                        "message": "スクリプトを実行しています..."
-                    }
-                })
-                
-            result = await self.execute_script(js_script)
-            
-            # 結果がJSONでない場合はエラー
-            if not isinstance(result, dict):
+                # ファイルを開く処理も含めたJavaScriptを1回のosascript呼び出しで実行
                 if callback:
                     await callback({
-                        "type": "error",
+                        "type": "progress",
                         "data": {
-                            "message": "Failed to generate thumbnail"
+                            "step": "executing_script",
+                            "progress": 50,
+                            "message": "スクリプトを実行しています..."
                         }
                     })
-                raise RuntimeError("Failed to generate thumbnail")
-            
-            # 画像ファイルを読み込み、Base64エンコード
-            if callback:
-                await callback({
-                    "type": "progress",
-                    "data": {
-                        "step": "encoding_image",
-                        "progress": 80,
-                        "message": "画像をエンコードしています..."
-                    }
-                })
+                    
+                result = await self._run_js(js_script, expect_json=True)
                 
-            with open(temp_path, "rb") as img_file:
-                thumbnail_data = base64.b64encode(img_file.read()).decode("utf-8")
+                # 画像ファイルを読み込む（return_bytesでない場合はBase64エンコード）
+                if callback:
+                    await callback({
+                        "type": "progress",
+                        "data": {
+                            "step": "encoding_image",
+                            "progress": 80,
+                            "message": "画像をエンコードしています..."
+                        }
+                    })
+                    
+                thumbnail_data = read_image_file(temp_path, return_bytes)
             
             # 完了通知
             response = {
@@ -517,5 +816,42 @@ class AppleScriptBridge(PhotoshopBridge):
             raise RuntimeError(f"Error generating thumbnail: {e}")
         finally:
             # 一時ファイルを削除
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
\ No newline at end of file
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    async def generate_thumbnails_batch(self, paths: List[str], width: int = 256, height: int = 256, format: str = "jpeg", quality: int = 80, concurrency: int = THUMBNAIL_BATCH_CONCURRENCY) -> List[dict]:
+        """複数のファイルのサムネイルを並列に生成する
+        
+        Pillowで処理できる画像はワーカースレッドで並列に縮小し、
+        PSDなどPhotoshopが必要なファイルは1件ずつ順番に処理する。
+        
+        Args:
+            paths: サムネイルを生成するファイルのパスのリスト
+            width: サムネイルの幅
+            height: サムネイルの高さ
+            format: 出力形式（jpeg, png）
+            quality: 画質（0-100）
+            concurrency: Pillowで同時に処理する最大数
+            
+        Returns:
+            pathsと同じ順序のサムネイル情報のリスト（失敗したファイルはstatusがerrorになる）
+        """
+        pillow_semaphore = asyncio.Semaphore(max(1, concurrency))
+        # Photoshopは一度に1つのドキュメントしか処理しないため直列化する
+        photoshop_semaphore = asyncio.Semaphore(1)
+        
+        async def generate(path: str) -> dict:
+            if os.path.splitext(path)[1].lower() in PILLOW_THUMBNAIL_EXTENSIONS:
+                semaphore = pillow_semaphore
+            else:
+                semaphore = photoshop_semaphore
+            async with semaphore:
+                try:
+                    result = await self.generate_thumbnail(path, width, height, format, quality)
+                except Exception as e:
+                    logger.warning(f"サムネイルの生成に失敗しました: {path}: {e}")
+                    return {"status": "error", "path": path, "message": str(e)}
+            result["path"] = path
+            return result
+        
+        return list(await asyncio.gather(*(generate(path) for path in paths)))
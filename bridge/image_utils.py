@@ -0,0 +1,232 @@
+"""
+画像処理のユーティリティ
+
+このモジュールは、Photoshopを経由せずにPillowで画像を処理する関数を、
+各バックエンドで共通に使用できるよう提供します。
+"""
+
+import base64
+import io
+import logging
+import os
+import struct
+from typing import Optional, Tuple, Union
+
+logger = logging.getLogger('photoshop_mcp_server.bridge.image_utils')
+
+# Base64エンコード時に一度に読み込むサイズ（3の倍数にすることで途中にパディングが入らない）
+BASE64_CHUNK_SIZE = 57 * 1024
+
+
+def encode_file_base64(path: str) -> str:
+    """ファイルをチャンク単位でBase64エンコードする
+    
+    ファイル全体を読み込んでからエンコードせず、読み込んだ分から順に
+    事前に確保した出力バッファへエンコードするため、元のバイト列全体をメモリに保持しない。
+    
+    Args:
+        path: エンコードするファイルのパス
+        
+    Returns:
+        Base64エンコードされた文字列
+    """
+    with open(path, "rb") as f:
+        # 出力サイズはファイルサイズから決まるため、先に確保して再確保とコピーを避ける
+        size = os.fstat(f.fileno()).st_size
+        buf = bytearray(4 * ((size + 2) // 3))
+        # 読み込み用のバッファも使い回す
+        chunk = memoryview(bytearray(BASE64_CHUNK_SIZE))
+        pos = 0
+        while n := f.readinto(chunk):
+            encoded = base64.b64encode(chunk[:n])
+            buf[pos:pos + len(encoded)] = encoded
+            pos += len(encoded)
+    # 読み込み中にファイルが短くなった場合は実際に書き込んだ分だけを返す
+    del buf[pos:]
+    return buf.decode("ascii")
+
+
+def read_image_file(path: str, as_bytes: bool = False) -> Union[str, bytes]:
+    """画像ファイルをBase64文字列またはバイト列として読み込む
+    
+    Args:
+        path: 読み込むファイルのパス
+        as_bytes: Base64エンコードせず、ファイルのバイト列を返すかどうか
+        
+    Returns:
+        Base64エンコードされた文字列（as_bytesの場合はバイト列）
+    """
+    if as_bytes:
+        with open(path, "rb") as f:
+            return f.read()
+    return encode_file_base64(path)
+
+
+# Photoshopを経由せずPillowでサムネイルを生成する拡張子（レイヤー合成が必要なPSD/PSBは除く）
+PILLOW_THUMBNAIL_EXTENSIONS = frozenset({".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp", ".webp"})
+
+# 埋め込みサムネイルが十分な大きさであればPillowで処理する拡張子
+PSD_THUMBNAIL_EXTENSIONS = frozenset({".psd", ".psb"})
+
+# サムネイルを格納するイメージリソースのID（0x040CはPhotoshop 5.0以降、0x0409は4.0のBGR形式）
+_PSD_THUMBNAIL_RESOURCE_IDS = (0x040C, 0x0409)
+
+# イメージリソースとして扱うシグネチャ
+_PSD_RESOURCE_SIGNATURES = frozenset({b"8BIM", b"MeSa", b"AgHg", b"PHUT", b"DCSR"})
+
+
+def read_psd_thumbnail(path: str) -> Optional[Tuple[bytes, bool]]:
+    """PSD/PSBファイルのイメージリソースから埋め込みサムネイルのJPEGを取り出す
+    
+    レイヤーや画像データは読み込まず、ヘッダーとイメージリソースのセクションだけを読む。
+    
+    Args:
+        path: PSD/PSBファイルのパス
+        
+    Returns:
+        JPEGのバイト列と、チャンネルの並びがBGRかどうか（Photoshop 4.0形式）、
+        サムネイルがない場合はNone
+    """
+    try:
+        with open(path, "rb") as f:
+            header = f.read(26)
+            if len(header) < 26 or header[:4] != b"8BPS":
+                return None
+            # カラーモードデータのセクションを読み飛ばす
+            color_mode_length = struct.unpack(">I", f.read(4))[0]
+            f.seek(color_mode_length, os.SEEK_CUR)
+            resources_length = struct.unpack(">I", f.read(4))[0]
+            resources = f.read(resources_length)
+    except (OSError, struct.error) as e:
+        logger.debug(f"PSDのイメージリソースを読み込めません: {path}: {e}")
+        return None
+    
+    thumbnails = {}
+    offset = 0
+    while offset + 12 <= len(resources):
+        signature = resources[offset:offset + 4]
+        if signature not in _PSD_RESOURCE_SIGNATURES:
+            break
+        resource_id = struct.unpack_from(">H", resources, offset + 4)[0]
+        # 名前はパスカル文字列で、長さのバイトを含めて偶数バイトに揃えられる
+        name_length = resources[offset + 6]
+        offset += 6 + name_length + 1 + ((name_length + 1) % 2)
+        if offset + 4 > len(resources):
+            break
+        size = struct.unpack_from(">I", resources, offset)[0]
+        offset += 4
+        if resource_id in _PSD_THUMBNAIL_RESOURCE_IDS:
+            thumbnails[resource_id] = resources[offset:offset + size]
+        offset += size + (size % 2)
+    
+    for resource_id in _PSD_THUMBNAIL_RESOURCE_IDS:
+        data = thumbnails.get(resource_id)
+        # 先頭28バイトはサムネイルの情報で、形式が1（JPEG）の場合のみ扱う
+        if data is not None and len(data) > 28 and struct.unpack_from(">I", data)[0] == 1:
+            return data[28:], resource_id == 0x0409
+    return None
+
+
+def pillow_thumbnail(path: str, width: int, height: int, format: str, quality: int, as_bytes: bool = False) -> Optional[Tuple[Union[str, bytes], int, int]]:
+    """Pillowでサムネイルをメモリ上に生成する
+    
+    Photoshopでの生成と同じく、アスペクト比を維持してwidth×heightに収まるサイズに変換する。
+    一時ファイルは使用せず、エンコードした画像をそのままBase64文字列にする。
+    PSD/PSBは埋め込みサムネイルが要求サイズ以上の場合のみ、それを縮小して使用する。
+    
+    Args:
+        path: サムネイルを生成するファイルのパス
+        width: サムネイルの幅
+        height: サムネイルの高さ
+        format: 出力形式（jpeg, png）
+        quality: 画質（0-100）
+        as_bytes: Base64エンコードせず、画像のバイト列を返すかどうか
+        
+    Returns:
+        Base64エンコードされたサムネイル（as_bytesの場合はバイト列）と幅、高さ、Pillowで扱えない場合はNone
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in PILLOW_THUMBNAIL_EXTENSIONS and extension not in PSD_THUMBNAIL_EXTENSIONS:
+        return None
+    if not os.path.isfile(path):
+        return None
+    
+    from PIL import Image, ImageOps
+    
+    try:
+        if extension in PSD_THUMBNAIL_EXTENSIONS:
+            # PSD/PSBは埋め込みサムネイルが要求サイズ以上の場合のみ使用する
+            embedded = read_psd_thumbnail(path)
+            if embedded is None:
+                return None
+            jpeg_data, bgr = embedded
+            with Image.open(io.BytesIO(jpeg_data)) as image:
+                if min(width / image.width, height / image.height) > 1:
+                    logger.debug(f"埋め込みサムネイルが小さいためPhotoshopを使用します: {path}: {image.width}x{image.height}")
+                    return None
+                _draft_thumbnail(image, width, height)
+                image = image.convert("RGB")
+                if bgr:
+                    blue, green, red = image.split()
+                    image = Image.merge("RGB", (red, green, blue))
+                return _encode_thumbnail(image, width, height, format, quality, as_bytes)
+        
+        with Image.open(path) as image:
+            # exif_transposeで画素が読み込まれる前に、縮小デコードを指定する
+            _draft_thumbnail(image, width, height)
+            return _encode_thumbnail(ImageOps.exif_transpose(image), width, height, format, quality, as_bytes)
+    except (OSError, ValueError) as e:
+        logger.debug(f"Pillowでサムネイルを生成できないためPhotoshopを使用します: {path}: {e}")
+        return None
+
+
+def _draft_thumbnail(image, width: int, height: int) -> None:
+    """JPEGをwidth×heightのサムネイルに必要な大きさまで縮小してデコードするよう指定する
+    
+    画素を読み込む前（開いた直後）に呼び出す必要がある。
+    EXIFで90度回転する画像は、回転前の向きで必要な大きさを計算する。
+    
+    Args:
+        image: 開いた直後のPillowのImage
+        width: サムネイルの幅
+        height: サムネイルの高さ
+    """
+    # EXIFのOrientationが5〜8の場合はexif_transposeで幅と高さが入れ替わる
+    if image.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+        width, height = height, width
+    ratio = min(width / image.width, height / image.height)
+    if ratio < 1:
+        image.draft("RGB", (max(1, round(image.width * ratio)), max(1, round(image.height * ratio))))
+
+
+def _encode_thumbnail(image, width: int, height: int, format: str, quality: int, as_bytes: bool) -> Tuple[Union[str, bytes], int, int]:
+    """画像をwidth×heightに収まるよう縮小してエンコードする
+    
+    Args:
+        image: PillowのImage
+        width: サムネイルの幅
+        height: サムネイルの高さ
+        format: 出力形式（jpeg, png）
+        quality: 画質（0-100）
+        as_bytes: Base64エンコードせず、画像のバイト列を返すかどうか
+        
+    Returns:
+        Base64エンコードされたサムネイル（as_bytesの場合はバイト列）と幅、高さ
+    """
+    from PIL import Image
+    
+    original_width, original_height = image.size
+    ratio = min(width / original_width, height / original_height)
+    new_size = (max(1, round(original_width * ratio)), max(1, round(original_height * ratio)))
+    
+    buffer = io.BytesIO()
+    if format.lower() == "png":
+        if image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA")
+        image.resize(new_size, Image.LANCZOS).save(buffer, format="PNG")
+    else:
+        # PNG以外はPhotoshopでの生成と同じくJPEGで保存する
+        image.convert("RGB").resize(new_size, Image.LANCZOS).save(buffer, format="JPEG", quality=quality)
+    if as_bytes:
+        return buffer.getvalue(), new_size[0], new_size[1]
+    return base64.b64encode(buffer.getbuffer()).decode("ascii"), new_size[0], new_size[1]
@@ -7,12 +7,39 @@
 
 import os
 import platform
+from functools import lru_cache
 from pathlib import Path
 from typing import Union
 
 # プラットフォーム検出
 PLATFORM = platform.system()
 
+def _normalize_posix(path: str) -> str:
+    """Windows以外のプラットフォーム用にパスを正規化する"""
+    # ユーザーホームディレクトリの展開
+    if path.startswith("~"):
+        path = os.path.expanduser(path)
+    
+    # 相対パスを絶対パスに変換
+    if not os.path.isabs(path):
+        path = os.path.abspath(path)
+    
+    return path
+
+def _normalize_windows(path: str) -> str:
+    """Windows用にパスを正規化する（バックスラッシュをスラッシュに変換）"""
+    # PureWindowsPath(path).as_posix()はPathオブジェクトの生成を伴い、str.replaceより大幅に遅いため使用しない
+    # （str.replaceは置換対象がなければ元の文字列をそのまま返す）
+    return _normalize_posix(path).replace("\\", "/")
+
+# プラットフォームごとの分岐を呼び出しごとに行わないよう、インポート時に関数を選択
+_normalize = _normalize_windows if PLATFORM == "Windows" else _normalize_posix
+
+@lru_cache(maxsize=1024)
+def _normalize_absolute(path: str) -> str:
+    """絶対パスを正規化する（結果がパス文字列だけで決まるためキャッシュする）"""
+    return _normalize(path)
+
 def normalize_path(path: Union[str, Path]) -> str:
     """パスを正規化する
     
@@ -32,19 +59,10 @@ def normalize_path(path: Union[str, Path]) -> str:
     if isinstance(path, Path):
         path = str(path)
     
-    # ユーザーホームディレクトリの展開
-    if path.startswith("~"):
-        path = os.path.expanduser(path)
-    
-    # 相対パスを絶対パスに変換
-    if not os.path.isabs(path):
-        path = os.path.abspath(path)
-    
-    # Windowsのバックスラッシュをスラッシュに変換
-    if PLATFORM == "Windows":
-        path = path.replace("\\", "/")
-    
-    return path
+    # 相対パスや~で始まるパスはカレントディレクトリやHOMEに依存するためキャッシュしない
+    if path.startswith("~") or not os.path.isabs(path):
+        return _normalize(path)
+    return _normalize_absolute(path)
 
 def format_path_for_script(path: Union[str, Path]) -> str:
     """スクリプト用にパスをフォーマットする
@@ -59,20 +77,38 @@ def format_path_for_script(path: Union[str, Path]) -> str:
         スクリプト用にフォーマットされたパス（文字列）
     """
     # まずパスを正規化
-    path = normalize_path(path)
-    
-    # プラットフォームに応じたフォーマット
-    if PLATFORM == "Darwin":
-        # AppleScript用にPOSIXパスをクォート
-        return f'POSIX file "{path}"'
-    elif PLATFORM == "Windows":
-        # PowerShell用にパスをエスケープ
-        # PowerShell用にパスをエスケープ（バックスラッシュをエスケープ）
-        escaped_path = path.replace('"', '\\"')
-        return f'"{escaped_path}"`'
-    else:
-        # その他のプラットフォームではシンプルにクォート
-        return f'"{path}"'
+    return _format_normalized_path(normalize_path(path))
+
+def _format_darwin(path: str) -> str:
+    """AppleScript用にPOSIXパスをクォートする"""
+    return f'POSIX file "{path}"'
+
+def _format_windows(path: str) -> str:
+    """PowerShell用にパスをエスケープする"""
+    # PowerShell用にパスをエスケープ（バックスラッシュをエスケープ）
+    escaped_path = path.replace('"', '\\"')
+    return f'"{escaped_path}"`'
+
+def _format_default(path: str) -> str:
+    """その他のプラットフォームではシンプルにクォートする"""
+    return f'"{path}"'
+
+# プラットフォームに応じたフォーマット関数をインポート時に選択し、正規化済みのパスごとにキャッシュ
+_format_normalized_path = lru_cache(maxsize=1024)(
+    {"Darwin": _format_darwin, "Windows": _format_windows}.get(PLATFORM, _format_default)
+)
+
+def _to_windows_separators(path: str) -> str:
+    """スラッシュをバックスラッシュに変換する"""
+    # str(PureWindowsPath(path))は冗長な区切り文字も除去するが、呼び出しごとのコストが大きいため使用しない
+    return path.replace("/", "\\")
+
+def _keep_separators(path: str) -> str:
+    """Windows以外のプラットフォームではパスをそのまま使用する"""
+    return path
+
+# Windowsの場合のみスラッシュをバックスラッシュに変換する（インポート時に関数を選択）
+_to_platform_separators = _to_windows_separators if PLATFORM == "Windows" else _keep_separators
 
 def convert_to_platform_path(path: Union[str, Path]) -> str:
     """プラットフォーム固有のパス形式に変換する
@@ -86,14 +122,11 @@ def convert_to_platform_path(path: Union[str, Path]) -> str:
     Returns:
         プラットフォーム固有のパス形式（文字列）
     """
-    # まずパスを正規化
-    path = normalize_path(path)
-    
-    # Windowsの場合はスラッシュをバックスラッシュに変換
-    if PLATFORM == "Windows":
-        path = path.replace("/", "\\")
-    
-    return path
+    # まずパスを正規化し、プラットフォームの区切り文字に変換
+    return _to_platform_separators(normalize_path(path))
+
+# 一時ディレクトリのパス（インポート時に一度だけ計算）
+_TEMP_DIR = normalize_path(os.path.join(os.path.dirname(os.path.dirname(__file__)), "temp"))
 
 def get_temp_dir() -> str:
     """一時ディレクトリのパスを取得する
@@ -103,7 +136,7 @@ def get_temp_dir() -> str:
     Returns:
         一時ディレクトリのパス（文字列）
     """
-    return normalize_path(os.path.join(os.path.dirname(os.path.dirname(__file__)), "temp"))
+    return _TEMP_DIR
 
 def ensure_dir_exists(path: Union[str, Path]) -> str:
     """ディレクトリが存在することを確認し、必要に応じて作成する
@@ -4,24 +4,708 @@ import asyncio
 import tempfile
 import base64
 import logging
+import random
+import shutil
+import signal
 import subprocess
+import threading
 import time
-from typing import Dict, Any, Optional, Union, Tuple, Dict, Callable
+import concurrent.futures
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Set, Union, Tuple, Dict, Callable
+
+try:
+    import orjson
+except ImportError:  # orjsonが利用できない場合は標準のjsonを使用
+    orjson = None
 
 from . import PhotoshopBridge
+from .image_utils import pillow_thumbnail, read_image_file
 from .path_utils import normalize_path, format_path_for_script
 
+# 結果のデコードに使う関数（orjsonのデコードエラーはjson.JSONDecodeErrorのサブクラス）
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+# 常駐PowerShellホストのスクリプト
+# 標準入力から1行1件のJSON要求（id, Base64エンコードしたスクリプト, 引数のJSON）を読み込み、
+# RunspacePoolで並列に実行して、完了した順に1行1件のJSON応答（id, stdout, stderr, returncode）を返す
+# cancelを指定した要求（id, cancel）を受け取ると、そのidの実行中のスクリプトだけを停止する
+# $MaxRunspacesは起動時に先頭へ追加する
+_POWERSHELL_HOST_SCRIPT = r'''
+$utf8 = New-Object System.Text.UTF8Encoding $false
+$reader = New-Object System.IO.StreamReader ([Console]::OpenStandardInput()), $utf8
+$writer = New-Object System.IO.StreamWriter ([Console]::OpenStandardOutput()), $utf8
+$writer.AutoFlush = $true
+
+# COMオブジェクトを扱うため、powershell.exeと同じくSTAで実行する
+$pool = [RunspaceFactory]::CreateRunspacePool(1, [Math]::Max(1, $MaxRunspaces))
+$pool.ApartmentState = [System.Threading.ApartmentState]::STA
+# ランスペースごとに作成したCOMオブジェクトを再利用するため、同じスレッドで実行し続ける
+$pool.ThreadOptions = [System.Management.Automation.Runspaces.PSThreadOptions]::ReuseThread
+$pool.Open()
+
+$running = New-Object System.Collections.ArrayList
+$readTask = $reader.ReadLineAsync()
+
+function Complete-Request($item) {
+    $ps = $item.PowerShell
+    $response = @{ id = $item.Id; stdout = ""; stderr = ""; returncode = 0 }
+    try {
+        $output = $ps.EndInvoke($item.Handle)
+        $response.stdout = ($output | Out-String -Width 8192)
+        $response.stderr = (($ps.Streams.Error | ForEach-Object { $_.ToString() }) -join "`n")
+        if ($ps.HadErrors) {
+            $response.returncode = 1
+        }
+    } catch {
+        $response.stderr = $_.Exception.Message
+        $response.returncode = 1
+    } finally {
+        $ps.Dispose()
+    }
+    $writer.WriteLine((ConvertTo-Json -Compress $response))
+}
+
+while ($readTask -ne $null -or $running.Count -gt 0) {
+    # 新しい要求をRunspacePoolで非同期に実行する
+    if ($readTask -ne $null -and $readTask.IsCompleted) {
+        $line = $readTask.Result
+        if ($line -eq $null) {
+            # 標準入力が閉じられたら、実行中の要求を完了させてから終了する
+            $readTask = $null
+        } else {
+            $readTask = $reader.ReadLineAsync()
+            if ($line.Length -gt 0) {
+                $request = ConvertFrom-Json $line
+                if ($request.cancel) {
+                    # タイムアウトした要求のパイプラインだけを停止する（停止後はエラーとして応答を返す）
+                    foreach ($item in $running) {
+                        if ($item.Id -eq $request.id) {
+                            $null = $item.PowerShell.BeginStop($null, $null)
+                        }
+                    }
+                } else {
+                    $ps = [PowerShell]::Create()
+                    $ps.RunspacePool = $pool
+                    # スクリプトごとにローカルスコープで実行し、変数が次の呼び出しに残らないようにする
+                    $null = $ps.AddScript($utf8.GetString([Convert]::FromBase64String($request.script)), $true)
+                    if ($request.args -ne $null) {
+                        # 引数のJSONはスクリプトのparamブロックで受け取る
+                        $null = $ps.AddArgument($request.args)
+                    }
+                    $null = $running.Add(@{ Id = $request.id; PowerShell = $ps; Handle = $ps.BeginInvoke() })
+                }
+            }
+        }
+        continue
+    }
+
+    # 完了した要求の応答を返す
+    for ($i = $running.Count - 1; $i -ge 0; $i--) {
+        if ($running[$i].Handle.IsCompleted) {
+            Complete-Request $running[$i]
+            $running.RemoveAt($i)
+        }
+    }
+
+    # 要求の受信かスクリプトの完了まで待機する（WaitAnyは最大64個のハンドルを扱える）
+    $handles = New-Object System.Collections.Generic.List[System.Threading.WaitHandle]
+    if ($readTask -ne $null) {
+        $handles.Add(([System.IAsyncResult]$readTask).AsyncWaitHandle)
+    }
+    foreach ($item in $running) {
+        if ($handles.Count -ge 64) {
+            break
+        }
+        $handles.Add($item.Handle.AsyncWaitHandle)
+    }
+    if ($handles.Count -gt 0) {
+        $null = [System.Threading.WaitHandle]::WaitAny($handles.ToArray(), 1000)
+    }
+}
+
+$pool.Close()
+'''
+
+@lru_cache(maxsize=64)
+def _encode_script(script: str) -> str:
+    """
+    スクリプトをUTF-8のBase64文字列にする
+    
+    スクリプト本体はモジュール定数で呼び出しごとに変わらないため、エンコード結果を再利用する
+    
+    Args:
+        script: PowerShellスクリプト
+        
+    Returns:
+        Base64文字列
+    """
+    return base64.b64encode(script.encode("utf-8")).decode("ascii")
+
+def _decode_base64_expr(text: str, encoded: Optional[str] = None) -> str:
+    """文字列をBase64で埋め込み、PowerShell上で元の文字列に戻す式を返す"""
+    if encoded is None:
+        encoded = base64.b64encode(text.encode("utf-8")).decode("ascii")
+    return f"([Text.Encoding]::UTF8.GetString([Convert]::FromBase64String('{encoded}')))"
+
+def _stdin_script(script: str, args_json: Optional[str] = None) -> str:
+    """
+    `-Command -`で標準入力から渡すスクリプトを返す
+    
+    標準入力からのスクリプトは1行ずつ解釈され、空行で複数行のブロックが途切れるため、
+    スクリプトと引数をBase64で埋め込んだ1行のコマンドにする
+    
+    Args:
+        script: PowerShellスクリプト
+        args_json: スクリプトに渡す引数のJSON
+        
+    Returns:
+        標準入力に書き込むスクリプト
+    """
+    command = f"& ([ScriptBlock]::Create({_decode_base64_expr(script, _encode_script(script))}))"
+    if args_json is not None:
+        command += f" {_decode_base64_expr(args_json)}"
+    return command + "\n"
+
+# 各メソッドのPowerShellスクリプト
+# スクリプト本体は固定し、呼び出しごとの値は引数のJSON（$ArgsJson）で受け取る
+_SCRIPT_HEADER_PS = r'''
+param([string]$ArgsJson)
+$mcpArgs = ConvertFrom-Json $ArgsJson
+
+# Photoshopのオブジェクトはランスペースごとに一度だけ作成し、以降の呼び出しで再利用する
+function Get-PhotoshopApp {
+    $app = $global:PsMcpApp
+    if ($app -ne $null -and $global:PsMcpAppName -eq $mcpArgs.app) {
+        try {
+            $null = $app.Documents.Count
+            return $app
+        } catch [System.Runtime.InteropServices.COMException] {
+            # Photoshopが再起動された場合は作り直す
+        }
+    }
+    $global:PsMcpSaveOptions = @{}
+    $app = New-Object -ComObject $mcpArgs.app
+    $global:PsMcpApp = $app
+    $global:PsMcpAppName = $mcpArgs.app
+    return $app
+}
+
+# 保存オプションもランスペースごとに作成して再利用する（Get-PhotoshopAppの後に呼び出す）
+function Get-SaveOptions([string]$progId) {
+    $options = $global:PsMcpSaveOptions[$progId]
+    if ($options -eq $null) {
+        $options = New-Object -ComObject $progId
+        $global:PsMcpSaveOptions[$progId] = $options
+    }
+    return $options
+}
+'''
+
+_OPEN_FILE_PS = _SCRIPT_HEADER_PS + r'''
+try {
+    $app = Get-PhotoshopApp
+    $null = $app.Open($mcpArgs.path)
+    Write-Output "true"
+    exit 0
+} catch {
+    Write-Error $_.Exception.Message
+    Write-Output "false"
+    exit 1
+}
+'''
+
+_CLOSE_FILE_PS = _SCRIPT_HEADER_PS + r'''
+try {
+    $app = Get-PhotoshopApp
+    if ($app.Documents.Count -eq 0) {
+        Write-Output "false"
+        exit 0
+    }
+    
+    $doc = $app.ActiveDocument
+    $doc.Close([bool]$mcpArgs.save_changes)
+    Write-Output "true"
+    exit 0
+} catch {
+    Write-Error $_.Exception.Message
+    Write-Output "false"
+    exit 1
+}
+'''
+
+_SAVE_FILE_PS = _SCRIPT_HEADER_PS + r'''
+try {
+    $app = Get-PhotoshopApp
+    if ($app.Documents.Count -eq 0) {
+        Write-Output "false"
+        exit 0
+    }
+    
+    $doc = $app.ActiveDocument
+    if ($mcpArgs.path) {
+        $saveOptions = Get-SaveOptions "Photoshop.PhotoshopSaveOptions"
+        $doc.SaveAs($mcpArgs.path, $saveOptions, $true)
+    } else {
+        $doc.Save()
+    }
+    Write-Output "true"
+    exit 0
+} catch {
+    Write-Error $_.Exception.Message
+    Write-Output "false"
+    exit 1
+}
+'''
+
+_EXECUTE_SCRIPT_PS = _SCRIPT_HEADER_PS + r'''
+try {
+    $app = Get-PhotoshopApp
+    $result = $app.DoJavaScript($mcpArgs.script)
+    Write-Output $result
+    exit 0
+} catch {
+    Write-Error $_.Exception.Message
+    exit 1
+}
+'''
+
+_DOCUMENT_INFO_PS = _SCRIPT_HEADER_PS + r'''
+try {
+    $app = Get-PhotoshopApp
+    if ($app.Documents.Count -eq 0) {
+        Write-Output "null"
+        exit 0
+    }
+    
+    $doc = $app.ActiveDocument
+    
+    # ヒストリー数をバージョンとし、呼び出し元のキャッシュと同じであれば情報の取得を省略する
+    $path = $doc.FullName
+    $version = $doc.HistoryStates.Count
+    $known = $mcpArgs.known_versions.PSObject.Properties[$path]
+    if ($known -ne $null -and $known.Value -eq $version) {
+        Write-Output (ConvertTo-Json -Compress @{ "path" = $path; "version" = $version; "unchanged" = $true })
+        exit 0
+    }
+    
+    $info = @{
+        "name" = $doc.Name
+        "width" = $doc.Width
+        "height" = $doc.Height
+        "resolution" = $doc.Resolution
+        "path" = $path
+    }
+    
+    $jsonInfo = ConvertTo-Json -Compress @{ "path" = $path; "version" = $version; "info" = $info }
+    Write-Output $jsonInfo
+    exit 0
+} catch {
+    Write-Error $_.Exception.Message
+    exit 1
+}
+'''
+
+_EXPORT_LAYER_PS = _SCRIPT_HEADER_PS + r'''
+try {
+    $app = Get-PhotoshopApp
+    if ($app.Documents.Count -eq 0) {
+        Write-Output (ConvertTo-Json -Compress @{ status = "error"; message = "No document is open" })
+        exit
+    }
+    
+    $doc = $app.ActiveDocument
+    
+    # レイヤーの表示/非表示を設定（表示状態を変更したレイヤーの位置と元の状態を記録し、終了時に元に戻す）
+    $changedLayers = New-Object System.Collections.ArrayList
+    $targetLayer = $null
+    $index = 0
+    foreach ($layer in $doc.ArtLayers) {
+        $visible = ($targetLayer -eq $null -and $layer.Name -eq $mcpArgs.layer_id)
+        if ($visible) {
+            $targetLayer = $layer
+        }
+        if ($layer.Visible -ne $visible) {
+            $layer.Visible = $visible
+            # JavaScriptの配列リテラルとして記録する（artLayersの並びはCOMと同じ）
+            $null = $changedLayers.Add("[$index,$(([string](-not $visible)).ToLower())]")
+        }
+        $index++
+    }
+    if ($targetLayer -eq $null) {
+        throw "Layer not found: $($mcpArgs.layer_id)"
+    }
+    
+    # ファイル形式の設定
+    $saveOptions = $null
+    switch ($mcpArgs.format.ToLower()) {
+        "jpeg" {
+            $saveOptions = Get-SaveOptions "Photoshop.JPEGSaveOptions"
+            $saveOptions.Quality = $mcpArgs.quality
+            $saveOptions.EmbedColorProfile = $true
+            $saveOptions.FormatOptions = 1  # StandardBaseline
+            $saveOptions.Matte = 1  # None
+            $extension = ".jpg"
+        }
+        "png" {
+            $saveOptions = Get-SaveOptions "Photoshop.PNGSaveOptions"
+            $saveOptions.Interlaced = $false
+            $extension = ".png"
+        }
+        "tiff" {
+            $saveOptions = Get-SaveOptions "Photoshop.TiffSaveOptions"
+            $saveOptions.EmbedColorProfile = $true
+            $saveOptions.ImageCompression = 1  # LZW
+            $extension = ".tif"
+        }
+        default {
+            Write-Output (ConvertTo-Json -Compress @{ status = "error"; message = "Unsupported format: $($mcpArgs.format)" })
+            exit
+        }
+    }
+    
+    # ファイルの保存
+    $doc.SaveAs($mcpArgs.path, $saveOptions, $true, 2)  # 2 = Extension Type: Lowercase
+    
+    Write-Output (ConvertTo-Json -Compress @{ status = "success"; message = "Layer exported successfully"; path = $mcpArgs.path; format = $mcpArgs.format })
+} catch {
+    Write-Output (ConvertTo-Json -Compress @{ status = "error"; message = $_.Exception.Message })
+} finally {
+    # 変更したレイヤーの表示状態だけを元に戻す（元々非表示だったレイヤーは非表示のまま）
+    # レイヤーごとにCOMを呼び出さず、1回のDoJavaScriptでまとめて戻す
+    if ($changedLayers -ne $null -and $changedLayers.Count -gt 0) {
+        $changes = $changedLayers -join ","
+        $null = $app.DoJavaScript("(function(){var d=app.activeDocument;var c=[$changes];for(var i=0;i<c.length;i++)d.artLayers[c[i][0]].visible=c[i][1];})();")
+    }
+}
+'''
+
+_RUN_ACTION_PS = _SCRIPT_HEADER_PS + r'''
+try {
+    $app = Get-PhotoshopApp
+    if ($app.Documents.Count -eq 0) {
+        Write-Output (ConvertTo-Json -Compress @{ status = "error"; message = "No document is open" })
+        exit
+    }
+    
+    # アクションの実行
+    $app.DoAction($mcpArgs.action_name, $mcpArgs.action_set)
+    
+    Write-Output (ConvertTo-Json -Compress @{ status = "success"; message = "Action executed successfully"; action_set = $mcpArgs.action_set; action_name = $mcpArgs.action_name })
+} catch {
+    Write-Output (ConvertTo-Json -Compress @{ status = "error"; message = $_.Exception.Message })
+}
+'''
+
+_THUMBNAIL_PS = _SCRIPT_HEADER_PS + r'''
+try {
+    $app = Get-PhotoshopApp
+    
+    # ファイルを開く
+    $doc = $app.Open($mcpArgs.path)
+    
+    # ドキュメントのサイズを取得
+    $originalWidth = $doc.Width
+    $originalHeight = $doc.Height
+    
+    # アスペクト比を維持したリサイズ
+    $ratio = [Math]::Min($mcpArgs.width / $originalWidth, $mcpArgs.height / $originalHeight)
+    $newWidth = [Math]::Round($originalWidth * $ratio)
+    $newHeight = [Math]::Round($originalHeight * $ratio)
+    
+    # ドキュメントをリサイズ
+    $doc.ResizeImage($newWidth, $newHeight, $doc.Resolution, 1, 0)  # 1 = Bicubic, 0 = No automatic interpolation
+    
+    # ファイル形式の設定
+    $saveOptions = $null
+    switch ($mcpArgs.format.ToLower()) {
+        "jpeg" {
+            $saveOptions = Get-SaveOptions "Photoshop.JPEGSaveOptions"
+            $saveOptions.Quality = $mcpArgs.quality
+            $saveOptions.EmbedColorProfile = $true
+            $saveOptions.FormatOptions = 1  # StandardBaseline
+            $saveOptions.Matte = 1  # None
+            $extension = ".jpg"
+        }
+        "png" {
+            $saveOptions = Get-SaveOptions "Photoshop.PNGSaveOptions"
+            $saveOptions.Interlaced = $false
+            $extension = ".png"
+        }
+        default {
+            $saveOptions = Get-SaveOptions "Photoshop.JPEGSaveOptions"
+            $saveOptions.Quality = $mcpArgs.quality
+            $extension = ".jpg"
+        }
+    }
+    
+    # サムネイルを保存
+    $thumbnailPath = $mcpArgs.temp_file + $extension
+    $doc.SaveAs($thumbnailPath, $saveOptions, $true, 2)  # 2 = Extension Type: Lowercase
+    
+    # ドキュメントを閉じる
+    $doc.Close(2)  # 2 = Don't save changes
+    
+    # 画像の読み込みと一時ファイルの削除は呼び出し元で行う
+    Write-Output (ConvertTo-Json -Compress @{ status = "success"; path = $thumbnailPath; width = $newWidth; height = $newHeight; format = $mcpArgs.format })
+} catch {
+    Write-Output (ConvertTo-Json -Compress @{ status = "error"; message = $_.Exception.Message })
+}
+'''
+
+_EXECUTE_JAVASCRIPT_PS = _SCRIPT_HEADER_PS + r'''
+try {
+    $app = Get-PhotoshopApp
+    if ($app.Documents.Count -eq 0) {
+        Write-Output (ConvertTo-Json -Compress @{ status = "error"; message = "No document is open" })
+        exit
+    }
+    
+    # JavaScriptの実行
+    $result = $app.DoJavaScript($mcpArgs.script)
+    
+    Write-Output (ConvertTo-Json -Compress @{ status = "success"; result = "$result" })
+} catch {
+    Write-Output (ConvertTo-Json -Compress @{ status = "error"; message = $_.Exception.Message })
+}
+'''
+
+def _thumbnail_result(thumbnail: Tuple[Union[str, bytes], int, int], format: str) -> Dict[str, Any]:
+    """
+    Pillowで生成したサムネイルを、PowerShellでの生成結果と同じ形式にする
+    
+    Args:
+        thumbnail: Base64エンコードされたサムネイル（またはバイト列）と幅、高さ
+        format: 出力形式
+        
+    Returns:
+        サムネイル情報（status, thumbnail, width, height, format）
+    """
+    thumbnail_data, thumbnail_width, thumbnail_height = thumbnail
+    return {
+        "status": "success",
+        "thumbnail": thumbnail_data,
+        "width": thumbnail_width,
+        "height": thumbnail_height,
+        "format": format
+    }
+
+def _parse_json_output(output: str) -> Dict[str, Any]:
+    """
+    スクリプトが出力したJSONの結果を解析する
+    
+    Args:
+        output: スクリプトの標準出力
+        
+    Returns:
+        結果（出力がない場合はエラーの結果）
+    """
+    if not output:
+        # PowerShell自体が失敗した場合はスクリプトの結果が出力されない
+        return {"status": "error", "message": "PowerShell script produced no output"}
+    return _json_loads(output)
+
+def _load_thumbnail_file(result: Dict[str, Any], return_bytes: bool) -> Dict[str, Any]:
+    """
+    PowerShellが保存したサムネイルを読み込み、一時ファイルを削除する
+    
+    Args:
+        result: サムネイル生成スクリプトの結果（成功時は一時ファイルのパスを含む）
+        return_bytes: Base64エンコードせず、画像のバイト列を返すかどうか
+        
+    Returns:
+        サムネイル情報（status, thumbnail, width, height, format）
+    """
+    thumbnail_path = result.pop("path", None) if result.get("status") == "success" else None
+    if thumbnail_path is None:
+        return result
+    try:
+        result["thumbnail"] = read_image_file(thumbnail_path, return_bytes)
+    finally:
+        os.remove(thumbnail_path)
+    return result
+
+def _thumbnail_summary(response: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    完了通知に含めるサムネイル情報を返す
+    
+    画像データは戻り値でのみ返し、進捗通知では同じデータを重複して送らない
+    
+    Args:
+        response: サムネイル情報（status, thumbnail, width, height, format）
+        
+    Returns:
+        画像データを除いたサムネイル情報（width, height, format）
+    """
+    return {
+        "width": response["width"],
+        "height": response["height"],
+        "format": response["format"]
+    }
+
+# 複数のJavaScriptを1回のDoJavaScript呼び出しで実行するラッパー
+# 各スクリプトをevalして最後の式の値を集め、失敗した時点で以降のスクリプトは実行しない
+_BATCH_JS_TEMPLATE = '''
+(function () {
+    var scripts = %s;
+    var results = [];
+    for (var i = 0; i < scripts.length; i++) {
+        try {
+            var value = eval(scripts[i]);
+            results.push({ok: true, value: value === undefined ? null : value});
+        } catch (e) {
+            results.push({ok: false, error: e.toString()});
+            break;
+        }
+    }
+    return JSON.stringify(results);
+})();
+'''
+
+# サムネイルを生成するJavaScript関数（Photoshopに一度だけ登録し、以降は名前で呼び出す）
+_THUMBNAIL_FUNCTION_JS = '''
+function (args) {
+    var doc = app.activeDocument;
+    
+    // ドキュメントのサイズを取得
+    var originalWidth = doc.width.value;
+    var originalHeight = doc.height.value;
+    
+    // アスペクト比を維持したサイズを計算
+    var ratio = Math.min(args.width / originalWidth, args.height / originalHeight);
+    var newWidth = Math.round(originalWidth * ratio);
+    var newHeight = Math.round(originalHeight * ratio);
+    
+    // 複製して新しいサイズにリサイズ
+    var docCopy = doc.duplicate();
+    docCopy.resizeImage(UnitValue(newWidth, "px"), UnitValue(newHeight, "px"), null, ResampleMethod.BICUBIC);
+    
+    // 保存オプションを設定
+    var saveOptions;
+    var format = args.format.toLowerCase();
+    
+    if (format === "jpeg" || format === "jpg") {
+        saveOptions = new JPEGSaveOptions();
+        saveOptions.quality = args.quality;
+        saveOptions.embedColorProfile = true;
+        saveOptions.formatOptions = FormatOptions.STANDARDBASELINE;
+        saveOptions.matte = MatteType.NONE;
+    } else if (format === "png") {
+        saveOptions = new PNGSaveOptions();
+        saveOptions.compression = 0;
+        saveOptions.interlaced = false;
+    } else {
+        // デフォルトはJPEG
+        saveOptions = new JPEGSaveOptions();
+        saveOptions.quality = args.quality;
+    }
+    
+    // ファイル保存
+    var fileObj = new File(args.path);
+    docCopy.saveAs(fileObj, saveOptions, true);
+    
+    // 複製を閉じる
+    docCopy.close(SaveOptions.DONOTSAVECHANGES);
+    
+    return {
+        width: newWidth,
+        height: newHeight
+    };
+}
+'''
+
+# リトライで回復する見込みのある一時的なエラー（Photoshopのビジー状態、タイムアウト、ホストの切断）
+_TRANSIENT_ERROR_PATTERNS = (
+    "RPC_E_SERVERCALL_RETRYLATER",
+    "0x8001010A",
+    "The message filter indicated that the application is busy",
+    "Call was rejected by callee",
+    "timed out",
+    "PowerShell host exited unexpectedly",
+    "Broken pipe",
+    "The pipe is being closed",
+)
+
+def _is_transient_error(error: Exception) -> bool:
+    """リトライで回復する見込みのある一時的なエラーかどうかを判定する"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    message = str(error)
+    return any(pattern in message for pattern in _TRANSIENT_ERROR_PATTERNS)
+
+# ドキュメント情報のキャッシュの有効期間（秒）
+# ヒストリーの上限に達するとHistoryStates.Countが変化しなくなるため、バージョンの比較だけに頼らない
+DOC_INFO_CACHE_TTL = 2.0
+
+# コンソールウィンドウを表示せずに子プロセスを起動するフラグ（Windows以外では0）
+_CREATE_NO_WINDOW = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
+# タイムアウト時にCtrl+Breakを送れるよう、子プロセスを新しいプロセスグループで起動するフラグ（Windows以外では0）
+_CREATE_NEW_PROCESS_GROUP = getattr(subprocess, "CREATE_NEW_PROCESS_GROUP", 0)
+
+# Ctrl+Breakを送ってから強制終了するまでの待機時間（秒）
+GRACEFUL_SHUTDOWN_TIMEOUT = 1.0
+
+# 常駐ホストにタイムアウトした要求の停止を指示してから、ホストごと強制終了するまでの待機時間（秒）
+HOST_CANCEL_TIMEOUT = 5.0
+
+class _PowerShellHostExited(ConnectionError):
+    """常駐PowerShellホストが応答を返す前に終了したことを示す例外"""
+    
+    def __init__(self, answered: bool, message: str = "PowerShell host exited unexpectedly"):
+        """
+        Args:
+            answered: 終了したホストが一度でも応答したかどうか
+            message: エラーメッセージ
+        """
+        super().__init__(message)
+        self.answered = answered
+
+class _PowerShellHostRestarted(_PowerShellHostExited):
+    """
+    タイムアウトした要求を停止できず、常駐PowerShellホストを強制終了したことを示す例外
+    
+    同じホストで実行中だった要求は途中まで実行された可能性があるため、再実行せずにエラーとして扱う。
+    ホスト自体は動作していたため、常駐ホストは無効にしない。
+    """
+    
+    def __init__(self):
+        super().__init__(True, "PowerShell host was restarted to stop another request")
+
 class PowerShellBridge(PhotoshopBridge):
     """PowerShellを使用してPhotoshopと通信するWindows用ブリッジ"""
     
-    def __init__(self):
-        """PowerShellブリッジの初期化"""
-        self.ps_executable = "powershell.exe"
+    def __init__(self, persistent: bool = True):
+        """PowerShellブリッジの初期化
+        
+        Args:
+            persistent: PowerShellを常駐させて呼び出しごとのプロセス起動を省略するかどうか
+        """
+        # PATHの検索を呼び出しごとに繰り返さないよう、実行ファイルのパスを事前に解決しておく
+        self.ps_executable = shutil.which("powershell.exe") or "powershell.exe"
+        # プロファイルを読み込まず、対話入力も待たない共通の引数
+        self._ps_argv_prefix: Tuple[str, ...] = (
+            self.ps_executable,
+            "-NoProfile", "-NonInteractive",
+            "-ExecutionPolicy", "Bypass",
+        )
+        self._ps_stdin_argv: Tuple[str, ...] = (*self._ps_argv_prefix, "-Command", "-")
         self.app_name = "Photoshop.Application"  # COMオブジェクト名
         self.timeout = 30  # スクリプト実行のタイムアウト（秒）
         self.max_retries = 3  # エラー時の最大リトライ回数
-        self.retry_delay = 1.0  # リトライ間の待機時間（秒）
-        self._script_cache = {}  # スクリプトキャッシュ
+        self.retry_delay = 1.0  # リトライ間の待機時間（秒、リトライごとに2倍にする）
+        self.max_retry_delay = 8.0  # リトライ間の待機時間の上限（秒）
+        self.error_counts: Dict[str, int] = {}  # execute_scriptで発生したエラーの種類ごとの件数
+        self._js_registered: Set[str] = set()  # Photoshopに登録済みのJavaScript関数
+        self._doc_info_cache: Dict[str, Tuple[int, Dict[str, Any], float]] = {}  # ドキュメント情報キャッシュ（パス -> バージョン、情報、有効期限）
+        self.persistent = persistent
+        self._host: Optional[subprocess.Popen] = None
+        self._host_lock = threading.Lock()  # ホストの起動と送信待ちの要求を保護する
+        self._host_write_lock = threading.Lock()  # ホストの標準入力への書き込みを直列化する
+        self._host_pending: Dict[int, concurrent.futures.Future] = {}
+        self._host_request_id = 0
+        self._restarted_hosts: Set[subprocess.Popen] = set()  # タイムアウトした要求のために強制終了したホスト
+        self.host_runspaces = os.cpu_count() or 4  # 常駐ホストで同時に実行するスクリプトの最大数
         
         # ロガーの設定
         self.logger = logging.getLogger('photoshop_mcp_server.bridge.powershell')
@@ -32,50 +716,330 @@ class PowerShellBridge(PhotoshopBridge):
             self.logger.addHandler(handler)
             self.logger.setLevel(logging.INFO)
     
-    async def _run_powershell_script(self, script: str) -> tuple[str, str, int]:
-        """PowerShellスクリプトを実行し、結果を返す"""
-        # 一時ファイルにスクリプトを書き込む
-        with tempfile.NamedTemporaryFile(suffix='.ps1', delete=False, mode='w', encoding='utf-8') as f:
-            f.write(script)
-            temp_script_path = f.name
+    async def __aenter__(self) -> "PowerShellBridge":
+        return self
+    
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+    
+    def _host_command(self) -> List[str]:
+        """常駐PowerShellホストを起動するコマンドラインを返す"""
+        script = f"$MaxRunspaces = {max(1, int(self.host_runspaces))}\n" + _POWERSHELL_HOST_SCRIPT
+        encoded = base64.b64encode(script.encode("utf-16-le")).decode("ascii")
+        return [*self._ps_argv_prefix, "-EncodedCommand", encoded]
+    
+    def _stdin_command(self) -> Tuple[str, ...]:
+        """スクリプトを標準入力から読み込むPowerShellのコマンドラインを返す"""
+        return self._ps_stdin_argv
+    
+    def _ensure_host(self) -> subprocess.Popen:
+        """
+        常駐PowerShellホストを取得（未起動・終了済みの場合は起動する）
+        
+        呼び出し元で_host_lockを保持していること。
+        
+        Returns:
+            PowerShellホストのプロセス
+        """
+        if self._host is None or self._host.poll() is not None:
+            proc = subprocess.Popen(
+                self._host_command(),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                creationflags=_CREATE_NO_WINDOW
+            )
+            # 送信待ちの要求はホストごとに管理し、終了したホストの要求だけを失敗させる
+            pending: Dict[int, concurrent.futures.Future] = {}
+            self._host = proc
+            self._host_pending = pending
+            threading.Thread(
+                target=self._read_host_responses,
+                args=(proc, pending),
+                name="powershell-host-reader",
+                daemon=True
+            ).start()
+            self.logger.debug(f"Started persistent PowerShell host (pid: {proc.pid})")
+        return self._host
+    
+    def _read_host_responses(self, proc: subprocess.Popen, pending: Dict[int, concurrent.futures.Future]) -> None:
+        """常駐PowerShellホストの応答を読み込み、対応する要求の結果を設定する（専用スレッドで実行）"""
+        answered = False
+        try:
+            for line in proc.stdout:
+                if not line.strip():
+                    continue
+                try:
+                    response = _json_loads(line)
+                except ValueError:
+                    self.logger.warning(f"Invalid response from PowerShell host: {line[:200]!r}")
+                    continue
+                answered = True
+                with self._host_lock:
+                    future = pending.pop(response.get("id"), None)
+                if future is None or future.cancelled():
+                    continue
+                try:
+                    future.set_result((
+                        (response.get("stdout") or "").strip(),
+                        (response.get("stderr") or "").strip(),
+                        int(response.get("returncode", 1))
+                    ))
+                except concurrent.futures.InvalidStateError:
+                    # タイムアウトなどで呼び出し元が待機をやめた要求
+                    pass
+        finally:
+            # ホストが終了したため、応答を受け取れなかった要求を失敗させる
+            with self._host_lock:
+                if self._host is proc:
+                    self._host = None
+                futures = list(pending.values())
+                pending.clear()
+                restarted = proc in self._restarted_hosts
+                self._restarted_hosts.discard(proc)
+            for future in futures:
+                if not future.done():
+                    # 自ら強制終了したホストは起動に失敗したわけではないため、常駐ホストを無効にさせない
+                    future.set_exception(_PowerShellHostRestarted() if restarted else _PowerShellHostExited(answered))
+            self.logger.debug(f"Persistent PowerShell host exited (pid: {proc.pid})")
+    
+    def _submit_to_host(self, script: str, args_json: Optional[str] = None) -> Tuple[subprocess.Popen, int, concurrent.futures.Future]:
+        """常駐PowerShellホストにスクリプトと引数のJSONを送信し、送信先のホスト、要求ID、結果を受け取るFutureを返す"""
+        with self._host_lock:
+            proc = self._ensure_host()
+            pending = self._host_pending
+            self._host_request_id += 1
+            request_id = self._host_request_id
+            future: concurrent.futures.Future = concurrent.futures.Future()
+            pending[request_id] = future
+        
+        request = json.dumps({
+            "id": request_id,
+            "script": _encode_script(script),
+            "args": args_json
+        })
+        try:
+            with self._host_write_lock:
+                proc.stdin.write(request.encode("utf-8") + b"\n")
+                proc.stdin.flush()
+        except (OSError, ValueError) as e:
+            # 書き込みに失敗した場合はホストが終了しているため、読み込みスレッドと同じ扱いにする
+            self.logger.warning(f"Failed to send script to PowerShell host: {e}")
+            with self._host_lock:
+                pending.pop(request_id, None)
+            raise _PowerShellHostExited(False) from e
+        return proc, request_id, future
+    
+    def _cancel_host_request(self, proc: subprocess.Popen, request_id: int, future: concurrent.futures.Future) -> None:
+        """
+        タイムアウトした要求だけを常駐PowerShellホストで停止する
+        
+        同じホストで並列に実行中の他の要求を巻き込まないよう、停止の指示を送って応答を待ち、
+        停止できなかった場合に限りホストを強制終了する。
+        
+        Args:
+            proc: 要求を送信したホストのプロセス
+            request_id: 停止する要求のID
+            future: 要求の結果を受け取るFuture
+        """
+        try:
+            with self._host_write_lock:
+                proc.stdin.write(json.dumps({"id": request_id, "cancel": True}).encode("utf-8") + b"\n")
+                proc.stdin.flush()
+        except (OSError, ValueError):
+            # ホストは既に終了している
+            return
+        try:
+            # 停止された要求はエラーとして応答が返る
+            future.result(timeout=HOST_CANCEL_TIMEOUT)
+            return
+        except concurrent.futures.TimeoutError:
+            pass
+        except Exception:
+            # ホストが終了した場合も要求は停止している
+            return
+        
+        # COM呼び出しなどでパイプラインを停止できない場合の最終手段として、このホストを作り直す
+        self.logger.warning(f"PowerShell host did not stop request {request_id}, restarting the host")
+        with self._host_lock:
+            if self._host is proc:
+                self._host = None
+            if proc.poll() is None:
+                self._restarted_hosts.add(proc)
+        if proc.poll() is None:
+            proc.kill()
+    
+    def _terminate_host(self) -> None:
+        """常駐PowerShellホストを終了する"""
+        with self._host_lock:
+            proc, self._host = self._host, None
+        if proc is None or proc.poll() is not None:
+            return
+        # 標準入力を閉じるとホストのループが終了する
+        try:
+            proc.stdin.close()
+            proc.wait(timeout=2)
+        except (OSError, subprocess.TimeoutExpired):
+            proc.kill()
+    
+    def _run_on_host_sync(self, script: str, args_json: Optional[str] = None) -> tuple[str, str, int]:
+        """常駐PowerShellホストでスクリプトを実行し、結果を返す（同期版）"""
+        proc, request_id, future = self._submit_to_host(script, args_json)
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            # 応答しないスクリプトだけを停止し、並列に実行中の他の要求は継続させる
+            self._cancel_host_request(proc, request_id, future)
+            raise
+    
+    async def _run_on_host(self, script: str, args_json: Optional[str] = None) -> tuple[str, str, int]:
+        """常駐PowerShellホストでスクリプトを実行し、結果を返す"""
+        # ホストの起動やパイプへの書き込みでイベントループを止めないよう、スレッドで送信する
+        proc, request_id, future = await asyncio.to_thread(self._submit_to_host, script, args_json)
+        wrapped = asyncio.wrap_future(future)
+        # タイムアウト後にホストが終了した場合でも、例外が未取得として警告されないようにする
+        wrapped.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            # タイムアウト後も停止の応答を待てるよう、元のFutureはキャンセルしない
+            return await asyncio.wait_for(asyncio.shield(wrapped), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            # 応答しないスクリプトだけを停止し、並列に実行中の他の要求は継続させる
+            await asyncio.to_thread(self._cancel_host_request, proc, request_id, future)
+            raise TimeoutError(f"PowerShell script execution timed out after {self.timeout} seconds")
+    
+    def _disable_host(self, error: OSError) -> None:
+        """常駐PowerShellホストが利用できないため、呼び出しごとの起動に切り替える"""
+        self.logger.warning(f"Persistent PowerShell host is unavailable, falling back to one process per call: {error}")
+        self.persistent = False
+    
+    def _invalidate_caches(self) -> None:
+        """キャッシュ済みのドキュメント情報を破棄する"""
+        self._doc_info_cache.clear()
+    
+    async def close(self) -> None:
+        """常駐PowerShellホストを終了する"""
+        await asyncio.to_thread(self._terminate_host)
+    
+    def _script_args(self, **kwargs) -> str:
+        """スクリプトに渡す引数のJSONを返す（操作対象のCOMオブジェクト名を含める）"""
+        return json.dumps({"app": self.app_name, **kwargs})
+    
+    async def _run_powershell_script(self, script: str, args: Optional[Dict[str, Any]] = None) -> tuple[str, str, int]:
+        """
+        PowerShellスクリプトを実行し、結果を返す
+        
+        Args:
+            script: PowerShellスクリプト
+            args: スクリプトの$ArgsJsonに渡す引数
             
+        Returns:
+            標準出力、標準エラー出力、終了コード
+        """
+        args_json = self._script_args(**args) if args is not None else None
+        if self.persistent:
+            try:
+                return await self._run_on_host(script, args_json)
+            except TimeoutError as e:
+                # TimeoutErrorはOSErrorのサブクラスのため、ホストの起動失敗より先に処理する
+                raise RuntimeError(f"PowerShell script execution failed: {str(e)}")
+            except _PowerShellHostExited as e:
+                if e.answered:
+                    # 実行途中で終了した場合は再実行せず、次の呼び出しで起動し直す
+                    return "", str(e), 1
+                self._disable_host(e)
+            except OSError as e:
+                self._disable_host(e)
+            except Exception as e:
+                raise RuntimeError(f"PowerShell script execution failed: {str(e)}")
+        
         try:
-            # PowerShellスクリプトを実行
+            # PowerShellスクリプトを標準入力から渡して実行（一時ファイルは使用しない）
             proc = await asyncio.create_subprocess_exec(
-                self.ps_executable,
-                "-ExecutionPolicy", "Bypass",
-                "-File", temp_script_path,
+                *self._stdin_command(),
+                stdin=asyncio.subprocess.PIPE,
                 stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+                stderr=asyncio.subprocess.PIPE,
+                creationflags=_CREATE_NO_WINDOW | _CREATE_NEW_PROCESS_GROUP
             )
-            stdout, stderr = await proc.communicate()
+            try:
+                stdout, stderr = await asyncio.wait_for(
+                    proc.communicate(_stdin_script(script, args_json).encode('utf-8')),
+                    timeout=self.timeout
+                )
+            except asyncio.TimeoutError:
+                # モーダルダイアログなどで応答しないプロセスを残さないよう、終了させて回収する
+                await self._stop_process(proc)
+                raise TimeoutError(f"PowerShell script execution timed out after {self.timeout} seconds")
             return stdout.decode().strip(), stderr.decode().strip(), proc.returncode
         except Exception as e:
             raise RuntimeError(f"PowerShell script execution failed: {str(e)}")
-        finally:
-            # 一時ファイルを削除
-            os.unlink(temp_script_path)
             
-    def _run_powershell_script_sync(self, script: str) -> str:
-        """PowerShellスクリプトを実行し、結果を返す（同期版、最適化）"""
-        # スクリプトキャッシュの確認
-        script_hash = hash(script)
-        if script_hash in self._script_cache:
-            self.logger.debug("Using cached script result")
-            return self._script_cache[script_hash]
+    async def _stop_process(self, proc: asyncio.subprocess.Process) -> None:
+        """
+        子プロセスを終了させて回収する
+        
+        Windowsでは先にCtrl+Breakを送り、終了しない場合は強制終了する。
+        
+        Args:
+            proc: 終了させるプロセス
+        """
+        ctrl_break = getattr(signal, "CTRL_BREAK_EVENT", None)
+        if ctrl_break is not None and proc.returncode is None:
+            try:
+                proc.send_signal(ctrl_break)
+                await asyncio.wait_for(proc.wait(), timeout=GRACEFUL_SHUTDOWN_TIMEOUT)
+                return
+            except (OSError, asyncio.TimeoutError):
+                pass
+        if proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+        await proc.wait()
+    
+    def _run_powershell_script_sync(self, script: str, args: Optional[Dict[str, Any]] = None) -> str:
+        """
+        PowerShellスクリプトを実行し、結果を返す（同期版、最適化）
+        
+        Args:
+            script: PowerShellスクリプト
+            args: スクリプトの$ArgsJsonに渡す引数
             
-        # 一時ファイルにスクリプトを書き込む
-        with tempfile.NamedTemporaryFile(suffix='.ps1', delete=False, mode='w', encoding='utf-8') as f:
-            f.write(script)
-            temp_script_path = f.name
+        Returns:
+            スクリプトの標準出力
+        """
+        args_json = self._script_args(**args) if args is not None else None
+        
+        if self.persistent:
+            try:
+                stdout, stderr, returncode = self._run_on_host_sync(script, args_json)
+            except concurrent.futures.TimeoutError:
+                error_msg = f"PowerShell script execution timed out after {self.timeout} seconds"
+                self.logger.error(error_msg)
+                raise TimeoutError(error_msg)
+            except _PowerShellHostExited as e:
+                if e.answered:
+                    error_msg = f"PowerShell script execution failed: {e}"
+                    self.logger.error(error_msg)
+                    raise RuntimeError(error_msg)
+                self._disable_host(e)
+            except OSError as e:
+                self._disable_host(e)
+            else:
+                if returncode != 0:
+                    self.logger.warning(f"PowerShell script execution failed: {stderr}")
+                return stdout
             
         try:
             # PowerShellスクリプトを実行（タイムアウト設定追加）
             start_time = time.time()
             self.logger.debug(f"Executing PowerShell script (timeout: {self.timeout}s)")
             
+            # スクリプトは標準入力から渡す（一時ファイルは使用しない）
             result = subprocess.run(
-                [self.ps_executable, "-ExecutionPolicy", "Bypass", "-File", temp_script_path],
+                self._stdin_command(),
+                input=_stdin_script(script, args_json),
                 capture_output=True,
                 text=True,
                 timeout=self.timeout
@@ -87,13 +1051,7 @@ class PowerShellBridge(PhotoshopBridge):
             if result.returncode != 0:
                 self.logger.warning(f"PowerShell script execution failed: {result.stderr}")
                 
-            output = result.stdout.strip()
-            
-            # 結果をキャッシュ（成功した場合のみ）
-            if result.returncode == 0:
-                self._script_cache[script_hash] = output
-                
-            return output
+            return result.stdout.strip()
         except subprocess.TimeoutExpired:
             error_msg = f"PowerShell script execution timed out after {self.timeout} seconds"
             self.logger.error(error_msg)
@@ -107,29 +1065,13 @@ class PowerShellBridge(PhotoshopBridge):
             error_msg = f"PowerShell script execution failed: {str(e)}"
             self.logger.error(error_msg)
             raise RuntimeError(error_msg)
-        finally:
-            # 一時ファイルを削除
-            try:
-                os.unlink(temp_script_path)
-            except Exception as e:
-                self.logger.warning(f"Failed to delete temporary script file: {e}")
     
     async def open_file(self, path: str) -> bool:
         """ファイルを開く"""
         path = normalize_path(path)
-        script = f"""
-        try {{
-            $app = New-Object -ComObject {self.app_name}
-            $app.Open("{path}")
-            Write-Output "true"
-            exit 0
-        }} catch {{
-            Write-Error $_.Exception.Message
-            Write-Output "false"
-            exit 1
-        }}
-        """
-        stdout, stderr, returncode = await self._run_powershell_script(script)
+        # ドキュメントの状態が変わるため、キャッシュを破棄する
+        self._invalidate_caches()
+        stdout, stderr, returncode = await self._run_powershell_script(_OPEN_FILE_PS, {"path": path})
         if returncode != 0:
             print(f"Error opening file: {stderr}")
             return False
@@ -137,26 +1079,9 @@ class PowerShellBridge(PhotoshopBridge):
     
     async def close_file(self, save_changes: bool = False) -> bool:
         """ファイルを閉じる"""
-        save_option = "$true" if save_changes else "$false"
-        script = f"""
-        try {{
-            $app = New-Object -ComObject {self.app_name}
-            if ($app.Documents.Count -eq 0) {{
-                Write-Output "false"
-                exit 0
-            }}
-            
-            $doc = $app.ActiveDocument
-            $doc.Close({save_option})
-            Write-Output "true"
-            exit 0
-        }} catch {{
-            Write-Error $_.Exception.Message
-            Write-Output "false"
-            exit 1
-        }}
-        """
-        stdout, stderr, returncode = await self._run_powershell_script(script)
+        # ドキュメントの状態が変わるため、キャッシュを破棄する
+        self._invalidate_caches()
+        stdout, stderr, returncode = await self._run_powershell_script(_CLOSE_FILE_PS, {"save_changes": save_changes})
         if returncode != 0:
             print(f"Error closing file: {stderr}")
             return False
@@ -166,68 +1091,17 @@ class PowerShellBridge(PhotoshopBridge):
         """現在のドキュメントを保存する"""
         if path:
             path = normalize_path(path)
-            script = f"""
-            try {{
-                $app = New-Object -ComObject {self.app_name}
-                if ($app.Documents.Count -eq 0) {{
-                    Write-Output "false"
-                    exit 0
-                }}
-                
-                $doc = $app.ActiveDocument
-                $saveOptions = New-Object -ComObject Photoshop.PhotoshopSaveOptions
-                $doc.SaveAs("{path}", $saveOptions, $true)
-                Write-Output "true"
-                exit 0
-            }} catch {{
-                Write-Error $_.Exception.Message
-                Write-Output "false"
-                exit 1
-            }}
-            """
-        else:
-            script = f"""
-            try {{
-                $app = New-Object -ComObject {self.app_name}
-                if ($app.Documents.Count -eq 0) {{
-                    Write-Output "false"
-                    exit 0
-                }}
-                
-                $doc = $app.ActiveDocument
-                $doc.Save()
-                Write-Output "true"
-                exit 0
-            }} catch {{
-                Write-Error $_.Exception.Message
-                Write-Output "false"
-                exit 1
-            }}
-            """
-        
-        stdout, stderr, returncode = await self._run_powershell_script(script)
+        
+        # ドキュメントの状態が変わるため、キャッシュを破棄する
+        self._invalidate_caches()
+        stdout, stderr, returncode = await self._run_powershell_script(_SAVE_FILE_PS, {"path": path})
         if returncode != 0:
             print(f"Error saving file: {stderr}")
             return False
         return stdout.lower() == "true"
     
     async def execute_script(self, script: str) -> Any:
-        """JavaScriptを実行する（エラーリトライ機能付き）"""
-        # JavaScriptのエスケープ
-        escaped_script = script.replace('"', '`"').replace("'", "`'")
-        
-        ps_script = f"""
-        try {{
-            $app = New-Object -ComObject {self.app_name}
-            $result = $app.DoJavaScript("{escaped_script}")
-            Write-Output $result
-            exit 0
-        }} catch {{
-            Write-Error $_.Exception.Message
-            exit 1
-        }}
-        """
-        
+        """JavaScriptを実行する（一時的なエラーのみリトライする）"""
         # リトライロジックの実装
         retry_count = 0
         last_error = None
@@ -236,21 +1110,31 @@ class PowerShellBridge(PhotoshopBridge):
             try:
                 if retry_count > 0:
                     self.logger.info(f"Retrying script execution (attempt {retry_count}/{self.max_retries})")
-                    # リトライ間の待機
-                    await asyncio.sleep(self.retry_delay)
+                    # 上限付きの指数バックオフに、同時に再試行しないよう揺らぎを加えて待機する
+                    delay = min(self.retry_delay * (2 ** (retry_count - 1)), self.max_retry_delay)
+                    await asyncio.sleep(delay + random.uniform(0, 0.1))
                 
-                stdout, stderr, returncode = await self._run_powershell_script(ps_script)
+                stdout, stderr, returncode = await self._run_powershell_script(_EXECUTE_SCRIPT_PS, {"script": script})
                 if returncode != 0:
                     raise RuntimeError(f"Script execution failed: {stderr}")
                 
+                # スクリプトがドキュメントを変更した可能性があるため、キャッシュを破棄する
+                self._invalidate_caches()
+                
                 # 結果をJSONとしてパースしてみる
                 try:
-                    return json.loads(stdout)
+                    return _json_loads(stdout)
                 except json.JSONDecodeError:
                     # JSONでない場合は文字列として返す
                     return stdout
                     
             except Exception as e:
+                error_type = type(e).__name__
+                self.error_counts[error_type] = self.error_counts.get(error_type, 0) + 1
+                if not _is_transient_error(e):
+                    # スクリプトの誤りなど、再実行しても成功しないエラーはすぐに返す
+                    self.logger.error(f"Non-transient error during script execution: {e}")
+                    raise
                 last_error = e
                 retry_count += 1
                 self.logger.warning(f"Error during script execution: {e}. Retry {retry_count}/{self.max_retries}")
@@ -259,377 +1143,180 @@ class PowerShellBridge(PhotoshopBridge):
         self.logger.error(f"Script execution failed after {self.max_retries} retries: {last_error}")
         raise last_error
     
-    async def get_document_info(self) -> Optional[Dict[str, Any]]:
-        """現在のドキュメント情報を取得する"""
-        script = f"""
-        try {{
-            $app = New-Object -ComObject {self.app_name}
-            if ($app.Documents.Count -eq 0) {{
-                Write-Output "null"
-                exit 0
-            }}
+    async def execute_scripts_batch(self, scripts: List[str]) -> List[Any]:
+        """
+        複数のJavaScriptを1回のPowerShell呼び出しでまとめて実行する
+        
+        スクリプトは順番に実行し、いずれかが失敗した場合は以降のスクリプトを実行しない。
+        
+        Args:
+            scripts: 実行するJavaScriptのリスト
             
-            $doc = $app.ActiveDocument
-            $info = @{{
-                "name" = $doc.Name
-                "width" = $doc.Width
-                "height" = $doc.Height
-                "resolution" = $doc.Resolution
-                "path" = $doc.FullName
-            }}
+        Returns:
+            各スクリプトの結果（JSON文字列の場合はパースした値）のリスト
+        """
+        if not scripts:
+            return []
+        
+        results = await self.execute_script(_BATCH_JS_TEMPLATE % json.dumps(scripts))
+        if not isinstance(results, list):
+            raise RuntimeError(f"Unexpected batch script result: {results!r}")
+        
+        values = []
+        for index, result in enumerate(results):
+            if not result.get("ok"):
+                raise RuntimeError(f"Script {index} in batch failed: {result.get('error')}")
+            value = result.get("value")
+            if isinstance(value, str):
+                # execute_scriptと同じく、JSONであればパースする
+                try:
+                    value = _json_loads(value)
+                except json.JSONDecodeError:
+                    pass
+            values.append(value)
+        return values
+    
+    def _js_function_snippet(self, key: str, source: str, args: Dict[str, Any]) -> str:
+        """
+        登録したJavaScript関数を呼び出すスクリプトを返す（未登録の場合は関数の定義を含める）
+        
+        Args:
+            key: 関数の識別子
+            source: 関数式のソース（引数をオブジェクトで受け取る）
+            args: 関数に渡す引数
             
-            $jsonInfo = ConvertTo-Json $info
-            Write-Output $jsonInfo
-            exit 0
-        }} catch {{
-            Write-Error $_.Exception.Message
-            exit 1
-        }}
+        Returns:
+            関数の戻り値をJSON文字列にするスクリプト
+        """
+        name = f"__fn_{key}"
+        call = f"JSON.stringify($.global.{name}({json.dumps(args)}));"
+        if key in self._js_registered:
+            return call
+        # 関数はグローバルに定義し、Photoshopのセッション中は再利用する
+        return f"$.global.{name} = {source};\n{call}"
+    
+    async def _run_js_function(self, key: str, source: str, args: Dict[str, Any], before: List[str] = ()) -> Any:
         """
+        JavaScript関数を初回のみ登録し、以降は名前で呼び出す
         
-        stdout, stderr, returncode = await self._run_powershell_script(script)
+        Args:
+            key: 関数の識別子
+            source: 関数式のソース（引数をオブジェクトで受け取る）
+            args: 関数に渡す引数
+            before: 関数の呼び出し前に同じ呼び出しで実行するスクリプト
+            
+        Returns:
+            関数の戻り値
+        """
+        try:
+            results = await self.execute_scripts_batch([*before, self._js_function_snippet(key, source, args)])
+        except RuntimeError as e:
+            if key not in self._js_registered or f"__fn_{key}" not in str(e):
+                raise
+            # Photoshopの再起動で関数が失われた場合は、定義し直して呼び出す
+            self.logger.info(f"Re-registering JavaScript function: {key}")
+            self._js_registered.discard(key)
+            results = await self.execute_scripts_batch([self._js_function_snippet(key, source, args)])
+        self._js_registered.add(key)
+        return results[-1]
+    
+    async def get_document_info(self) -> Optional[Dict[str, Any]]:
+        """現在のドキュメント情報を取得する"""
+        # キャッシュ済みのバージョンを渡し、変更がなければキャッシュを返す（1回の呼び出しで確認と取得を行う）
+        # 有効期限を過ぎたエントリはバージョンが同じでも取得し直す
+        now = time.monotonic()
+        known_versions = {path: version for path, (version, _, expires) in self._doc_info_cache.items() if now < expires}
+        stdout, stderr, returncode = await self._run_powershell_script(_DOCUMENT_INFO_PS, {"known_versions": known_versions})
         if returncode != 0 or stdout == "null":
             return None
         
         try:
-            return json.loads(stdout)
+            result = _json_loads(stdout)
         except json.JSONDecodeError:
             raise RuntimeError(f"Failed to parse document info: {stdout}")
+        
+        path = result["path"]
+        if result.get("unchanged"):
+            cached = self._doc_info_cache.get(path)
+            if cached is not None:
+                return dict(cached[1])
+            # 問い合わせ中にキャッシュが破棄された場合は取得し直す
+            return await self.get_document_info()
+        
+        info = result["info"]
+        self._doc_info_cache[path] = (result["version"], info, time.monotonic() + DOC_INFO_CACHE_TTL)
+        return dict(info)
     
     def export_layer(self, layer_id: str, path: str, format: str = "jpeg", quality: int = 80) -> Dict[str, Any]:
         """指定したレイヤーをエクスポートする"""
         path = normalize_path(path)
-        script = f"""
-        try {{
-            $app = New-Object -ComObject Photoshop.Application
-            if ($app.Documents.Count -eq 0) {{
-                Write-Output "{{ \\"status\\": \\"error\\", \\"message\\": \\"No document is open\\" }}"
-                exit
-            }}
-            
-            $doc = $app.ActiveDocument
-            
-            # レイヤーの表示/非表示を設定
-            foreach ($layer in $doc.ArtLayers) {{
-                if ($layer.Name -eq "{layer_id}") {{
-                    $layer.Visible = $true
-                    $targetLayer = $layer
-                }} else {{
-                    $layer.Visible = $false
-                }}
-            }}
-            
-            # ファイル形式の設定
-            $saveOptions = $null
-            switch ("{format.lower()}") {{
-                "jpeg" {{
-                    $saveOptions = New-Object -ComObject Photoshop.JPEGSaveOptions
-                    $saveOptions.Quality = {quality}
-                    $saveOptions.EmbedColorProfile = $true
-                    $saveOptions.FormatOptions = 1  # StandardBaseline
-                    $saveOptions.Matte = 1  # None
-                    $extension = ".jpg"
-                }}
-                "png" {{
-                    $saveOptions = New-Object -ComObject Photoshop.PNGSaveOptions
-                    $saveOptions.Interlaced = $false
-                    $extension = ".png"
-                }}
-                "tiff" {{
-                    $saveOptions = New-Object -ComObject Photoshop.TiffSaveOptions
-                    $saveOptions.EmbedColorProfile = $true
-                    $saveOptions.ImageCompression = 1  # LZW
-                    $extension = ".tif"
-                }}
-                default {{
-                    Write-Output "{{ \\"status\\": \\"error\\", \\"message\\": \\"Unsupported format: {format}\\" }}"
-                    exit
-                }}
-            }}
-            
-            # ファイルの保存
-            $doc.SaveAs("{path}", $saveOptions, $true, 2)  # 2 = Extension Type: Lowercase
-            
-            Write-Output "{{ \\"status\\": \\"success\\", \\"message\\": \\"Layer exported successfully\\", \\"path\\": \\"{path}\\", \\"format\\": \\"{format}\\" }}"
-        }} catch {{
-            Write-Output "{{ \\"status\\": \\"error\\", \\"message\\": \\"$($_.Exception.Message)\\" }}"
-        }} finally {{
-            # すべてのレイヤーを再表示
-            if ($doc -ne $null) {{
-                foreach ($layer in $doc.ArtLayers) {{
-                    $layer.Visible = $true
-                }}
-            }}
-        }}
-        """
-        result = self._run_powershell_script_sync(script)
-        return json.loads(result)
+        result = self._run_powershell_script_sync(_EXPORT_LAYER_PS, {"layer_id": layer_id, "path": path, "format": format, "quality": quality})
+        # エクスポート時にドキュメントの状態が変わる可能性があるため、キャッシュを破棄する
+        self._invalidate_caches()
+        return _parse_json_output(result)
         
     async def export_layer_async(self, layer_id: str, path: str, format: str = "jpeg", quality: int = 80) -> Dict[str, Any]:
-        """指定したレイヤーをエクスポートする（非同期版）"""
-        path = normalize_path(path)
-        script = f"""
-        try {{
-            $app = New-Object -ComObject Photoshop.Application
-            if ($app.Documents.Count -eq 0) {{
-                Write-Output "{{ \\"status\\": \\"error\\", \\"message\\": \\"No document is open\\" }}"
-                exit
-            }}
-            
-            $doc = $app.ActiveDocument
-            
-            # レイヤーの表示/非表示を設定
-            foreach ($layer in $doc.ArtLayers) {{
-                if ($layer.Name -eq "{layer_id}") {{
-                    $layer.Visible = $true
-                    $targetLayer = $layer
-                }} else {{
-                    $layer.Visible = $false
-                }}
-            }}
-            
-            # ファイル形式の設定
-            $saveOptions = $null
-            switch ("{format.lower()}") {{
-                "jpeg" {{
-                    $saveOptions = New-Object -ComObject Photoshop.JPEGSaveOptions
-                    $saveOptions.Quality = {quality}
-                    $saveOptions.EmbedColorProfile = $true
-                    $saveOptions.FormatOptions = 1  # StandardBaseline
-                    $saveOptions.Matte = 1  # None
-                    $extension = ".jpg"
-                }}
-                "png" {{
-                    $saveOptions = New-Object -ComObject Photoshop.PNGSaveOptions
-                    $saveOptions.Interlaced = $false
-                    $extension = ".png"
-                }}
-                "tiff" {{
-                    $saveOptions = New-Object -ComObject Photoshop.TiffSaveOptions
-                    $saveOptions.EmbedColorProfile = $true
-                    $saveOptions.ImageCompression = 1  # LZW
-                    $extension = ".tif"
-                }}
-                default {{
-                    Write-Output "{{ \\"status\\": \\"error\\", \\"message\\": \\"Unsupported format: {format}\\" }}"
-                    exit
-                }}
-            }}
-            
-            # ファイルの保存
-            $doc.SaveAs("{path}", $saveOptions, $true, 2)  # 2 = Extension Type: Lowercase
-            
-            Write-Output "{{ \\"status\\": \\"success\\", \\"message\\": \\"Layer exported successfully\\", \\"path\\": \\"{path}\\", \\"format\\": \\"{format}\\" }}"
-        }} catch {{
-            Write-Output "{{ \\"status\\": \\"error\\", \\"message\\": \\"$($_.Exception.Message)\\" }}"
-        }} finally {{
-            # すべてのレイヤーを再表示
-            if ($doc -ne $null) {{
-                foreach ($layer in $doc.ArtLayers) {{
-                    $layer.Visible = $true
-                }}
-            }}
-        }}
-        """
-        stdout, stderr, returncode = await self._run_powershell_script(script)
-        if returncode != 0:
-            return {"status": "error", "message": stderr}
-        return json.loads(stdout)
+        """指定したレイヤーをエクスポートする（非同期版、同期版をスレッドで実行する）"""
+        return await asyncio.to_thread(self.export_layer, layer_id, path, format, quality)
     
     def run_action(self, action_set: str, action_name: str) -> Dict[str, Any]:
         """アクションを実行する"""
-        script = f"""
-        try {{
-            $app = New-Object -ComObject Photoshop.Application
-            if ($app.Documents.Count -eq 0) {{
-                Write-Output "{{ \\"status\\": \\"error\\", \\"message\\": \\"No document is open\\" }}"
-                exit
-            }}
-            
-            # アクションの実行
-            $app.DoAction("{action_name}", "{action_set}")
-            
-            Write-Output "{{ \\"status\\": \\"success\\", \\"message\\": \\"Action executed successfully\\", \\"action_set\\": \\"{action_set}\\", \\"action_name\\": \\"{action_name}\\" }}"
-        }} catch {{
-            Write-Output "{{ \\"status\\": \\"error\\", \\"message\\": \\"$($_.Exception.Message)\\" }}"
-        }}
-        """
-        result = self._run_powershell_script_sync(script)
-        return json.loads(result)
+        result = self._run_powershell_script_sync(_RUN_ACTION_PS, {"action_set": action_set, "action_name": action_name})
+        # アクションがドキュメントを変更した可能性があるため、キャッシュを破棄する
+        self._invalidate_caches()
+        return _parse_json_output(result)
         
     async def run_action_async(self, action_set: str, action_name: str) -> Dict[str, Any]:
-        """アクションを実行する（非同期版）"""
-        script = f"""
-        try {{
-            $app = New-Object -ComObject Photoshop.Application
-            if ($app.Documents.Count -eq 0) {{
-                Write-Output "{{ \\"status\\": \\"error\\", \\"message\\": \\"No document is open\\" }}"
-                exit
-            }}
-            
-            # アクションの実行
-            $app.DoAction("{action_name}", "{action_set}")
-            
-            Write-Output "{{ \\"status\\": \\"success\\", \\"message\\": \\"Action executed successfully\\", \\"action_set\\": \\"{action_set}\\", \\"action_name\\": \\"{action_name}\\" }}"
-        }} catch {{
-            Write-Output "{{ \\"status\\": \\"error\\", \\"message\\": \\"$($_.Exception.Message)\\" }}"
-        }}
-        """
-        stdout, stderr, returncode = await self._run_powershell_script(script)
-        if returncode != 0:
-            return {"status": "error", "message": stderr}
-        return json.loads(stdout)
+        """アクションを実行する（非同期版、同期版をスレッドで実行する）"""
+        return await asyncio.to_thread(self.run_action, action_set, action_name)
     
-    def generate_thumbnail(self, path: str, width: int, height: int, format: str = "jpeg", quality: int = 80) -> Dict[str, Any]:
-        """サムネイルを生成する"""
-        path = normalize_path(path)
-        temp_file = os.path.join(tempfile.gettempdir(), f"thumbnail_{os.path.basename(path)}")
+    def generate_thumbnail(self, path: str, width: int, height: int, format: str = "jpeg", quality: int = 80, return_bytes: bool = False) -> Dict[str, Any]:
+        """
+        サムネイルを生成する
         
-        script = f"""
-        try {{
-            $app = New-Object -ComObject Photoshop.Application
-            
-            # ファイルを開く
-            $doc = $app.Open("{path}")
-            
-            # ドキュメントのサイズを取得
-            $originalWidth = $doc.Width
-            $originalHeight = $doc.Height
-            
-            # アスペクト比を維持したリサイズ
-            $ratio = [Math]::Min({width} / $originalWidth, {height} / $originalHeight)
-            $newWidth = [Math]::Round($originalWidth * $ratio)
-            $newHeight = [Math]::Round($originalHeight * $ratio)
-            
-            # ドキュメントをリサイズ
-            $doc.ResizeImage($newWidth, $newHeight, $doc.Resolution, 1, 0)  # 1 = Bicubic, 0 = No automatic interpolation
-            
-            # ファイル形式の設定
-            $saveOptions = $null
-            switch ("{format.lower()}") {{
-                "jpeg" {{
-                    $saveOptions = New-Object -ComObject Photoshop.JPEGSaveOptions
-                    $saveOptions.Quality = {quality}
-                    $saveOptions.EmbedColorProfile = $true
-                    $saveOptions.FormatOptions = 1  # StandardBaseline
-                    $saveOptions.Matte = 1  # None
-                    $extension = ".jpg"
-                }}
-                "png" {{
-                    $saveOptions = New-Object -ComObject Photoshop.PNGSaveOptions
-                    $saveOptions.Interlaced = $false
-                    $extension = ".png"
-                }}
-                default {{
-                    $saveOptions = New-Object -ComObject Photoshop.JPEGSaveOptions
-                    $saveOptions.Quality = {quality}
-                    $extension = ".jpg"
-                }}
-            }}
-            
-            # サムネイルを保存
-            $thumbnailPath = "{temp_file}" + $extension
-            $doc.SaveAs($thumbnailPath, $saveOptions, $true, 2)  # 2 = Extension Type: Lowercase
+        Args:
+            path: サムネイルを生成するファイルのパス
+            width: サムネイルの幅
+            height: サムネイルの高さ
+            format: 出力形式（jpeg, png）
+            quality: 画質（0-100）
+            return_bytes: thumbnailをBase64文字列ではなく画像のバイト列で返すかどうか
             
-            # ドキュメントを閉じる
-            $doc.Close(2)  # 2 = Don't save changes
-            
-            # サムネイルのBase64エンコード
-            $bytes = [System.IO.File]::ReadAllBytes($thumbnailPath)
-            $base64 = [Convert]::ToBase64String($bytes)
-            
-            # 一時ファイルを削除
-            Remove-Item $thumbnailPath
-            
-            Write-Output "{{ \\"status\\": \\"success\\", \\"thumbnail\\": \\"$base64\\", \\"width\\": $newWidth, \\"height\\": $newHeight, \\"format\\": \\"{format}\\" }}"
-        }} catch {{
-            Write-Output "{{ \\"status\\": \\"error\\", \\"message\\": \\"$($_.Exception.Message)\\" }}"
-        }}
+        Returns:
+            サムネイル情報（status, thumbnail, width, height, format）
         """
-        result = self._run_powershell_script_sync(script)
-        return json.loads(result)
-        
-    async def generate_thumbnail_async(self, path: str, width: int, height: int, format: str = "jpeg", quality: int = 80) -> Dict[str, Any]:
-        """サムネイルを生成する（非同期版）"""
         path = normalize_path(path)
+        
+        # 保存済みの画像とPSDの埋め込みサムネイルはPhotoshopを経由せず、Pillowで縮小する
+        thumbnail = pillow_thumbnail(path, width, height, format, quality, return_bytes)
+        if thumbnail is not None:
+            return _thumbnail_result(thumbnail, format)
+        
         temp_file = os.path.join(tempfile.gettempdir(), f"thumbnail_{os.path.basename(path)}")
+        result = self._run_powershell_script_sync(_THUMBNAIL_PS, {"path": path, "width": width, "height": height, "format": format, "quality": quality, "temp_file": temp_file})
+        return _load_thumbnail_file(_parse_json_output(result), return_bytes)
         
-        script = f"""
-        try {{
-            $app = New-Object -ComObject Photoshop.Application
-            
-            # ファイルを開く
-            $doc = $app.Open("{path}")
-            
-            # ドキュメントのサイズを取得
-            $originalWidth = $doc.Width
-            $originalHeight = $doc.Height
-            
-            # アスペクト比を維持したリサイズ
-            $ratio = [Math]::Min({width} / $originalWidth, {height} / $originalHeight)
-            $newWidth = [Math]::Round($originalWidth * $ratio)
-            $newHeight = [Math]::Round($originalHeight * $ratio)
-            
-            # ドキュメントをリサイズ
-            $doc.ResizeImage($newWidth, $newHeight, $doc.Resolution, 1, 0)  # 1 = Bicubic, 0 = No automatic interpolation
-            
-            # ファイル形式の設定
-            $saveOptions = $null
-            switch ("{format.lower()}") {{
-                "jpeg" {{
-                    $saveOptions = New-Object -ComObject Photoshop.JPEGSaveOptions
-                    $saveOptions.Quality = {quality}
-                    $saveOptions.EmbedColorProfile = $true
-                    $saveOptions.FormatOptions = 1  # StandardBaseline
-                    $saveOptions.Matte = 1  # None
-                    $extension = ".jpg"
-                }}
-                "png" {{
-                    $saveOptions = New-Object -ComObject Photoshop.PNGSaveOptions
-                    $saveOptions.Interlaced = $false
-                    $extension = ".png"
-                }}
-                default {{
-                    $saveOptions = New-Object -ComObject Photoshop.JPEGSaveOptions
-                    $saveOptions.Quality = {quality}
-                    $extension = ".jpg"
-                }}
-            }}
-            
-            # サムネイルを保存
-            $thumbnailPath = "{temp_file}" + $extension
-            $doc.SaveAs($thumbnailPath, $saveOptions, $true, 2)  # 2 = Extension Type: Lowercase
-            
-            # ドキュメントを閉じる
-            $doc.Close(2)  # 2 = Don't save changes
-            
-            # サムネイルのBase64エンコード
-            $bytes = [System.IO.File]::ReadAllBytes($thumbnailPath)
-            $base64 = [Convert]::ToBase64String($bytes)
-            
-            # 一時ファイルを削除
-            Remove-Item $thumbnailPath
+    async def generate_thumbnail_async(self, path: str, width: int, height: int, format: str = "jpeg", quality: int = 80, return_bytes: bool = False) -> Dict[str, Any]:
+        """
+        サムネイルを生成する（非同期版、同期版をスレッドで実行する）
+        
+        Args:
+            path: サムネイルを生成するファイルのパス
+            width: サムネイルの幅
+            height: サムネイルの高さ
+            format: 出力形式（jpeg, png）
+            quality: 画質（0-100）
+            return_bytes: thumbnailをBase64文字列ではなく画像のバイト列で返すかどうか
             
-            Write-Output "{{ \\"status\\": \\"success\\", \\"thumbnail\\": \\"$base64\\", \\"width\\": $newWidth, \\"height\\": $newHeight, \\"format\\": \\"{format}\\" }}"
-        }} catch {{
-            Write-Output "{{ \\"status\\": \\"error\\", \\"message\\": \\"$($_.Exception.Message)\\" }}"
-        }}
+        Returns:
+            サムネイル情報（status, thumbnail, width, height, format）
         """
-        stdout, stderr, returncode = await self._run_powershell_script(script)
-        if returncode != 0:
-            return {"status": "error", "message": stderr}
-        return json.loads(stdout)
+        return await asyncio.to_thread(self.generate_thumbnail, path, width, height, format, quality, return_bytes)
     
-    async def generate_thumbnail_stream(self, path: str, width: int = 256, height: int = 256, format: str = "jpeg", quality: int = 80, callback=None) -> dict:
+    async def generate_thumbnail_stream(self, path: str, width: int = 256, height: int = 256, format: str = "jpeg", quality: int = 80, callback=None, return_bytes: bool = False) -> dict:
         """サムネイルを生成し、進捗状況をコールバックで通知する"""
-        import tempfile
-        import base64
-        import os
-        import time
-        
-        # 一時ファイルを作成
-        with tempfile.NamedTemporaryFile(suffix=f".{format}", delete=False) as temp_file:
-            temp_path = temp_file.name
+        # Photoshopで生成する場合のみ一時ファイルを使用する
+        temp_path = None
         
         try:
             # 開始通知
@@ -644,6 +1331,28 @@ class PowerShellBridge(PhotoshopBridge):
                     }
                 })
             
+            # 保存済みの画像とPSDの埋め込みサムネイルはPhotoshopを経由せず、Pillowで縮小する
+            thumbnail = await asyncio.to_thread(pillow_thumbnail, normalize_path(path), width, height, format, quality, return_bytes)
+            if thumbnail is not None:
+                thumbnail_data, thumbnail_width, thumbnail_height = thumbnail
+                response = {
+                    "status": "ok",
+                    "thumbnail": thumbnail_data,
+                    "width": thumbnail_width,
+                    "height": thumbnail_height,
+                    "format": format
+                }
+                if callback:
+                    await callback({
+                        "type": "complete",
+                        "data": _thumbnail_summary(response)
+                    })
+                return response
+            
+            # 一時ファイルを作成
+            with tempfile.NamedTemporaryFile(suffix=f".{format}", delete=False) as temp_file:
+                temp_path = temp_file.name
+            
             # ファイルを開く
             if callback:
                 await callback({
@@ -655,16 +1364,6 @@ class PowerShellBridge(PhotoshopBridge):
                     }
                 })
                 
-            if not await self.open_file(path):
-                if callback:
-                    await callback({
-                        "type": "error",
-                        "data": {
-                            "message": f"Failed to open file: {path}"
-                        }
-                    })
-                raise RuntimeError(f"Failed to open file: {path}")
-            
             # JavaScriptを使用してサムネイルを生成
             if callback:
                 await callback({
@@ -676,63 +1375,11 @@ class PowerShellBridge(PhotoshopBridge):
                     }
                 })
                 
-            # Windowsパスのバックスラッシュをエスケープ
-            temp_path_js = temp_path.replace('\\', '\\\\')
+            # パスはJSONリテラルで埋め込む（バックスラッシュと引用符をエスケープ）
+            open_js = f"app.open(new File({json.dumps(normalize_path(path))})); 'true';"
+            thumbnail_args = {"width": width, "height": height, "format": format, "quality": quality, "path": temp_path}
             
-            js_script = f'''
-            function generateThumbnail() {{
-                var doc = app.activeDocument;
-                
-                // ドキュメントのサイズを取得
-                var originalWidth = doc.width.value;
-                var originalHeight = doc.height.value;
-                
-                // アスペクト比を維持したサイズを計算
-                var ratio = Math.min({width} / originalWidth, {height} / originalHeight);
-                var newWidth = Math.round(originalWidth * ratio);
-                var newHeight = Math.round(originalHeight * ratio);
-                
-                // 複製して新しいサイズにリサイズ
-                var docCopy = doc.duplicate();
-                docCopy.resizeImage(UnitValue(newWidth, "px"), UnitValue(newHeight, "px"), null, ResampleMethod.BICUBIC);
-                
-                // 保存オプションを設定
-                var saveOptions;
-                var format = "{format}".toLowerCase();
-                
-                if (format === "jpeg" || format === "jpg") {{
-                    saveOptions = new JPEGSaveOptions();
-                    saveOptions.quality = {quality};
-                    saveOptions.embedColorProfile = true;
-                    saveOptions.formatOptions = FormatOptions.STANDARDBASELINE;
-                    saveOptions.matte = MatteType.NONE;
-                }} else if (format === "png") {{
-                    saveOptions = new PNGSaveOptions();
-                    saveOptions.compression = 0;
-                    saveOptions.interlaced = false;
-                }} else {{
-                    // デフォルトはJPEG
-                    saveOptions = new JPEGSaveOptions();
-                    saveOptions.quality = {quality};
-                }}
-                
-                // ファイル保存
-                var fileObj = new File("{temp_path_js}");
-                docCopy.saveAs(fileObj, saveOptions, true);
-                
-                // 複製を閉じる
-                docCopy.close(SaveOptions.DONOTSAVECHANGES);
-                
-                return {{
-                    width: newWidth,
-                    height: newHeight
-                }};
-            }}
-            
-            JSON.stringify(generateThumbnail());
-            '''
-            
-            # JavaScriptを実行
+            # ファイルを開く処理とサムネイルの生成を1回の呼び出しで実行
             if callback:
                 await callback({
                     "type": "progress",
@@ -743,7 +1390,7 @@ class PowerShellBridge(PhotoshopBridge):
                     }
                 })
                 
-            result = await self.execute_script(js_script)
+            result = await self._run_js_function("thumb", _THUMBNAIL_FUNCTION_JS, thumbnail_args, before=[open_js])
             
             # 結果がJSONでない場合はエラー
             if not isinstance(result, dict):
@@ -756,7 +1403,7 @@ class PowerShellBridge(PhotoshopBridge):
                     })
                 raise RuntimeError("Failed to generate thumbnail")
             
-            # 画像ファイルを読み込み、Base64エンコード
+            # 画像ファイルを読み込む（return_bytesでない場合はBase64エンコード）
             if callback:
                 await callback({
                     "type": "progress",
@@ -767,8 +1414,7 @@ class PowerShellBridge(PhotoshopBridge):
                     }
                 })
                 
-            with open(temp_path, "rb") as img_file:
-                thumbnail_data = base64.b64encode(img_file.read()).decode("utf-8")
+            thumbnail_data = read_image_file(temp_path, return_bytes)
             
             # 完了通知
             response = {
@@ -782,7 +1428,7 @@ class PowerShellBridge(PhotoshopBridge):
             if callback:
                 await callback({
                     "type": "complete",
-                    "data": response
+                    "data": _thumbnail_summary(response)
                 })
                 
             return response
@@ -798,55 +1444,16 @@ class PowerShellBridge(PhotoshopBridge):
             raise RuntimeError(f"Error generating thumbnail: {e}")
         finally:
             # 一時ファイルを削除
-            if os.path.exists(temp_path):
+            if temp_path is not None and os.path.exists(temp_path):
                 os.remove(temp_path)
                 
     def execute_javascript(self, script: str) -> Dict[str, Any]:
         """JavaScriptを実行する"""
-        # JavaScriptのエスケープ
-        escaped_script = script.replace('"', '`"').replace("'", "`'")
-        
-        ps_script = f"""
-        try {{
-            $app = New-Object -ComObject Photoshop.Application
-            if ($app.Documents.Count -eq 0) {{
-                Write-Output "{{ \\"status\\": \\"error\\", \\"message\\": \\"No document is open\\" }}"
-                exit
-            }}
-            
-            # JavaScriptの実行
-            $result = $app.DoJavaScript("{escaped_script}")
-            
-            Write-Output "{{ \\"status\\": \\"success\\", \\"result\\": \\"$result\\" }}"
-        }} catch {{
-            Write-Output "{{ \\"status\\": \\"error\\", \\"message\\": \\"$($_.Exception.Message)\\" }}"
-        }}
-        """
-        result = self._run_powershell_script_sync(ps_script)
-        return json.loads(result)
+        result = self._run_powershell_script_sync(_EXECUTE_JAVASCRIPT_PS, {"script": script})
+        # スクリプトがドキュメントを変更した可能性があるため、キャッシュを破棄する
+        self._invalidate_caches()
+        return _parse_json_output(result)
         
     async def execute_javascript_async(self, script: str) -> Dict[str, Any]:
-        """JavaScriptを実行する（非同期版）"""
-        # JavaScriptのエスケープ
-        escaped_script = script.replace('"', '`"').replace("'", "`'")
-        
-        ps_script = f"""
-        try {{
-            $app = New-Object -ComObject Photoshop.Application
-            if ($app.Documents.Count -eq 0) {{
-                Write-Output "{{ \\"status\\": \\"error\\", \\"message\\": \\"No document is open\\" }}"
-                exit
-            }}
-            
-            # JavaScriptの実行
-            $result = $app.DoJavaScript("{escaped_script}")
-            
-            Write-Output "{{ \\"status\\": \\"success\\", \\"result\\": \\"$result\\" }}"
-        }} catch {{
-            Write-Output "{{ \\"status\\": \\"error\\", \\"message\\": \\"$($_.Exception.Message)\\" }}"
-        }}
-        """
-        stdout, stderr, returncode = await self._run_powershell_script(ps_script)
-        if returncode != 0:
-            return {"status": "error", "message": stderr}
-        return json.loads(stdout)
\ No newline at end of file
+        """JavaScriptを実行する（非同期版、同期版をスレッドで実行する）"""
+        return await asyncio.to_thread(self.execute_javascript, script)
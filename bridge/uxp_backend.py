@@ -1,13 +1,149 @@
 import asyncio
+import base64
 import json
 import logging
 import websockets
-from typing import Dict, Any, Optional, List, Set
+from functools import lru_cache
+from typing import Dict, Any, Optional, List, Set, Tuple, Union
+
+try:
+    import orjson
+except ImportError:  # orjsonが利用できない場合は標準のjsonを使用
+    orjson = None
+
 from . import PhotoshopBridge
 
 # ロガーの設定
 logger = logging.getLogger(__name__)
 
+# 受信するメッセージの最大サイズ（バイト、バイナリフレームで受け取る画像データを含む）
+WEBSOCKET_MAX_SIZE = 64 * 1024 * 1024
+
+# 送信バッファの上限（バイト、これを超えると送信の完了を待つ）
+WEBSOCKET_WRITE_LIMIT = 1024 * 1024
+
+# これを超えるサイズのJSONのエンコード・デコードとBase64変換は、イベントループを止めないようスレッドで行う（バイト）
+LARGE_PAYLOAD_BYTES = 64 * 1024
+
+# 送信キューから1回のフレームにまとめて送信するコマンドの合計サイズの上限（バイト）
+OUTBOX_BATCH_BYTES = 1024 * 1024
+
+# 期限（deadline）を指定しない場合の、コマンド1件あたりの応答待ちのタイムアウト（秒）
+COMMAND_TIMEOUT = 30.0
+
+# 受信メッセージのデコードに使う関数（orjsonのデコードエラーはjson.JSONDecodeErrorのサブクラス）
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+def _json_dumps(data: Dict[str, Any]) -> bytes:
+    """
+    送信メッセージをUTF-8のJSONバイト列に変換する
+    
+    websocketsは文字列を送信時にUTF-8へエンコードし直すため、バイト列のまま渡して
+    バイナリフレームで送信する（プラグイン側でUTF-8としてデコードする）
+    
+    Args:
+        data: 送信するメッセージ
+        
+    Returns:
+        JSONのバイト列
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # orjsonで扱えない値（64ビットを超える整数など）は標準のjsonで処理
+            pass
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+# 内容が変わらない応答はインポート時に一度だけエンコードしておく
+_CONNECTED_MESSAGE = _json_dumps({
+    "command": "connected",
+    "message": "UXP WebSocketサーバーに接続しました"
+})
+_INVALID_JSON_MESSAGE = _json_dumps({
+    "command": "error",
+    "error": "無効なJSONフォーマット"
+})
+
+@lru_cache(maxsize=None)
+def _command_prefix(command: str) -> bytes:
+    """
+    コマンドのフレームのうち、メッセージIDより前の部分を返す（コマンドごとに一度だけエンコードする）
+    
+    Args:
+        command: コマンド名
+        
+    Returns:
+        '{"command":"<コマンド名>","id":'のバイト列
+    """
+    return b'{"command":' + json.dumps(command).encode("utf-8") + b',"id":'
+
+def _command_frame(command: str, message_id: int, params: Optional[Dict[str, Any]]) -> bytes:
+    """
+    送信するコマンドのJSONを組み立てる
+    
+    形式は固定のため、メッセージ全体の辞書は作らず、パラメータだけをエンコードして連結する
+    
+    Args:
+        command: コマンド名
+        message_id: メッセージID
+        params: コマンドパラメータ
+        
+    Returns:
+        {"command", "id", "params"}のJSONのバイト列
+    """
+    frame = _command_prefix(command) + str(message_id).encode("ascii")
+    if params:
+        frame += b',"params":' + _json_dumps(params)
+    return frame + b"}"
+
+def _payload_size_hint(params: Optional[Dict[str, Any]]) -> int:
+    """
+    コマンドパラメータのエンコード後のおおよそのサイズを返す（文字列とバイト列の値の長さの合計）
+    
+    Args:
+        params: コマンドパラメータ
+        
+    Returns:
+        おおよそのサイズ
+    """
+    if not params:
+        return 0
+    return sum(len(value) for value in params.values() if isinstance(value, (str, bytes)))
+
+def _convert_thumbnail(thumbnail: Union[str, bytes, None], return_bytes: bool) -> Union[str, bytes]:
+    """
+    プラグインから受け取った画像データを、要求された形式（Base64文字列またはバイト列）にする
+    
+    Args:
+        thumbnail: バイナリフレームで受け取ったバイト列、またはBase64文字列
+        return_bytes: バイト列で返すかどうか
+        
+    Returns:
+        Base64文字列（return_bytesの場合はバイト列）
+    """
+    if not thumbnail:
+        return b"" if return_bytes else ""
+    if isinstance(thumbnail, bytes):
+        return thumbnail if return_bytes else base64.b64encode(thumbnail).decode("ascii")
+    return base64.b64decode(thumbnail) if return_bytes else thumbnail
+
+async def _thumbnail_data(thumbnail: Union[str, bytes, None], return_bytes: bool) -> Union[str, bytes]:
+    """
+    画像データを要求された形式にする（大きい画像の変換はスレッドで行う）
+    
+    Args:
+        thumbnail: バイナリフレームで受け取ったバイト列、またはBase64文字列
+        return_bytes: バイト列で返すかどうか
+        
+    Returns:
+        Base64文字列（return_bytesの場合はバイト列）
+    """
+    needs_conversion = isinstance(thumbnail, bytes) != return_bytes
+    if thumbnail and needs_conversion and len(thumbnail) > LARGE_PAYLOAD_BYTES:
+        return await asyncio.to_thread(_convert_thumbnail, thumbnail, return_bytes)
+    return _convert_thumbnail(thumbnail, return_bytes)
+
 class UXPBridge(PhotoshopBridge):
     """UXPプラグインを使用してPhotoshopと通信するブリッジ"""
     
@@ -23,8 +159,17 @@ class UXPBridge(PhotoshopBridge):
         self.port = port
         self.server = None
         self.clients: Set[websockets.WebSocketServerProtocol] = set()
+        # 接続順のクライアントのスナップショット（接続・切断時のみ作り直し、送信時はこれを参照する）
+        self._client_snapshot: Tuple[websockets.WebSocketServerProtocol, ...] = ()
         self.message_id = 0
         self.pending_requests: Dict[int, asyncio.Future] = {}
+        # 送信済みのリクエストの送信先クライアント（メッセージID -> クライアント、切断時に該当する応答だけを失敗させる）
+        self._request_clients: Dict[int, Any] = {}
+        # 画像データのバイナリフレームを待っている応答（クライアント -> メッセージID、応答）
+        self._binary_waiting: Dict[Any, Tuple[int, Dict[str, Any]]] = {}
+        # 送信待ちのコマンド（メッセージID、エンコード済みのJSON）と、まとめて送信するタスク
+        self._outbox: "asyncio.Queue[Tuple[int, bytes]]" = asyncio.Queue()
+        self._writer_task: Optional[asyncio.Task] = None
         
         # サーバー起動
         asyncio.create_task(self._start_server())
@@ -32,10 +177,15 @@ class UXPBridge(PhotoshopBridge):
     async def _start_server(self):
         """WebSocketサーバーを起動"""
         try:
+            # JPEG/PNGの画像データはほとんど圧縮できないため、permessage-deflateを無効にする
+            # （サーバーが応じなければ拡張は使用されず、プラグイン側の変更は不要）
             self.server = await websockets.serve(
                 self._handle_client,
                 self.host,
-                self.port
+                self.port,
+                compression=None,
+                max_size=WEBSOCKET_MAX_SIZE,
+                write_limit=WEBSOCKET_WRITE_LIMIT
             )
             logger.info(f"UXP WebSocketサーバーを起動しました: ws://{self.host}:{self.port}")
         except Exception as e:
@@ -53,13 +203,11 @@ class UXPBridge(PhotoshopBridge):
         try:
             # クライアントを登録
             self.clients.add(websocket)
+            self._client_snapshot = self._client_snapshot + (websocket,)
             logger.info(f"クライアント接続: {websocket.remote_address}")
             
             # 接続確認メッセージを送信
-            await websocket.send(json.dumps({
-                "command": "connected",
-                "message": "UXP WebSocketサーバーに接続しました"
-            }))
+            await websocket.send(_CONNECTED_MESSAGE)
             
             # メッセージ処理ループ
             async for message in websocket:
@@ -72,17 +220,34 @@ class UXPBridge(PhotoshopBridge):
         finally:
             # クライアントを削除
             self.clients.remove(websocket)
+            self._client_snapshot = tuple(client for client in self._client_snapshot if client is not websocket)
+            self._binary_waiting.pop(websocket, None)
+            error = ConnectionError("UXPプラグインとの接続が切断されました")
+            if not self.clients:
+                # 応答を返すプラグインがなくなったため、タイムアウトを待たずに保留中のリクエストを失敗させる
+                self._fail_pending_requests(error)
+            else:
+                # 他のプラグインが接続中でも、切断したプラグインに送信したリクエストには応答が届かない
+                self._fail_client_requests(websocket, error)
     
-    async def _process_message(self, websocket: websockets.WebSocketServerProtocol, message: str):
+    async def _process_message(self, websocket: websockets.WebSocketServerProtocol, message: Union[str, bytes]):
         """
         受信メッセージを処理
         
         Args:
             websocket: WebSocketクライアント接続
-            message: 受信メッセージ
+            message: 受信メッセージ（JSONのテキストフレーム、または画像データのバイナリフレーム）
         """
+        if isinstance(message, bytes):
+            self._process_binary(websocket, message)
+            return
+        
         try:
-            data = json.loads(message)
+            if len(message) > LARGE_PAYLOAD_BYTES:
+                # Base64の画像を含む応答などの大きいJSONは、他のクライアントの処理を止めないようスレッドでデコード
+                data = await asyncio.to_thread(_json_loads, message)
+            else:
+                data = _json_loads(message)
             command = data.get("command")
             message_id = data.get("id")
             
@@ -96,7 +261,14 @@ class UXPBridge(PhotoshopBridge):
             elif command == "action_result" or command == "document_info" or command == "error":
                 # 保留中のリクエストを解決
                 if message_id in self.pending_requests:
-                    future = self.pending_requests.pop(message_id)
+                    if command != "error" and data.get("binary"):
+                        # 画像データは直後のバイナリフレームで届くため、それまで応答を保留する
+                        self._binary_waiting[websocket] = (message_id, data)
+                        return
+                    future = self._pop_request(message_id)
+                    if future.done():
+                        # タイムアウトなどで呼び出し元が待機をやめたリクエスト
+                        return
                     if command == "error":
                         future.set_exception(Exception(data.get("error", "Unknown error")))
                     else:
@@ -104,7 +276,7 @@ class UXPBridge(PhotoshopBridge):
                 return
             
             # エラー応答
-            await websocket.send(json.dumps({
+            await websocket.send(_json_dumps({
                 "command": "error",
                 "id": message_id,
                 "error": f"未知のコマンド: {command}"
@@ -112,64 +284,177 @@ class UXPBridge(PhotoshopBridge):
             
         except json.JSONDecodeError:
             logger.error(f"JSONパースエラー: {message}")
-            await websocket.send(json.dumps({
-                "command": "error",
-                "error": "無効なJSONフォーマット"
-            }))
+            await websocket.send(_INVALID_JSON_MESSAGE)
         except Exception as e:
             logger.error(f"メッセージ処理エラー: {e}")
-            await websocket.send(json.dumps({
+            await websocket.send(_json_dumps({
                 "command": "error",
                 "error": f"メッセージ処理エラー: {str(e)}"
             }))
     
-    async def _send_command(self, command: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
+    def _process_binary(self, websocket: websockets.WebSocketServerProtocol, message: bytes) -> None:
+        """
+        画像データのバイナリフレームを、直前に受信した応答に格納して保留中のリクエストを解決する
+        
+        応答のbinaryには画像データを格納するキーの経路（例: ["result", "result", "thumbnail"]）が含まれる
+        
+        Args:
+            websocket: WebSocketクライアント接続
+            message: 受信したバイナリフレーム
+        """
+        waiting = self._binary_waiting.pop(websocket, None)
+        if waiting is None:
+            logger.warning(f"対応する応答のないバイナリフレームを受信しました: {len(message)}バイト")
+            return
+        
+        message_id, data = waiting
+        keys = data.pop("binary")
+        target = data
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = message
+        
+        future = self._pop_request(message_id)
+        if future is not None and not future.done():
+            future.set_result(data)
+    
+    def _pop_request(self, message_id: int) -> Optional[asyncio.Future]:
+        """
+        保留中のリクエストを取り除き、送信先の記録も破棄する
+        
+        Args:
+            message_id: メッセージID
+            
+        Returns:
+            応答を待機しているFuture、または存在しない場合はNone
+        """
+        self._request_clients.pop(message_id, None)
+        return self.pending_requests.pop(message_id, None)
+    
+    def _fail_client_requests(self, websocket: websockets.WebSocketServerProtocol, error: Exception) -> None:
+        """
+        指定したクライアントに送信したリクエストだけを失敗させる
+        
+        Args:
+            websocket: 切断したWebSocketクライアント接続
+            error: 呼び出し元に送出する例外
+        """
+        message_ids = [message_id for message_id, client in self._request_clients.items() if client is websocket]
+        for message_id in message_ids:
+            future = self._pop_request(message_id)
+            if future is not None and not future.done():
+                future.set_exception(error)
+    
+    def _fail_pending_requests(self, error: Exception) -> None:
+        """
+        保留中のリクエストをすべて失敗させる
+        
+        Args:
+            error: 呼び出し元に送出する例外
+        """
+        pending, self.pending_requests = self.pending_requests, {}
+        self._request_clients.clear()
+        self._binary_waiting.clear()
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+    
+    async def _writer_loop(self) -> None:
+        """
+        送信キューのコマンドをまとめてプラグインに送信する（バックグラウンドタスクで実行）
+        
+        キューに溜まっているコマンドは{"batch": [...]}の1フレームにまとめ、送信回数を減らす
+        """
+        while True:
+            batch = [await self._outbox.get()]
+            size = len(batch[0][1])
+            while size < OUTBOX_BATCH_BYTES and not self._outbox.empty():
+                item = self._outbox.get_nowait()
+                batch.append(item)
+                size += len(item[1])
+            
+            if len(batch) == 1:
+                frame = batch[0][1]
+            else:
+                # エンコード済みのJSONをそのまま連結し、コマンドごとに再エンコードしない
+                frame = b'{"batch":[' + b",".join(payload for _, payload in batch) + b"]}"
+            
+            try:
+                clients = self._client_snapshot
+                if not clients:
+                    raise RuntimeError("接続中のUXPプラグインがありません")
+                # 最初に接続したクライアントにメッセージを送信し、切断時に失敗させるリクエストとして記録する
+                client = clients[0]
+                for message_id, _ in batch:
+                    if message_id in self.pending_requests:
+                        self._request_clients[message_id] = client
+                await client.send(frame)
+            except Exception as e:
+                # 送信できなかったコマンドは応答が届かないため、呼び出し元に例外を返す
+                logger.error(f"コマンド送信エラー: {e}")
+                for message_id, _ in batch:
+                    future = self._pop_request(message_id)
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+    
+    async def _send_command(self, command: str, params: Dict[str, Any] = None, deadline: Optional[float] = None) -> Dict[str, Any]:
         """
         コマンドを送信し、応答を待機
         
         Args:
             command: コマンド名
             params: コマンドパラメータ
+            deadline: 応答を待つ期限（イベントループのloop.time()基準の絶対時刻）。
+                Noneの場合はコマンドごとにCOMMAND_TIMEOUT秒待機する
             
         Returns:
             応答データ
         """
-        if not self.clients:
+        if not self._client_snapshot:
             raise RuntimeError("接続中のUXPプラグインがありません")
         
+        loop = asyncio.get_running_loop()
+        if deadline is None:
+            timeout = COMMAND_TIMEOUT
+        else:
+            # 複数のコマンドで同じ期限を共有し、全体の待ち時間を期限内に収める
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                raise TimeoutError(f"コマンド {command} の送信前に期限を過ぎました")
+        
         # メッセージIDをインクリメント
         self.message_id += 1
         message_id = self.message_id
         
+        if _payload_size_hint(params) > LARGE_PAYLOAD_BYTES:
+            # 大きいスクリプトなどを含むコマンドはスレッドでエンコード
+            frame = await asyncio.to_thread(_command_frame, command, message_id, params)
+        else:
+            frame = _command_frame(command, message_id, params)
+        
         # 応答を待機するためのFutureを作成
-        future = asyncio.Future()
+        future = loop.create_future()
         self.pending_requests[message_id] = future
         
-        # コマンドを送信
-        message = {
-            "command": command,
-            "id": message_id
-        }
-        if params:
-            message["params"] = params
-            
-        # 最初の接続クライアントにメッセージを送信
-        client = next(iter(self.clients))
-        await client.send(json.dumps(message))
+        # 送信キューに追加し、同時に送信されるコマンドとまとめて送信する
+        self._outbox.put_nowait((message_id, frame))
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._writer_loop())
         
         # タイムアウト付きで応答を待機
         try:
-            return await asyncio.wait_for(future, timeout=30.0)
+            return await asyncio.wait_for(future, timeout=timeout)
         except asyncio.TimeoutError:
-            self.pending_requests.pop(message_id, None)
+            self._pop_request(message_id)
             raise TimeoutError(f"コマンド {command} がタイムアウトしました")
     
-    async def open_file(self, path: str) -> bool:
+    async def open_file(self, path: str, deadline: Optional[float] = None) -> bool:
         """
         ファイルを開く
         
         Args:
             path: 開くファイルのパス
+            deadline: 応答を待つ期限（loop.time()基準の絶対時刻、Noneの場合は既定のタイムアウト）
             
         Returns:
             成功したかどうか
@@ -182,7 +467,7 @@ class UXPBridge(PhotoshopBridge):
                     "_target": [{ "_ref": "application" }],
                     "file": { "_path": path }
                 }]
-            })
+            }, deadline=deadline)
             return result.get("result", {}).get("success", False)
         except Exception as e:
             logger.error(f"ファイルを開く操作でエラー: {e}")
@@ -248,7 +533,7 @@ class UXPBridge(PhotoshopBridge):
             logger.error(f"ファイルを保存する操作でエラー: {e}")
             return False
     
-    async def export_layer(self, layer_name: str, export_path: str, format: str = "PNG") -> bool:
+    async def export_layer(self, layer_name: str, export_path: str, format: str = "PNG", deadline: Optional[float] = None) -> bool:
         """
         レイヤーをエクスポートする
         
@@ -256,74 +541,24 @@ class UXPBridge(PhotoshopBridge):
             layer_name: エクスポートするレイヤー名
             export_path: エクスポート先のパス
             format: エクスポート形式（PNG, JPEG, PSD等）
+            deadline: 応答を待つ期限（loop.time()基準の絶対時刻、Noneの場合は既定のタイムアウト）
             
         Returns:
             成功したかどうか
         """
         try:
-            # JavaScriptを使用してレイヤーをエクスポート
-            js_script = f'''
-            function exportLayer() {{
-                var doc = app.activeDocument;
-                var layerFound = false;
-                
-                // レイヤーを検索
-                for (var i = 0; i < doc.layers.length; i++) {{
-                    if (doc.layers[i].name === "{layer_name}") {{
-                        layerFound = true;
-                        
-                        // 他のレイヤーを非表示にする
-                        var visibilityState = [];
-                        for (var j = 0; j < doc.layers.length; j++) {{
-                            visibilityState.push(doc.layers[j].visible);
-                            doc.layers[j].visible = false;
-                        }}
-                        
-                        // 対象レイヤーを表示
-                        doc.layers[i].visible = true;
-                        
-                        // エクスポート設定
-                        var saveOptions;
-                        var format = "{format}".toLowerCase();
-                        
-                        if (format === "png") {{
-                            saveOptions = new PNGSaveOptions();
-                            saveOptions.compression = 0;
-                            saveOptions.interlaced = false;
-                        }} else if (format === "jpeg" || format === "jpg") {{
-                            saveOptions = new JPEGSaveOptions();
-                            saveOptions.quality = 12;
-                            saveOptions.embedColorProfile = true;
-                        }} else if (format === "psd") {{
-                            saveOptions = new PhotoshopSaveOptions();
-                            saveOptions.embedColorProfile = true;
-                        }} else {{
-                            // デフォルトはPNG
-                            saveOptions = new PNGSaveOptions();
-                        }}
-                        
-                        // ファイル保存
-                        var fileObj = new File("{export_path}");
-                        doc.saveAs(fileObj, saveOptions, true);
-                        
-                        // レイヤーの表示状態を元に戻す
-                        for (var j = 0; j < doc.layers.length; j++) {{
-                            doc.layers[j].visible = visibilityState[j];
-                        }}
-                        
-                        return true;
-                    }}
-                }}
-                
-                return layerFound;
-            }}
-            
-            exportLayer();
-            '''
-            
-            # JavaScriptを実行
-            result = await self.execute_script(js_script)
-            return result is True
+            # プラグインに登録済みのレイヤーエクスポート処理を、パラメータだけを送って実行
+            response = await self._send_command("execute_action", {
+                "actionType": "exportLayer",
+                "name": layer_name,
+                "path": export_path,
+                "format": format
+            }, deadline=deadline)
+            result = response.get("result", {})
+            if not result.get("success", False):
+                logger.error(f"レイヤーエクスポートに失敗しました: {result.get('error', 'Unknown error')}")
+                return False
+            return True
         except Exception as e:
             logger.error(f"レイヤーエクスポート操作でエラー: {e}")
             return False
@@ -385,12 +620,43 @@ class UXPBridge(PhotoshopBridge):
     
     async def stop(self):
         """WebSocketサーバーを停止"""
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            self._writer_task = None
         if self.server:
             self.server.close()
             await self.server.wait_closed()
             logger.info("UXP WebSocketサーバーを停止しました")
     
-    async def generate_thumbnail(self, path: str, width: int = 256, height: int = 256, format: str = "jpeg", quality: int = 80) -> dict:
+    async def _run_thumbnail_action(self, width: int, height: int, format: str, quality: int, deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        アクティブなドキュメントのサムネイルをプラグインのgenerateThumbnailアクションで生成する
+        
+        スクリプトは送信せず、プラグインに実装済みの処理をパラメータだけを指定して呼び出す
+        
+        Args:
+            width: サムネイルの幅
+            height: サムネイルの高さ
+            format: 出力形式（jpeg, png）
+            quality: 画質（0-100）
+            deadline: 応答を待つ期限（loop.time()基準の絶対時刻）
+            
+        Returns:
+            サムネイル情報（thumbnail, width, height, format）
+        """
+        response = await self._send_command("execute_action", {
+            "actionType": "generateThumbnail",
+            "width": width,
+            "height": height,
+            "format": format,
+            "quality": quality
+        }, deadline=deadline)
+        result = response.get("result", {})
+        if not result.get("success", False):
+            raise RuntimeError(f"Failed to generate thumbnail: {result.get('error', 'Unknown error')}")
+        return result.get("result", {})
+    
+    async def generate_thumbnail(self, path: str, width: int = 256, height: int = 256, format: str = "jpeg", quality: int = 80, return_bytes: bool = False, deadline: Optional[float] = None) -> dict:
         """サムネイルを生成する
         
         Args:
@@ -399,93 +665,23 @@ class UXPBridge(PhotoshopBridge):
             height: サムネイルの高さ
             format: 出力形式（jpeg, png）
             quality: 画質（0-100）
+            return_bytes: thumbnailをBase64文字列ではなく画像のバイト列で返すかどうか
+            deadline: ファイルを開いてからサムネイルを受け取るまでの全体の期限（loop.time()基準の絶対時刻）
             
         Returns:
             サムネイル情報（status, thumbnail, width, height, format）
         """
         try:
             # ファイルを開く
-            if not await self.open_file(path):
+            if not await self.open_file(path, deadline=deadline):
                 raise RuntimeError(f"Failed to open file: {path}")
             
-            # JavaScriptを使用してサムネイルを生成
-            js_script = f'''
-            async function generateThumbnail() {{
-                try {{
-                    const doc = app.activeDocument;
-                    
-                    // ドキュメントのサイズを取得
-                    const originalWidth = doc.width.value;
-                    const originalHeight = doc.height.value;
-                    
-                    // アスペクト比を維持したサイズを計算
-                    const ratio = Math.min({width} / originalWidth, {height} / originalHeight);
-                    const newWidth = Math.round(originalWidth * ratio);
-                    const newHeight = Math.round(originalHeight * ratio);
-                    
-                    // 複製して新しいサイズにリサイズ
-                    const docCopy = await doc.duplicate();
-                    await docCopy.resizeImage({{
-                        width: UnitValue(newWidth, "px"),
-                        height: UnitValue(newHeight, "px"),
-                        resolution: doc.resolution,
-                        resampleMethod: ResampleMethod.BICUBIC
-                    }});
-                    
-                    // Base64エンコードされた画像データを取得
-                    const format = "{format}".toLowerCase();
-                    const quality = {quality};
-                    
-                    let imageData;
-                    if (format === "jpeg" || format === "jpg") {{
-                        imageData = await docCopy.saveToOE({{
-                            format: "image/jpeg",
-                            quality: quality / 100
-                        }});
-                    }} else if (format === "png") {{
-                        imageData = await docCopy.saveToOE({{
-                            format: "image/png"
-                        }});
-                    }} else {{
-                        // デフォルトはJPEG
-                        imageData = await docCopy.saveToOE({{
-                            format: "image/jpeg",
-                            quality: quality / 100
-                        }});
-                    }}
-                    
-                    // 複製を閉じる
-                    await docCopy.close(SaveOptions.DONOTSAVECHANGES);
-                    
-                    return {{
-                        success: true,
-                        thumbnail: imageData,
-                        width: newWidth,
-                        height: newHeight,
-                        format: format
-                    }};
-                }} catch (error) {{
-                    return {{
-                        success: false,
-                        error: error.toString()
-                    }};
-                }}
-            }}
-            
-            return await generateThumbnail();
-            '''
-            
-            # JavaScriptを実行
-            result = await self.execute_script(js_script)
-            
-            # 結果を確認
-            if not isinstance(result, dict) or not result.get("success", False):
-                error_msg = result.get("error", "Unknown error") if isinstance(result, dict) else "Invalid result"
-                raise RuntimeError(f"Failed to generate thumbnail: {error_msg}")
+            # プラグインに登録済みのサムネイル生成処理を、パラメータだけを送って実行
+            result = await self._run_thumbnail_action(width, height, format, quality, deadline=deadline)
             
             return {
                 "status": "ok",
-                "thumbnail": result.get("thumbnail", ""),
+                "thumbnail": await _thumbnail_data(result.get("thumbnail"), return_bytes),
                 "width": result.get("width", width),
                 "height": result.get("height", height),
                 "format": result.get("format", format)
@@ -495,7 +691,7 @@ class UXPBridge(PhotoshopBridge):
             logger.error(f"Error generating thumbnail: {e}")
             raise RuntimeError(f"Error generating thumbnail: {e}")
             
-    async def generate_thumbnail_stream(self, path: str, width: int = 256, height: int = 256, format: str = "jpeg", quality: int = 80, callback=None) -> dict:
+    async def generate_thumbnail_stream(self, path: str, width: int = 256, height: int = 256, format: str = "jpeg", quality: int = 80, callback=None, return_bytes: bool = False, deadline: Optional[float] = None) -> dict:
         """サムネイルを生成し、進捗状況をコールバックで通知する
         
         Args:
@@ -505,6 +701,8 @@ class UXPBridge(PhotoshopBridge):
             format: 出力形式（jpeg, png）
             quality: 画質（0-100）
             callback: 進捗状況を通知するコールバック関数
+            return_bytes: thumbnailをBase64文字列ではなく画像のバイト列で返すかどうか
+            deadline: ファイルを開いてからサムネイルを受け取るまでの全体の期限（loop.time()基準の絶対時刻）
             
         Returns:
             サムネイル情報（status, thumbnail, width, height, format）
@@ -533,7 +731,7 @@ class UXPBridge(PhotoshopBridge):
                     }
                 })
                 
-            if not await self.open_file(path):
+            if not await self.open_file(path, deadline=deadline):
                 if callback:
                     await callback({
                         "type": "error",
@@ -554,74 +752,7 @@ class UXPBridge(PhotoshopBridge):
                     }
                 })
                 
-            # JavaScriptを使用してサムネイルを生成
-            js_script = f'''
-            async function generateThumbnail() {{
-                try {{
-                    const doc = app.activeDocument;
-                    
-                    // ドキュメントのサイズを取得
-                    const originalWidth = doc.width.value;
-                    const originalHeight = doc.height.value;
-                    
-                    // アスペクト比を維持したサイズを計算
-                    const ratio = Math.min({width} / originalWidth, {height} / originalHeight);
-                    const newWidth = Math.round(originalWidth * ratio);
-                    const newHeight = Math.round(originalHeight * ratio);
-                    
-                    // 複製して新しいサイズにリサイズ
-                    const docCopy = await doc.duplicate();
-                    await docCopy.resizeImage({{
-                        width: UnitValue(newWidth, "px"),
-                        height: UnitValue(newHeight, "px"),
-                        resolution: doc.resolution,
-                        resampleMethod: ResampleMethod.BICUBIC
-                    }});
-                    
-                    // Base64エンコードされた画像データを取得
-                    const format = "{format}".toLowerCase();
-                    const quality = {quality};
-                    
-                    let imageData;
-                    if (format === "jpeg" || format === "jpg") {{
-                        imageData = await docCopy.saveToOE({{
-                            format: "image/jpeg",
-                            quality: quality / 100
-                        }});
-                    }} else if (format === "png") {{
-                        imageData = await docCopy.saveToOE({{
-                            format: "image/png"
-                        }});
-                    }} else {{
-                        // デフォルトはJPEG
-                        imageData = await docCopy.saveToOE({{
-                            format: "image/jpeg",
-                            quality: quality / 100
-                        }});
-                    }}
-                    
-                    // 複製を閉じる
-                    await docCopy.close(SaveOptions.DONOTSAVECHANGES);
-                    
-                    return {{
-                        success: true,
-                        thumbnail: imageData,
-                        width: newWidth,
-                        height: newHeight,
-                        format: format
-                    }};
-                }} catch (error) {{
-                    return {{
-                        success: false,
-                        error: error.toString()
-                    }};
-                }}
-            }}
-            
-            return await generateThumbnail();
-            '''
-            
-            # JavaScriptを実行
+            # プラグインに登録済みのサムネイル生成処理を、パラメータだけを送って実行
             if callback:
                 await callback({
                     "type": "progress",
@@ -632,19 +763,7 @@ class UXPBridge(PhotoshopBridge):
                     }
                 })
                 
-            result = await self.execute_script(js_script)
-            
-            # 結果を確認
-            if not isinstance(result, dict) or not result.get("success", False):
-                error_msg = result.get("error", "Unknown error") if isinstance(result, dict) else "Invalid result"
-                if callback:
-                    await callback({
-                        "type": "error",
-                        "data": {
-                            "message": f"Failed to generate thumbnail: {error_msg}"
-                        }
-                    })
-                raise RuntimeError(f"Failed to generate thumbnail: {error_msg}")
+            result = await self._run_thumbnail_action(width, height, format, quality, deadline=deadline)
             
             # 画像処理
             if callback:
@@ -660,7 +779,7 @@ class UXPBridge(PhotoshopBridge):
             # 完了通知
             response = {
                 "status": "ok",
-                "thumbnail": result.get("thumbnail", ""),
+                "thumbnail": await _thumbnail_data(result.get("thumbnail"), return_bytes),
                 "width": result.get("width", width),
                 "height": result.get("height", height),
                 "format": result.get("format", format)
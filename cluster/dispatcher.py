@@ -14,17 +14,24 @@ import logging
 import random
 import time
 import uuid
+from collections import deque
 from concurrent import futures
 from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
-from typing import Dict, List, Optional, Set, Tuple, Union, Any
+from typing import Deque, Dict, List, Optional, Set, Tuple, Union, Any
 
 # gRPCで生成されたコードをインポート（実際の実装時にはprotoからコードを生成後にインポート）
 # from .proto import photoshop_pb2, photoshop_pb2_grpc
 
 logger = logging.getLogger(__name__)
 
+# 平均レイテンシの計算に使うレイテンシ履歴の件数
+LATENCY_HISTORY_SIZE = 10
+
+# ノード選択用ヒープの古いエントリがノード数のこの倍数を超えたら作り直す
+NODE_HEAP_COMPACT_FACTOR = 4
+
 
 class NodeStatus(Enum):
     """ノードのステータスを表す列挙型"""
@@ -67,8 +74,10 @@ class Node:
     failed_jobs: int = 0
     last_heartbeat: float = 0.0
     uptime: float = 0.0
-    latency_history: List[float] = field(default_factory=list)
+    latency_history: Deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_HISTORY_SIZE))
     current_jobs: Set[str] = field(default_factory=set)
+    # レイテンシ履歴の更新時に計算した平均レイテンシ（参照のたびに合計しない）
+    _average_latency: float = field(default=float('inf'), init=False, repr=False)
     
     @property
     def address(self) -> str:
@@ -91,16 +100,14 @@ class Node:
     
     @property
     def average_latency(self) -> float:
-        """平均レイテンシを計算"""
-        if not self.latency_history:
-            return float('inf')
-        return sum(self.latency_history) / len(self.latency_history)
+        """平均レイテンシを取得（履歴がない場合はinf）"""
+        return self._average_latency
     
     def update_latency(self, latency: float):
-        """レイテンシ履歴を更新（最新の10件を保持）"""
+        """レイテンシ履歴を更新（最新の10件を保持）し、平均レイテンシを再計算"""
+        # dequeのmaxlenにより、古いレイテンシは追加時に自動的に破棄される
         self.latency_history.append(latency)
-        if len(self.latency_history) > 10:
-            self.latency_history.pop(0)
+        self._average_latency = sum(self.latency_history) / len(self.latency_history)
     
     def to_dict(self) -> Dict:
         """ノード情報を辞書形式で取得"""
@@ -170,6 +177,16 @@ class DispatcherConfig:
     cluster_id: str = field(default_factory=lambda: str(uuid.uuid4()))
 
 
+def _load_factor_key(node: Node) -> float:
+    """ノード選択で比較する負荷係数を取得"""
+    return node.load_factor
+
+
+def _average_latency_key(node: Node) -> float:
+    """ノード選択で比較する平均レイテンシを取得"""
+    return node.average_latency
+
+
 class ClusterDispatcher:
     """
     Photoshop MCPサーバーのクラスターディスパッチャー
@@ -193,6 +210,14 @@ class ClusterDispatcher:
         self.is_running = False
         self.server = None
         
+        # ジョブがキューに追加されたことをディスパッチタスクに通知するイベント
+        self._job_available = asyncio.Event()
+        # ノードが利用可能になったことを、ノードの空きを待っているディスパッチタスクに通知するイベント
+        self._node_available = asyncio.Event()
+        self._dispatch_task: Optional[asyncio.Task] = None
+        # ノードで実行中のジョブのタスク（完了まで参照を保持する）
+        self._job_tasks: Set[asyncio.Task] = set()
+        
         # 統計情報
         self.start_time = time.time()
         self.total_jobs_processed = 0
@@ -200,6 +225,12 @@ class ClusterDispatcher:
         
         # ノード選択のラウンドロビンインデックス
         self.round_robin_index = 0
+        # ラウンドロビンで巡回するノードIDの順序（ノードの登録・削除時にのみ更新）
+        self._node_ring: List[str] = []
+        # 負荷係数・平均レイテンシの小さい順にノードを取り出すヒープ（(値, node_id)）
+        # 値が変わるたびに新しいエントリを追加し、古いエントリは選択時に破棄する
+        self._load_heap: List[Tuple[float, str]] = []
+        self._latency_heap: List[Tuple[float, str]] = []
         
         logger.info(f"Dispatcher initialized with cluster ID: {self.config.cluster_id}")
     
@@ -219,7 +250,7 @@ class ClusterDispatcher:
         
         # バックグラウンドタスクの開始
         asyncio.create_task(self._health_check_task())
-        asyncio.create_task(self._job_dispatcher_task())
+        self._dispatch_task = asyncio.create_task(self._job_dispatcher_task())
         asyncio.create_task(self._cleanup_task())
         
         self.is_running = True
@@ -238,6 +269,15 @@ class ClusterDispatcher:
                 job.completed_at = time.time()
                 job.error_message = "Dispatcher shutdown"
         
+        # ディスパッチタスクと実行中のジョブのタスクの停止
+        tasks = list(self._job_tasks)
+        if self._dispatch_task is not None:
+            tasks.append(self._dispatch_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._dispatch_task = None
+        
         # gRPCサーバーの停止
         if self.server:
             await self.server.stop(0)
@@ -281,6 +321,7 @@ class ClusterDispatcher:
                     # node.status = NodeStatus(response.status.name.lower())
                     # node.active_jobs = response.active_jobs
                     # node.last_heartbeat = current_time
+                    # self._update_node_heaps(node)
                     
                     # 仮実装（gRPCコード生成前）
                     # ランダムなレイテンシとステータスを生成
@@ -290,6 +331,8 @@ class ClusterDispatcher:
                         [NodeStatus.HEALTHY, NodeStatus.DEGRADED, NodeStatus.UNHEALTHY],
                         weights=[0.8, 0.15, 0.05]
                     )[0]
+                    # 状態の更新後に反映し、利用可能になったノードを待機中のワーカーに通知する
+                    self._update_node_heaps(node)
                     node.last_heartbeat = current_time
                     
                     logger.debug(f"Health check for node {node_id}: {node.status.value}, latency: {latency:.3f}s")
@@ -327,7 +370,112 @@ class ClusterDispatcher:
                 job.started_at = None
                 
                 # キューに追加
-                heapq.heappush(self.job_queue, (-job.priority, job.created_at, job.job_id))
+                self._enqueue_job(job)
+    
+    def _enqueue_job(self, job: Job):
+        """
+        ジョブを優先度付きキューに追加し、待機中のディスパッチタスクを起こす
+        
+        Args:
+            job: キューに追加するジョブ
+        """
+        heapq.heappush(self.job_queue, (-job.priority, job.created_at, job.job_id))
+        self._job_available.set()
+    
+    async def add_job(self, job: Job):
+        """
+        ジョブを登録してディスパッチキューに追加
+        
+        Args:
+            job: 追加するジョブ
+        """
+        self.jobs[job.job_id] = job
+        self._enqueue_job(job)
+        logger.info(f"Job {job.job_id} of type {job.job_type} added to queue with priority {job.priority}")
+    
+    def _add_node(self, node: Node):
+        """
+        ノードを登録し、ラウンドロビンの巡回順序に追加
+        
+        Args:
+            node: 登録するノード
+        """
+        if node.node_id not in self.nodes:
+            self._node_ring.append(node.node_id)
+        self.nodes[node.node_id] = node
+        self._update_node_heaps(node)
+    
+    def _remove_node(self, node_id: str) -> Optional[Node]:
+        """
+        ノードを削除し、ラウンドロビンの巡回順序から取り除く
+        
+        Args:
+            node_id: 削除するノードID
+        
+        Returns:
+            削除されたノード、または存在しない場合はNone
+        """
+        node = self.nodes.pop(node_id, None)
+        if node is not None:
+            self._node_ring.remove(node_id)
+        return node
+    
+    def _update_node_heaps(self, node: Node):
+        """
+        ノードの負荷係数・平均レイテンシの変化を選択用ヒープに反映
+        
+        Args:
+            node: 負荷またはレイテンシが変化したノード
+        """
+        heapq.heappush(self._load_heap, (node.load_factor, node.node_id))
+        heapq.heappush(self._latency_heap, (node.average_latency, node.node_id))
+        if node.is_available:
+            # ノードの空きを待っているディスパッチタスクを起こす
+            self._node_available.set()
+        
+        # 古いエントリが溜まりすぎた場合は現在の値からヒープを作り直す
+        if len(self._load_heap) > NODE_HEAP_COMPACT_FACTOR * len(self.nodes) + 16:
+            self._load_heap = [(n.load_factor, n.node_id) for n in self.nodes.values()]
+            heapq.heapify(self._load_heap)
+        if len(self._latency_heap) > NODE_HEAP_COMPACT_FACTOR * len(self.nodes) + 16:
+            self._latency_heap = [(n.average_latency, n.node_id) for n in self.nodes.values()]
+            heapq.heapify(self._latency_heap)
+    
+    def _select_from_heap(self, heap: List[Tuple[float, str]], key, available_nodes: List[Node]) -> Node:
+        """
+        ヒープから値が最小の利用可能なノードを選択
+        
+        Args:
+            heap: (値, node_id)のヒープ
+            key: ノードの現在の値を取得する関数
+            available_nodes: 利用可能なノードのリスト
+        
+        Returns:
+            選択されたノード
+        """
+        available_ids = {node.node_id for node in available_nodes}
+        skipped = []
+        selected = None
+        while heap:
+            value, node_id = heap[0]
+            node = self.nodes.get(node_id)
+            if node is None or key(node) != value:
+                # 削除されたノードや値が変わったノードの古いエントリは破棄
+                heapq.heappop(heap)
+                continue
+            if node_id in available_ids:
+                selected = node
+                break
+            # 現在利用できないノードは、後で利用可能になった時のためにヒープに戻す
+            skipped.append(heapq.heappop(heap))
+        for entry in skipped:
+            heapq.heappush(heap, entry)
+        
+        if selected is None:
+            # ヒープに登録されていないノードしかない場合は全件から選択
+            return min(available_nodes, key=key)
+        return selected
+    
     def _select_node(self, job: Job, available_nodes: List[Node]) -> Optional[Node]:
         """
         ルーティング戦略に基づいてノードを選択
@@ -350,7 +498,7 @@ class ClusterDispatcher:
         
         if strategy == RoutingStrategy.LEAST_BUSY:
             # 最も忙しくないノードを選択
-            return min(available_nodes, key=lambda node: node.load_factor)
+            return self._select_from_heap(self._load_heap, _load_factor_key, available_nodes)
         
         elif strategy == RoutingStrategy.ROUND_ROBIN:
             # ラウンドロビン方式
@@ -358,14 +506,15 @@ class ClusterDispatcher:
                 return None
             
             # 現在のインデックスから開始して利用可能なノードを探す
-            start_idx = self.round_robin_index
-            for _ in range(len(self.nodes)):
-                self.round_robin_index = (self.round_robin_index + 1) % len(self.nodes)
-                node_id = list(self.nodes.keys())[self.round_robin_index]
-                node = self.nodes.get(node_id)
+            # （巡回順序は登録時に更新済みのものを使い、利用可能かどうかはセットで判定）
+            ring = self._node_ring
+            available_ids = {node.node_id for node in available_nodes}
+            for _ in range(len(ring)):
+                self.round_robin_index = (self.round_robin_index + 1) % len(ring)
+                node_id = ring[self.round_robin_index]
                 
-                if node and node in available_nodes:
-                    return node
+                if node_id in available_ids:
+                    return self.nodes[node_id]
             
             # 見つからなかった場合は最初の利用可能なノードを返す
             return available_nodes[0]
@@ -376,16 +525,16 @@ class ClusterDispatcher:
         
         elif strategy == RoutingStrategy.LOWEST_LATENCY:
             # 最も低いレイテンシのノードを選択
-            return min(available_nodes, key=lambda node: node.average_latency)
+            return self._select_from_heap(self._latency_heap, _average_latency_key, available_nodes)
         
         elif strategy == RoutingStrategy.CAPABILITY_BASED:
             # 機能ベースの選択（ジョブタイプに応じた機能を持つノードを選択）
             # 実際の実装ではジョブタイプと機能の対応を定義
             # この例では単純化のため、最も忙しくないノードを選択
-            return min(available_nodes, key=lambda node: node.load_factor)
+            return self._select_from_heap(self._load_heap, _load_factor_key, available_nodes)
         
         # デフォルトは最も忙しくないノード
-        return min(available_nodes, key=lambda node: node.load_factor)
+        return self._select_from_heap(self._load_heap, _load_factor_key, available_nodes)
     
     async def _assign_job_to_node(self, job: Job, node: Node):
         """
@@ -401,6 +550,7 @@ class ClusterDispatcher:
 # ノードの状態を更新
         node.active_jobs += 1
         node.current_jobs.add(job.job_id)
+        self._update_node_heaps(node)
         
         logger.info(f"Job {job.job_id} assigned to node {node.node_id}")
         
@@ -429,7 +579,9 @@ class ClusterDispatcher:
             
             # 仮実装（gRPCコード生成前）
             # ジョブの実行をシミュレート
-            asyncio.create_task(self._simulate_job_execution(job, node))
+            task = asyncio.create_task(self._simulate_job_execution(job, node))
+            self._job_tasks.add(task)
+            task.add_done_callback(lambda task: self._job_task_done(task, job, node))
         
         except Exception as e:
             logger.error(f"Failed to send job {job.job_id} to node {node.node_id}: {e}")
@@ -442,9 +594,40 @@ class ClusterDispatcher:
             # ノードの状態を更新
             node.active_jobs = max(0, node.active_jobs - 1)
             node.current_jobs.remove(job.job_id)
+            self._update_node_heaps(node)
             
             # キューに追加
-            heapq.heappush(self.job_queue, (-job.priority, job.created_at, job.job_id))
+            self._enqueue_job(job)
+    
+    def _job_task_done(self, task: asyncio.Task, job: Job, node: Node):
+        """
+        ノードで実行したジョブのタスクの完了を処理
+        
+        タスクが例外で終了した場合は、ジョブを失敗として記録しノードの割り当てを解放します。
+        
+        Args:
+            task: 完了したタスク
+            job: 実行したジョブ
+            node: 実行先のノード
+        """
+        self._job_tasks.discard(task)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is None:
+            return
+        
+        logger.error(f"Job {job.job_id} raised an error on node {node.node_id}: {error}")
+        if job.status not in [JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED]:
+            job.status = JobStatus.FAILED
+            job.completed_at = time.time()
+            job.error_message = str(error)
+            self.total_jobs_failed += 1
+            node.failed_jobs += 1
+        if job.job_id in node.current_jobs:
+            node.active_jobs = max(0, node.active_jobs - 1)
+            node.current_jobs.discard(job.job_id)
+            self._update_node_heaps(node)
     
     async def _simulate_job_execution(self, job: Job, node: Node):
         """
@@ -486,6 +669,7 @@ class ClusterDispatcher:
         # ノードの状態を更新
         node.active_jobs = max(0, node.active_jobs - 1)
         node.current_jobs.remove(job.job_id)
+        self._update_node_heaps(node)
         
         logger.info(f"Job {job.job_id} {job.status.value} on node {node.node_id}")
     
@@ -516,7 +700,7 @@ class ClusterDispatcher:
             if node.status == NodeStatus.UNHEALTHY:
                 if current_time - node.last_heartbeat > unhealthy_threshold:
                     logger.info(f"Removing unhealthy node {node_id} that has been down for too long")
-                    self.nodes.pop(node_id, None)
+                    self._remove_node(node_id)
     
     # gRPCサービスメソッド（実際の実装時にはphotoshop_pb2_grpcから生成されたクラスを継承）
     
@@ -548,7 +732,7 @@ class ClusterDispatcher:
     #             status=NodeStatus.HEALTHY,
     #             last_heartbeat=time.time()
     #         )
-    #         self.nodes[node_id] = node
+    #         self._add_node(node)
     #     
     #     return photoshop_pb2.RegisterNodeResponse(
     #         success=True,
@@ -566,7 +750,7 @@ class ClusterDispatcher:
     #         await self._requeue_node_jobs(node_id)
     #         
     #         # ノードの削除
-    #         self.nodes.pop(node_id)
+    #         self._remove_node(node_id)
     #         logger.info(f"Node {node_id} unregistered")
     #         
     #         return photoshop_pb2.UnregisterNodeResponse(success=True)
@@ -617,7 +801,7 @@ class ClusterDispatcher:
     #     self.jobs[job_id] = job
     #     
     #     # キューに追加
-    #     heapq.heappush(self.job_queue, (-job.priority, job.created_at, job.job_id))
+    #     self._enqueue_job(job)
     #     
     #     logger.info(f"Job {job_id} of type {request.job_type} added to queue with priority {request.priority}")
     #     
@@ -715,6 +899,7 @@ class ClusterDispatcher:
         # ノードの状態を更新
         node.active_jobs += 1
         node.current_jobs.add(job.job_id)
+        self._update_node_heaps(node)
         
         logger.info(f"Job {job.job_id} assigned to node {node.node_id}")
         
@@ -756,9 +941,10 @@ class ClusterDispatcher:
             # ノードの状態を更新
             node.active_jobs = max(0, node.active_jobs - 1)
             node.current_jobs.remove(job.job_id)
+            self._update_node_heaps(node)
             
             # キューに追加
-            heapq.heappush(self.job_queue, (-job.priority, job.created_at, job.job_id))
+            self._enqueue_job(job)
     
     async def _simulate_job_execution(self, job: Job, node: Node):
         """
@@ -800,6 +986,7 @@ class ClusterDispatcher:
         # ノードの状態を更新
         node.active_jobs = max(0, node.active_jobs - 1)
         node.current_jobs.remove(job.job_id)
+        self._update_node_heaps(node)
         
         logger.info(f"Job {job.job_id} {job.status.value} on node {node.node_id}")
     
@@ -830,7 +1017,7 @@ class ClusterDispatcher:
             if node.status == NodeStatus.UNHEALTHY:
                 if current_time - node.last_heartbeat > unhealthy_threshold:
                     logger.info(f"Removing unhealthy node {node_id} that has been down for too long")
-                    self.nodes.pop(node_id, None)
+                    self._remove_node(node_id)
     
     # gRPCサービスメソッド（実際の実装時にはphotoshop_pb2_grpcから生成されたクラスを継承）
     
@@ -862,7 +1049,7 @@ class ClusterDispatcher:
     #             status=NodeStatus.HEALTHY,
     #             last_heartbeat=time.time()
     #         )
-    #         self.nodes[node_id] = node
+    #         self._add_node(node)
     #     
     #     return photoshop_pb2.RegisterNodeResponse(
     #         success=True,
@@ -880,7 +1067,7 @@ class ClusterDispatcher:
     #         await self._requeue_node_jobs(node_id)
     #         
     #         # ノードの削除
-    #         self.nodes.pop(node_id)
+    #         self._remove_node(node_id)
     #         logger.info(f"Node {node_id} unregistered")
     #         
     #         return photoshop_pb2.UnregisterNodeResponse(success=True)
@@ -931,7 +1118,7 @@ class ClusterDispatcher:
     #     self.jobs[job_id] = job
     #     
     #     # キューに追加
-    #     heapq.heappush(self.job_queue, (-job.priority, job.created_at, job.job_id))
+    #     self._enqueue_job(job)
     #     
     #     logger.info(f"Job {job_id} of type {request.job_type} added to queue with priority {request.priority}")
     #     
@@ -1031,16 +1218,20 @@ class ClusterDispatcher:
                 node.active_jobs = max(0, node.active_jobs - 1)
     
     async def _job_dispatcher_task(self):
-        """ジョブをノードに割り当てるタスク"""
+        """キューのジョブをノードに割り当てるタスク"""
         while self.is_running:
             if not self.job_queue:
-                await asyncio.sleep(0.1)
+                # キューが空の間はポーリングせず、ジョブの追加を待つ
+                self._job_available.clear()
+                await self._job_available.wait()
                 continue
             
             # 利用可能なノードを取得
             available_nodes = [node for node in self.nodes.values() if node.is_available]
             if not available_nodes:
-                await asyncio.sleep(0.1)
+                # 空いているノードがない間はポーリングせず、ノードの登録やジョブの完了を待つ
+                self._node_available.clear()
+                await self._node_available.wait()
                 continue
             
             # キューからジョブを取得
@@ -1053,12 +1244,13 @@ class ClusterDispatcher:
             # ルーティング戦略に基づいてノードを選択
             selected_node = self._select_node(job, available_nodes)
             if not selected_node:
-                # 適切なノードが見つからない場合は再キューイング
-                heapq.heappush(self.job_queue, (-job.priority, job.created_at, job.job_id))
-                await asyncio.sleep(0.1)
+                # 適切なノードが見つからない場合は再キューイングし、ノードの状態が変わるのを待つ
+                self._enqueue_job(job)
+                self._node_available.clear()
+                await self._node_available.wait()
                 continue
             
             # ジョブをノードに割り当て
             await self._assign_job_to_node(job, selected_node)
             
-            await asyncio.sleep(0.01)  # 短い待機で他のタスクに制御を渡す
\ No newline at end of file
+            await asyncio.sleep(0)  # 他のタスクに制御を渡す
\ No newline at end of file
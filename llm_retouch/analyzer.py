@@ -182,7 +182,7 @@ class ImageAnalyzer:
         
         try:
             # モデルを使用して画像を分析
-            analysis = self.model.analyze_image(image_path, prompt)
+            analysis = await self.model.analyze_image(image_path, prompt)
             
             # 分析結果をログに記録
             logger.debug(f"分析結果: {json.dumps(analysis, indent=2, ensure_ascii=False)}")
@@ -242,7 +242,7 @@ class ImageAnalyzer:
         """
         
         logger.info(f"構図分析を開始: {image_path}")
-        return self.model.analyze_image(image_path, composition_prompt)
+        return await self.model.analyze_image(image_path, composition_prompt)
     
     async def analyze_color(self, image_path: str) -> Dict[str, Any]:
         """
@@ -273,7 +273,7 @@ class ImageAnalyzer:
         """
         
         logger.info(f"色調分析を開始: {image_path}")
-        return self.model.analyze_image(image_path, color_prompt)
+        return await self.model.analyze_image(image_path, color_prompt)
     
     async def analyze_subject(self, image_path: str, subject_type: str = "auto") -> Dict[str, Any]:
         """
@@ -375,4 +375,4 @@ class ImageAnalyzer:
             """
         
         logger.info(f"被写体分析を開始: {image_path} (タイプ: {subject_type})")
-        return self.model.analyze_image(image_path, prompt)
\ No newline at end of file
+        return await self.model.analyze_image(image_path, prompt)
\ No newline at end of file
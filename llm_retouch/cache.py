@@ -0,0 +1,411 @@
+"""
+LLM Response Cache
+
+This module provides a persistent cache for vision model responses.
+"""
+
+import os
+import copy
+import json
+import asyncio
+import time
+import sqlite3
+import hashlib
+import logging
+import functools
+import threading
+import unicodedata
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+try:
+    import numpy as np
+except ImportError:  # 意味的キャッシュはnumpyが必要
+    np = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # 意味的キャッシュはsentence-transformersが必要
+    SentenceTransformer = None
+
+# ロガーの設定
+logger = logging.getLogger(__name__)
+
+# デフォルトのキャッシュディレクトリ
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".photoshop_mcp_server", "cache")
+
+# デフォルトの最大エントリ数
+DEFAULT_MAX_ENTRIES = 1000
+
+# レスポンスキャッシュのデフォルトの有効期間（秒、環境変数 LLM_RESPONSE_CACHE_TTL で変更可能）
+DEFAULT_RESPONSE_TTL = float(os.environ.get("LLM_RESPONSE_CACHE_TTL", 86400))
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    プロンプトを正規化する（Unicode NFC正規化と前後の空白の除去）
+    
+    空白や合成文字の表記揺れでキャッシュがヒットしなくなることを防ぎます。
+    
+    Args:
+        prompt: プロンプト
+    
+    Returns:
+        正規化されたプロンプト
+    """
+    return unicodedata.normalize("NFC", prompt).strip()
+
+def make_cache_key(image_sha256: str, model: str, method: str, *parts: Any) -> str:
+    """
+    レスポンスキャッシュのキーを計算する
+    
+    Args:
+        image_sha256: 画像データのSHA-256
+        model: モデル名
+        method: 呼び出したメソッド名
+        *parts: プロンプトなどキーに含める値（文字列は正規化、それ以外は正規化JSON化）
+    
+    Returns:
+        SHA-256キー（16進文字列）
+    """
+    hasher = hashlib.sha256()
+    hasher.update(image_sha256.encode("utf-8"))
+    hasher.update(b"\0")
+    hasher.update(json.dumps({"model": model, "method": method}, sort_keys=True).encode("utf-8"))
+    for part in parts:
+        hasher.update(b"\0")
+        if isinstance(part, str):
+            hasher.update(normalize_prompt(part).encode("utf-8"))
+        else:
+            hasher.update(json.dumps(part, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    return hasher.hexdigest()
+
+class ResponseCache:
+    """SQLiteを使用した永続レスポンスキャッシュ（有効期限付き、LRU方式で古いエントリを削除）"""
+    
+    def __init__(self,
+                 cache_dir: Optional[str] = None,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 ttl: float = DEFAULT_RESPONSE_TTL):
+        """
+        初期化
+        
+        Args:
+            cache_dir: キャッシュディレクトリ（Noneの場合はデフォルト）
+            max_entries: 保持する最大エントリ数
+            ttl: エントリの有効期間（秒）
+        """
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # 読み込み時の最終アクセス時刻（ディスクには次回の書き込み時にまとめて反映する）
+        self._accessed: Dict[str, float] = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.db_path = os.path.join(self.cache_dir, "responses.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed)")
+        self._conn.commit()
+        logger.info(f"レスポンスキャッシュを初期化しました: {self.db_path}")
+    
+    def get(self, key: str) -> Optional[Any]:
+        """
+        キャッシュからレスポンスを取得する
+        
+        Args:
+            key: キャッシュキー
+        
+        Returns:
+            キャッシュされたレスポンス、または存在しない場合はNone
+        """
+        now = time.time()
+        with self._lock:
+            # 有効期限を過ぎたエントリはヒットとして扱わない（削除は次回の書き込み時に行う）
+            row = self._conn.execute(
+                "SELECT value FROM responses WHERE key = ? AND created >= ?",
+                (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            # 読み込みのたびにコミットしないよう、最終アクセス時刻はメモリ上に記録する
+            self._accessed[key] = now
+        return json.loads(row[0])
+    
+    def set(self, key: str, value: Any) -> None:
+        """
+        レスポンスをキャッシュに保存する
+        
+        Args:
+            key: キャッシュキー
+            value: JSONシリアライズ可能なレスポンス
+        """
+        now = time.time()
+        serialized = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            # 読み込み時に記録した最終アクセス時刻を反映してからLRUの削除を行う
+            if self._accessed:
+                self._conn.executemany(
+                    "UPDATE responses SET accessed = ? WHERE key = ?",
+                    [(accessed, accessed_key) for accessed_key, accessed in self._accessed.items()]
+                )
+                self._accessed.clear()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, serialized, now, now)
+            )
+            # 有効期限を過ぎたエントリを削除
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            # 最大エントリ数を超えた分を最終アクセスの古い順に削除
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+    
+    def clear(self) -> None:
+        """キャッシュをすべて削除する"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._accessed.clear()
+    
+    def close(self) -> None:
+        """データベース接続を閉じる"""
+        with self._lock:
+            self._conn.close()
+
+# 共有レスポンスキャッシュ
+_response_cache: Optional[ResponseCache] = None
+_response_cache_initialized = False
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    共有レスポンスキャッシュを取得する
+    
+    キャッシュは既定では無効で、環境変数 LLM_RESPONSE_CACHE に "1" を指定すると有効になります。
+    エントリの有効期間は LLM_RESPONSE_CACHE_TTL（秒）で指定できます。
+    
+    Returns:
+        ResponseCacheインスタンス、または無効な場合はNone
+    """
+    global _response_cache, _response_cache_initialized
+    if not _response_cache_initialized:
+        _response_cache_initialized = True
+        if os.environ.get("LLM_RESPONSE_CACHE", "0") == "1":
+            try:
+                _response_cache = ResponseCache()
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"レスポンスキャッシュを初期化できませんでした: {e}")
+    return _response_cache
+
+def cached_response(method: Callable) -> Callable:
+    """
+    モデルのAPI呼び出しメソッドの結果をレスポンスキャッシュに保存するデコレーター
+    
+    キャッシュキーはモデルの _response_cache_key で計算されます。
+    呼び出し時に bypass_cache=True を指定するとキャッシュを使用しません。
+    
+    Args:
+        method: (self, image_path, ...) を引数に取る非同期メソッド
+    
+    Returns:
+        デコレートされたメソッド
+    """
+    @functools.wraps(method)
+    async def wrapper(self, image_path: str, *args: Any, bypass_cache: bool = False, **kwargs: Any) -> Any:
+        cache = get_response_cache()
+        if bypass_cache or cache is None:
+            return await method(self, image_path, *args, **kwargs)
+        
+        # 画像の読み込みとエンコードはイベントループの外で済ませてからキーを計算する
+        await self._load_image(image_path)
+        key = self._response_cache_key(method.__name__, image_path, *args, *sorted(kwargs.items()))
+        # SQLiteへのアクセスはブロッキングのためスレッドで実行する
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            logger.debug(f"レスポンスキャッシュにヒット: {method.__name__}")
+            return cached
+        
+        result = await method(self, image_path, *args, **kwargs)
+        await asyncio.to_thread(cache.set, key, result)
+        return result
+    
+    return wrapper
+
+class SemanticCache:
+    """
+    言い換えられた指示に対してレスポンスを再利用する意味的キャッシュ
+    
+    指示文を埋め込みベクトルに変換し、同じスコープ（同一画像・同一分析結果など）に保存済みの
+    指示とのコサイン類似度がしきい値以上であれば、そのレスポンスを返します。
+    """
+    
+    def __init__(self,
+                 cache_dir: Optional[str] = None,
+                 threshold: float = 0.93,
+                 model_name: str = "all-MiniLM-L6-v2",
+                 max_entries_per_scope: int = 64):
+        """
+        初期化
+        
+        Args:
+            cache_dir: キャッシュディレクトリ（Noneの場合はデフォルト）
+            threshold: キャッシュヒットとみなすコサイン類似度のしきい値
+            model_name: sentence-transformersの埋め込みモデル名
+            max_entries_per_scope: スコープごとに保持する最大エントリ数
+        """
+        if np is None or SentenceTransformer is None:
+            raise ImportError("SemanticCache requires numpy and sentence-transformers")
+        
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.threshold = threshold
+        self.max_entries_per_scope = max_entries_per_scope
+        self._model = SentenceTransformer(model_name)
+        # スコープ -> (埋め込み行列, レスポンスのリスト)
+        self._entries: Dict[str, Tuple["np.ndarray", List[Any]]] = {}
+        
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.db_path = os.path.join(self.cache_dir, "semantic.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, scope TEXT NOT NULL, vector BLOB NOT NULL, value TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_scope ON entries (scope)")
+        self._conn.commit()
+        logger.info(f"意味的キャッシュを初期化しました: {self.db_path} (threshold: {threshold})")
+    
+    def _embed(self, text: str) -> "np.ndarray":
+        """
+        テキストを正規化済みの埋め込みベクトルに変換する
+        
+        Args:
+            text: テキスト
+            
+        Returns:
+            L2正規化された埋め込みベクトル
+        """
+        vector = self._model.encode(normalize_prompt(text), normalize_embeddings=True)
+        return np.asarray(vector, dtype=np.float32)
+    
+    def _load_scope(self, scope: str) -> Tuple["np.ndarray", List[Any]]:
+        """
+        スコープのエントリをディスクから読み込む（読み込み済みの場合はメモリから返す）
+        
+        Args:
+            scope: スコープキー
+            
+        Returns:
+            (埋め込み行列, レスポンスのリスト)
+        """
+        entries = self._entries.get(scope)
+        if entries is None:
+            rows = self._conn.execute(
+                "SELECT vector, value FROM entries WHERE scope = ? ORDER BY id", (scope,)
+            ).fetchall()
+            if rows:
+                matrix = np.stack([np.frombuffer(row[0], dtype=np.float32) for row in rows])
+                values = [json.loads(row[1]) for row in rows]
+            else:
+                matrix = np.empty((0, 0), dtype=np.float32)
+                values = []
+            entries = (matrix, values)
+            self._entries[scope] = entries
+        return entries
+    
+    def get(self, scope: str, text: str) -> Optional[Any]:
+        """
+        類似した指示に対するレスポンスを取得する
+        
+        Args:
+            scope: スコープキー（画像のハッシュなど、一致が必須の条件）
+            text: 指示文
+            
+        Returns:
+            キャッシュされたレスポンス、または類似エントリがない場合はNone
+        """
+        vector = self._embed(text)
+        with self._lock:
+            matrix, values = self._load_scope(scope)
+            if not values:
+                return None
+            # 正規化済みベクトルの内積がコサイン類似度になる
+            similarities = matrix @ vector
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                return None
+            logger.debug(f"意味的キャッシュにヒット (similarity: {similarity:.3f})")
+            # 呼び出し元が結果を変更してもキャッシュに影響しないようにコピーを返す
+            return copy.deepcopy(values[best])
+    
+    def set(self, scope: str, text: str, value: Any) -> None:
+        """
+        指示文とレスポンスをキャッシュに保存する
+        
+        Args:
+            scope: スコープキー
+            text: 指示文
+            value: JSONシリアライズ可能なレスポンス
+        """
+        vector = self._embed(text)
+        serialized = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            matrix, values = self._load_scope(scope)
+            matrix = np.vstack([matrix, vector]) if values else vector[np.newaxis, :]
+            values = values + [json.loads(serialized)]
+            if len(values) > self.max_entries_per_scope:
+                matrix = matrix[-self.max_entries_per_scope:]
+                values = values[-self.max_entries_per_scope:]
+            self._entries[scope] = (matrix, values)
+            
+            self._conn.execute(
+                "INSERT INTO entries (scope, vector, value) VALUES (?, ?, ?)",
+                (scope, vector.tobytes(), serialized)
+            )
+            # スコープごとの最大エントリ数を超えた古いエントリを削除
+            self._conn.execute(
+                "DELETE FROM entries WHERE scope = ? AND id NOT IN ("
+                "SELECT id FROM entries WHERE scope = ? ORDER BY id DESC LIMIT ?)",
+                (scope, scope, self.max_entries_per_scope)
+            )
+            self._conn.commit()
+    
+    def clear(self) -> None:
+        """キャッシュをすべて削除する"""
+        with self._lock:
+            self._entries.clear()
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+
+# 共有意味的キャッシュ
+_semantic_cache: Optional[SemanticCache] = None
+_semantic_cache_initialized = False
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """
+    共有意味的キャッシュを取得する
+    
+    埋め込みモデルの読み込みが重いため、環境変数 LLM_SEMANTIC_CACHE に "1" を指定した場合のみ有効になります。
+    しきい値は LLM_SEMANTIC_CACHE_THRESHOLD で変更できます。
+    
+    Returns:
+        SemanticCacheインスタンス、または無効な場合はNone
+    """
+    global _semantic_cache, _semantic_cache_initialized
+    if not _semantic_cache_initialized:
+        _semantic_cache_initialized = True
+        if os.environ.get("LLM_SEMANTIC_CACHE", "0") == "1":
+            try:
+                threshold = float(os.environ.get("LLM_SEMANTIC_CACHE_THRESHOLD", 0.93))
+                _semantic_cache = SemanticCache(threshold=threshold)
+            except (ImportError, OSError, ValueError, sqlite3.Error) as e:
+                logger.warning(f"意味的キャッシュを初期化できませんでした: {e}")
+    return _semantic_cache
@@ -5,12 +5,29 @@ This module generates Photoshop retouch instructions based on image analysis.
 """
 
 import os
+import copy
+import hashlib
 import logging
-from typing import Dict, Any, List, Optional, Union
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple, Union, AsyncIterator
+import re
 import json
 import asyncio
+from string import Template
 
-from .models import get_model, ModelType, BaseVisionModel
+try:
+    import orjson
+except ImportError:  # orjsonが利用できない場合は標準のjsonを使用
+    orjson = None
+
+try:
+    import fastjsonschema
+except ImportError:  # fastjsonschemaが利用できない場合は簡易バリデーターを使用
+    fastjsonschema = None
+
+from .models import get_model, ModelType, BaseVisionModel, load_image_payload
+from .cache import SemanticCache, get_semantic_cache
 
 # プロンプトのインポート
 from .prompts.retouch import get_retouch_command_prompt
@@ -207,20 +224,619 @@ RETOUCH_STYLE_TEMPLATES = {
     """
 }
 
+# レタッチコマンド生成用プロンプトの雛形（インポート時に一度だけ構築）
+_GENERATE_PROMPT_TEXT = """
+            $base_prompt
+            
+            $style_prompt
+            
+            画像分析結果:
+            ```json
+            $analysis_json
+            ```
+            
+            ユーザー指示:
+            $user_instructions
+            
+            上記の情報に基づいて、Photoshopで実行可能なレタッチコマンドを生成してください。
+            """
+
+def _build_generate_templates() -> Dict[Tuple[bool, Optional[str]], Template]:
+    """
+    詳細モードとスタイルの組み合わせごとに、固定部分を埋め込んだテンプレートを構築する
+    
+    Returns:
+        (advanced, style) -> テンプレートの辞書
+    """
+    templates = {}
+    for advanced, base_prompt in ((False, BASIC_RETOUCH_PROMPT), (True, ADVANCED_RETOUCH_PROMPT)):
+        styles: Dict[Optional[str], str] = {None: ""}
+        styles.update(
+            (style, f"\nStyle Instructions: {style_template}")
+            for style, style_template in RETOUCH_STYLE_TEMPLATES.items()
+        )
+        for style, style_prompt in styles.items():
+            text = Template(_GENERATE_PROMPT_TEXT).safe_substitute(
+                base_prompt=base_prompt,
+                style_prompt=style_prompt
+            )
+            templates[(advanced, style)] = Template(text)
+    return templates
+
+_GENERATE_TEMPLATES = _build_generate_templates()
+
+_CUSTOM_PROMPT_TEMPLATE = Template("""
+            画像分析結果:
+            ```json
+            $analysis_json
+            ```
+            
+            $custom_prompt
+            
+            上記の情報に基づいて、Photoshopで実行可能なレタッチコマンドをJSON形式で生成してください。
+            """)
+
+_DEFAULT_USER_INSTRUCTIONS = "特に指示はありません。画像分析結果に基づいて最適なレタッチを行ってください。"
+
+_PORTRAIT_TEMPLATE = Template("""
+        この画像のポートレートレタッチを行ってください。
+        
+        美肌レタッチレベル: $beauty_level/5（1=最小限、5=最大限）
+        個性の保持: $preserve_identity
+        
+        以下の要素に注目してレタッチしてください：
+        1. 肌の質感改善（しわ、毛穴、にきびなどの軽減）
+        2. 肌のトーン均一化
+        3. 目の明るさと鮮明さの強調
+        4. 髪の毛の質感と色の改善
+        5. 顔の輪郭の微調整（必要な場合）
+        6. 全体的な照明とコントラストの最適化
+        7. 背景の改善または調整
+        
+        各調整について、具体的なPhotoshopコマンドとパラメータを提供してください。
+        美肌レタッチは自然な仕上がりを心がけ、過度な処理は避けてください。
+        """)
+
+_LANDSCAPE_TEMPLATE = Template("""
+        この風景写真のレタッチを行ってください。
+        
+        スタイル: $style
+        空の強調: $enhance_sky
+        前景の強調: $enhance_foreground
+        
+        以下の要素に注目してレタッチしてください：
+        1. 全体的な露出とコントラストの最適化
+        2. 色彩の強調と調整
+        3. 空の処理（色、コントラスト、雲の詳細）
+        4. 前景の処理（ディテール、コントラスト、色彩）
+        5. 中間領域の処理
+        6. 霞や大気遠近法の調整
+        7. 全体的な色調の統一
+        
+        各調整について、具体的なPhotoshopコマンドとパラメータを提供してください。
+        """)
+
+_PRODUCT_TEMPLATE = Template("""
+        この商品写真のレタッチを行ってください。
+        
+        背景のクリーンアップ: $clean_background
+        商品詳細の強調: $enhance_details
+        
+        以下の要素に注目してレタッチしてください：
+        1. 商品の色彩と質感の正確な表現
+        2. 商品のディテールと鮮明さの強調
+        3. 適切な露出とコントラストの調整
+        4. 背景の処理（クリーンアップ、単色化、または適切な調整）
+        5. 商品のハイライトと影の最適化
+        6. 商品の輪郭の明確化
+        7. 全体的な商品の魅力向上
+        
+        各調整について、具体的なPhotoshopコマンドとパラメータを提供してください。
+        商品の実際の色や質感を正確に表現することを優先してください。
+        """)
+
+# ストリーム中のコマンド配列の開始位置（"commands": [ または "retouch_commands": [）
+_COMMANDS_ARRAY_PATTERN = re.compile(r'"(?:retouch_)?commands"\s*:\s*\[')
+
+class _CommandStreamParser:
+    """
+    LLMのJSON出力からコマンド配列の要素を逐次取り出すインクリメンタルパーサー
+    
+    文字列リテラルとエスケープを考慮して括弧の深さを追跡し、
+    配列直下のオブジェクトが閉じた時点でそのオブジェクトだけをパースします。
+    """
+    
+    def __init__(self):
+        """初期化"""
+        self._buffer = ""
+        self._pos = 0
+        self._search_from = 0
+        self._depth = 0
+        self._item_start = -1
+        self._in_string = False
+        self._escape = False
+        self.found_array = False
+        self.finished = False
+    
+    @property
+    def text(self) -> str:
+        """これまでに受信したテキスト全体"""
+        return self._buffer
+    
+    def feed(self, chunk: str) -> List[Any]:
+        """
+        テキスト断片を追加し、新たに完成した配列要素を返す
+        
+        Args:
+            chunk: LLM出力のテキスト断片
+            
+        Returns:
+            パースが完了した配列要素のリスト
+        """
+        self._buffer += chunk
+        if self.finished:
+            return []
+        
+        buffer = self._buffer
+        if not self.found_array:
+            match = _COMMANDS_ARRAY_PATTERN.search(buffer, self._search_from)
+            if match is None:
+                # キーが断片の境界で分割されている可能性があるため少し手前から再検索する
+                self._search_from = max(0, len(buffer) - 32)
+                return []
+            self.found_array = True
+            self._pos = match.end()
+        
+        items = []
+        i = self._pos
+        length = len(buffer)
+        while i < length:
+            ch = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{" or ch == "[":
+                if self._depth == 0:
+                    self._item_start = i
+                self._depth += 1
+            elif ch == "}" or ch == "]":
+                if self._depth == 0:
+                    # コマンド配列の終端
+                    self.finished = True
+                    i += 1
+                    break
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        items.append(json.loads(buffer[self._item_start:i + 1]))
+                    except json.JSONDecodeError as e:
+                        logger.warning(f"ストリーム中のコマンドのパースに失敗: {e}")
+            i += 1
+        self._pos = i
+        return items
+
+# レタッチコマンドキャッシュの最大エントリ数
+COMMAND_CACHE_SIZE = 512
+
+# モデル呼び出しの最大同時実行数（環境変数 LLM_RETOUCH_PARALLEL で変更可能）
+LLM_RETOUCH_PARALLEL = int(os.environ.get("LLM_RETOUCH_PARALLEL", 8))
+
+# 画像読み込みなどのブロッキング処理をイベントループ外で実行するスレッドプール（すべてのインスタンスで共有する）
+_RETOUCH_EXECUTOR = ThreadPoolExecutor(max_workers=LLM_RETOUCH_PARALLEL, thread_name_prefix="llm-retouch")
+
+def _serialize_analysis(analysis_result: Dict[str, Any]) -> str:
+    """
+    分析結果をキーをソートした正規化JSON文字列に変換する
+    
+    プロンプトへの埋め込みとキャッシュキーの計算の両方に同じ文字列を使用します。
+    
+    Args:
+        analysis_result: 画像分析結果
+        
+    Returns:
+        インデント付きの正規化JSON文字列
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                analysis_result,
+                option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+                default=str
+            ).decode("utf-8")
+        except TypeError:
+            # orjsonで扱えない値（64ビットを超える整数など）は標準のjsonで処理
+            pass
+    try:
+        return json.dumps(analysis_result, ensure_ascii=False, indent=2, sort_keys=True, default=str)
+    except TypeError:
+        # 型の異なるキーが混在してソートできない場合は元の順序を使用
+        return json.dumps(analysis_result, ensure_ascii=False, indent=2, default=str)
+
+def _analysis_digest(analysis_json: str) -> str:
+    """
+    正規化済みの分析結果JSONからキャッシュキー用のダイジェストを計算する
+    
+    Args:
+        analysis_json: _serialize_analysisで生成したJSON文字列
+        
+    Returns:
+        16バイトのBLAKE2bダイジェスト（16進文字列）
+    """
+    return hashlib.blake2b(analysis_json.encode("utf-8"), digest_size=16).hexdigest()
+
+# レタッチコマンドのJSONスキーマ
+_COMMAND_SCHEMA = {
+    "type": "object",
+    "required": ["type", "params"],
+    "properties": {
+        "type": {"type": "string"},
+        "params": {"type": "object"},
+        "purpose": {"type": "string"},
+        "order": {"type": "integer"},
+        "layer_name": {"type": "string"},
+        "blend_mode": {"type": "string"},
+        "opacity": {"type": "number"},
+        "mask": {"type": "boolean"},
+        "mask_instructions": {"type": "string"}
+    }
+}
+
+# JSONスキーマの型名とPythonの型の対応（boolはint/floatとして扱わない）
+_JSON_TYPE_CHECKS = {
+    "string": lambda value: type(value) is str,
+    "object": lambda value: type(value) is dict,
+    "integer": lambda value: type(value) is int,
+    "number": lambda value: type(value) is int or type(value) is float,
+    "boolean": lambda value: type(value) is bool
+}
+
+def _compile_command_validator():
+    """
+    レタッチコマンドのバリデーターを構築する
+    
+    fastjsonschemaが利用可能な場合はスキーマをコンパイルし、
+    利用できない場合は同じスキーマを解釈する簡易バリデーターを返します。
+    
+    Returns:
+        コマンドが有効な場合にTrueを返す関数
+    """
+    if fastjsonschema is not None:
+        validate = fastjsonschema.compile(_COMMAND_SCHEMA)
+        exception_type = fastjsonschema.JsonSchemaException
+        
+        def is_valid(cmd: Any) -> bool:
+            try:
+                validate(cmd)
+                return True
+            except exception_type:
+                return False
+        
+        return is_valid
+    
+    required = tuple(_COMMAND_SCHEMA["required"])
+    property_checks = tuple(
+        (name, _JSON_TYPE_CHECKS[spec["type"]])
+        for name, spec in _COMMAND_SCHEMA["properties"].items()
+    )
+    
+    def is_valid(cmd: Any) -> bool:
+        if type(cmd) is not dict:
+            return False
+        for name in required:
+            if name not in cmd:
+                return False
+        for name, check in property_checks:
+            if name in cmd and not check(cmd[name]):
+                return False
+        return True
+    
+    return is_valid
+
+_is_valid_command = _compile_command_validator()
+
+def _validate_commands(commands: List[Any]) -> List[Dict[str, Any]]:
+    """
+    スキーマに適合するレタッチコマンドのみを残す
+    
+    Args:
+        commands: コマンド候補のリスト
+        
+    Returns:
+        検証済みのコマンドリスト
+    """
+    is_valid = _is_valid_command
+    validated = [cmd for cmd in commands if is_valid(cmd)]
+    skipped = len(commands) - len(validated)
+    if skipped:
+        logger.warning(f"無効なコマンド形式をスキップ: {skipped} 件")
+    return validated
+
+def _extract_and_validate(commands_data: Any) -> List[Dict[str, Any]]:
+    """
+    モデルのレスポンスからコマンドリストを取り出して検証する
+    
+    "commands"、"retouch_commands"、トップレベルの値の順にコマンドリストを探します。
+    
+    Args:
+        commands_data: モデルが返したJSONデータ
+        
+    Returns:
+        検証済みのコマンドリスト
+    """
+    if type(commands_data) is dict:
+        if "commands" in commands_data:
+            commands = commands_data["commands"]
+        else:
+            # フォールバック: トップレベルの値を使用
+            commands = commands_data.get("retouch_commands") or list(commands_data.values())
+    else:
+        commands = commands_data
+    if type(commands) is not list:
+        return []
+    return _validate_commands(commands)
+
+# 共有ジェネレーターインスタンス（モデルタイプ -> インスタンス）
+_SHARED_GENERATORS: Dict[str, "RetouchCommandGenerator"] = {}
+
 class RetouchCommandGenerator:
     """レタッチコマンド生成クラス"""
     
-    def __init__(self, model_type: Union[ModelType, str] = ModelType.GPT4_VISION, api_key: Optional[str] = None):
+    def __init__(self,
+                 model_type: Union[ModelType, str] = ModelType.GPT4_VISION,
+                 api_key: Optional[str] = None,
+                 semantic_cache: Optional[SemanticCache] = None):
         """
         初期化
         
         Args:
             model_type: 使用するモデルタイプ
             api_key: APIキー（Noneの場合は環境変数から取得）
+            semantic_cache: 言い換えられた指示に結果を再利用する意味的キャッシュ（Noneの場合は共有設定を使用）
         """
         self.model = get_model(model_type, api_key)
+        self._semantic_cache = semantic_cache or get_semantic_cache()
+        # 生成済みコマンドのLRUキャッシュ（キャッシュキー -> 検証済みコマンドリスト）
+        self._command_cache: "OrderedDict[Tuple[str, ...], List[Dict[str, Any]]]" = OrderedDict()
+        # モデル呼び出しの同時実行数の上限
+        self._model_semaphore = asyncio.Semaphore(LLM_RETOUCH_PARALLEL)
+        # 実行中の生成処理（キャッシュキー -> 生成タスク）
+        self._inflight: Dict[Tuple[str, ...], asyncio.Future] = {}
+        # 接続のウォームアップ（モデルごとに1回、イベントループ上で生成された場合のみバックグラウンドで実行）
+        self.model.start_warmup()
         logger.info(f"RetouchCommandGeneratorを初期化しました (model_type: {model_type})")
     
+    @classmethod
+    def shared(cls, model_type: Union[ModelType, str] = ModelType.GPT4_VISION) -> "RetouchCommandGenerator":
+        """
+        モデルタイプごとに共有されるジェネレーターインスタンスを取得する
+        
+        リクエストごとにインスタンスを生成するWebハンドラーなどから利用することで、
+        モデルとHTTPセッションの再初期化を避けられます。
+        
+        Args:
+            model_type: 使用するモデルタイプ（APIキーは環境変数から取得）
+            
+        Returns:
+            共有ジェネレーターインスタンス
+        """
+        key = model_type.value if isinstance(model_type, ModelType) else str(model_type)
+        generator = _SHARED_GENERATORS.get(key)
+        if generator is None:
+            generator = cls(model_type)
+            _SHARED_GENERATORS[key] = generator
+        return generator
+    
+    async def _image_digest(self, image_path: str) -> str:
+        """
+        画像のダイジェストを取得する（読み込み結果はモデル側と共有のキャッシュに保持される）
+        
+        Args:
+            image_path: 画像ファイルのパス
+            
+        Returns:
+            画像のSHA-256ダイジェスト
+        """
+        loop = asyncio.get_running_loop()
+        payload = await loop.run_in_executor(_RETOUCH_EXECUTOR, load_image_payload, image_path)
+        return payload.sha256
+    
+    async def _call_model(self, image_path: str, analysis_result: Dict[str, Any], prompt: str) -> Dict[str, Any]:
+        """
+        モデルのレタッチ生成を同時実行数の上限付きで実行する
+        
+        Args:
+            image_path: 画像ファイルのパス
+            analysis_result: 画像分析結果
+            prompt: プロンプト
+            
+        Returns:
+            モデルが返したJSONデータ
+        """
+        async with self._model_semaphore:
+            return await self.model.generate_retouch(image_path, analysis_result, prompt)
+    
+    async def _generate_commands(self,
+                                 cache_key: Tuple[str, ...],
+                                 image_path: str,
+                                 analysis_result: Dict[str, Any],
+                                 prompt: str) -> List[Dict[str, Any]]:
+        """
+        モデルでレタッチコマンドを生成し、検証してキャッシュに保存する
+        
+        同じキャッシュキーの生成処理が実行中の場合は、モデルを再度呼び出さずにその結果を待ちます。
+        
+        Args:
+            cache_key: キャッシュキー
+            image_path: 画像ファイルのパス
+            analysis_result: 画像分析結果
+            prompt: プロンプト
+            
+        Returns:
+            検証済みのコマンドリスト
+        """
+        task = self._inflight.get(cache_key)
+        if task is None:
+            # モデル呼び出しを独立したタスクとして実行し、最初の呼び出し元がキャンセルされても
+            # 同じキーで待機している他の呼び出し元には結果が届くようにする
+            task = asyncio.ensure_future(self._produce_commands(cache_key, image_path, analysis_result, prompt))
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda t: self._finish_inflight(cache_key, t))
+        else:
+            logger.info("同一内容の生成処理が実行中のため、その結果を待機します")
+        
+        # 呼び出し元のキャンセルがタスク本体に伝播しないようにshieldで待機する
+        return copy.deepcopy(await asyncio.shield(task))
+    
+    async def _produce_commands(self,
+                                cache_key: Tuple[str, ...],
+                                image_path: str,
+                                analysis_result: Dict[str, Any],
+                                prompt: str) -> List[Dict[str, Any]]:
+        """
+        モデルを呼び出してコマンドを検証し、キャッシュに保存する（実行中の生成処理の本体）
+        
+        Args:
+            cache_key: キャッシュキー
+            image_path: 画像ファイルのパス
+            analysis_result: 画像分析結果
+            prompt: プロンプト
+            
+        Returns:
+            検証済みのコマンドリスト
+        """
+        commands_data = await self._call_model(image_path, analysis_result, prompt)
+        validated_commands = _extract_and_validate(commands_data)
+        if validated_commands:
+            self._store_cached_commands(cache_key, validated_commands)
+        return validated_commands
+    
+    def _finish_inflight(self, cache_key: Tuple[str, ...], task: asyncio.Future) -> None:
+        """
+        完了した生成処理を実行中の一覧から取り除く
+        
+        Args:
+            cache_key: キャッシュキー
+            task: 完了した生成タスク
+        """
+        if self._inflight.get(cache_key) is task:
+            del self._inflight[cache_key]
+        # 待機者がいない場合でも例外が未取得として警告されないようにする
+        if not task.cancelled():
+            task.exception()
+    
+    def _semantic_scope(self, cache_key: Tuple[str, ...]) -> str:
+        """
+        意味的キャッシュのスコープキーを計算する（指示以外のキャッシュキー要素とモデルが一致する範囲）
+        
+        Args:
+            cache_key: generateのキャッシュキー
+            
+        Returns:
+            スコープキー
+        """
+        scope = (self.model.__class__.__name__,) + cache_key[:-1]
+        return hashlib.blake2b("\0".join(scope).encode("utf-8"), digest_size=16).hexdigest()
+    
+    async def _get_semantic_commands(self, cache_key: Tuple[str, ...], instructions: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        意味的キャッシュから類似した指示のレタッチコマンドを取得する
+        
+        Args:
+            cache_key: generateのキャッシュキー
+            instructions: レタッチの指示
+            
+        Returns:
+            レタッチコマンドのリスト、または存在しない場合はNone
+        """
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                _RETOUCH_EXECUTOR, self._semantic_cache.get, self._semantic_scope(cache_key), instructions
+            )
+        except Exception as e:
+            logger.warning(f"意味的キャッシュの参照エラー: {e}")
+            return None
+    
+    async def _store_semantic_commands(self, cache_key: Tuple[str, ...], instructions: str, commands: List[Dict[str, Any]]) -> None:
+        """
+        レタッチコマンドを意味的キャッシュに保存する
+        
+        Args:
+            cache_key: generateのキャッシュキー
+            instructions: レタッチの指示
+            commands: 検証済みのコマンドリスト
+        """
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                _RETOUCH_EXECUTOR, self._semantic_cache.set, self._semantic_scope(cache_key), instructions, commands
+            )
+        except Exception as e:
+            logger.warning(f"意味的キャッシュの保存エラー: {e}")
+    
+    def _get_cached_commands(self, cache_key: Tuple[str, ...]) -> Optional[List[Dict[str, Any]]]:
+        """
+        キャッシュからレタッチコマンドを取得する
+        
+        Args:
+            cache_key: キャッシュキー
+            
+        Returns:
+            キャッシュされたコマンドのコピー、または存在しない場合はNone
+        """
+        commands = self._command_cache.get(cache_key)
+        if commands is None:
+            return None
+        self._command_cache.move_to_end(cache_key)
+        # 呼び出し元による変更がキャッシュに波及しないようにコピーを返す
+        return copy.deepcopy(commands)
+    
+    def _store_cached_commands(self, cache_key: Tuple[str, ...], commands: List[Dict[str, Any]]) -> None:
+        """
+        レタッチコマンドをキャッシュに保存する
+        
+        Args:
+            cache_key: キャッシュキー
+            commands: 検証済みのコマンドリスト
+        """
+        self._command_cache[cache_key] = copy.deepcopy(commands)
+        self._command_cache.move_to_end(cache_key)
+        if len(self._command_cache) > COMMAND_CACHE_SIZE:
+            self._command_cache.popitem(last=False)
+    
+    def clear_cache(self) -> None:
+        """レタッチコマンドキャッシュをクリアする"""
+        self._command_cache.clear()
+    
+    def _build_prompt(self,
+                      analysis_json: str,
+                      instructions: Optional[str],
+                      advanced: bool,
+                      style: Optional[str]) -> str:
+        """
+        レタッチコマンド生成用のプロンプトを構築する
+        
+        Args:
+            analysis_json: 正規化済みの分析結果JSON
+            instructions: レタッチの指示（オプション）
+            advanced: 詳細なレタッチコマンドを生成するかどうか
+            style: レタッチスタイル
+            
+        Returns:
+            プロンプト文字列
+        """
+        template = _GENERATE_TEMPLATES.get((advanced, style)) or _GENERATE_TEMPLATES[(advanced, None)]
+        return template.substitute(
+            analysis_json=analysis_json,
+            user_instructions=instructions or _DEFAULT_USER_INSTRUCTIONS
+        )
+    
     async def generate(self, 
                       image_path: str,
                       analysis_result: Dict[str, Any], 
@@ -241,60 +857,40 @@ class RetouchCommandGenerator:
             レタッチコマンドのリスト
         """
         try:
-            # レタッチコマンド生成用プロンプトを取得
-            base_prompt = ADVANCED_RETOUCH_PROMPT if advanced else BASIC_RETOUCH_PROMPT
-            
-            # スタイルテンプレートの適用
-            style_prompt = ""
-            if style and style in RETOUCH_STYLE_TEMPLATES:
-                style_prompt = f"\nStyle Instructions: {RETOUCH_STYLE_TEMPLATES[style]}"
-            
-            # 分析結果をJSON文字列に変換
-            analysis_json = json.dumps(analysis_result, ensure_ascii=False, indent=2)
-            
-            # ユーザー指示の処理
-            user_instructions = "特に指示はありません。画像分析結果に基づいて最適なレタッチを行ってください。"
-            if instructions:
-                user_instructions = instructions
-            
-            # 最終プロンプトの構築
-            prompt = f"""
-            {base_prompt}
-            
-            {style_prompt}
+            # 分析結果をJSON文字列に変換（プロンプトとキャッシュキーで共用）
+            analysis_json = _serialize_analysis(analysis_result)
             
-            画像分析結果:
-            ```json
-            {analysis_json}
-            ```
+            # キャッシュの確認
+            cache_key = (
+                await self._image_digest(image_path),
+                _analysis_digest(analysis_json),
+                style or "",
+                str(advanced),
+                instructions or ""
+            )
+            cached_commands = self._get_cached_commands(cache_key)
+            if cached_commands is not None:
+                logger.info(f"キャッシュからレタッチコマンドを取得: {len(cached_commands)} コマンド")
+                return cached_commands
             
-            ユーザー指示:
-            {user_instructions}
+            # 言い換えられた指示に対する結果の確認
+            if instructions and self._semantic_cache is not None:
+                cached_commands = await self._get_semantic_commands(cache_key, instructions)
+                if cached_commands is not None:
+                    logger.info(f"意味的キャッシュからレタッチコマンドを取得: {len(cached_commands)} コマンド")
+                    self._store_cached_commands(cache_key, cached_commands)
+                    return cached_commands
             
-            上記の情報に基づいて、Photoshopで実行可能なレタッチコマンドを生成してください。
-            """
+            # 事前構築済みテンプレートからプロンプトを構築
+            prompt = self._build_prompt(analysis_json, instructions, advanced, style)
             
             logger.info("レタッチコマンド生成を開始")
             
             # モデルを使用してレタッチコマンドを生成
-            commands_data = self.model.generate_retouch(image_path, analysis_result, prompt)
-            
-            # コマンドリストを取得
-            if "commands" in commands_data:
-                commands = commands_data["commands"]
-            else:
-                commands = commands_data.get("retouch_commands", [])
-                if not commands:
-                    # フォールバック: トップレベルのリストを使用
-                    commands = list(commands_data.values()) if isinstance(commands_data, dict) else []
-            
-            # コマンドの検証
-            validated_commands = []
-            for cmd in commands:
-                if isinstance(cmd, dict) and "type" in cmd and "params" in cmd:
-                    validated_commands.append(cmd)
-                else:
-                    logger.warning(f"無効なコマンド形式をスキップ: {cmd}")
+            validated_commands = await self._generate_commands(cache_key, image_path, analysis_result, prompt)
+            
+            if validated_commands and instructions and self._semantic_cache is not None:
+                await self._store_semantic_commands(cache_key, instructions, validated_commands)
             
             logger.info(f"レタッチコマンド生成完了: {len(validated_commands)} コマンド")
             return validated_commands
@@ -304,6 +900,74 @@ class RetouchCommandGenerator:
             # エラーが発生した場合は空のリストを返す
             return []
     
+    async def generate_stream(self,
+                              image_path: str,
+                              analysis_result: Dict[str, Any],
+                              instructions: Optional[str] = None,
+                              advanced: bool = False,
+                              style: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        レタッチコマンドを生成し、完成したコマンドから順に返す
+        
+        LLMの出力をインクリメンタルにパースするため、レスポンス全体を待たずに
+        先頭のコマンドからPhotoshopでの実行を開始できます。
+        
+        Args:
+            image_path: 画像ファイルのパス
+            analysis_result: 画像分析結果
+            instructions: レタッチの指示（オプション）
+            advanced: 詳細なレタッチコマンドを生成するかどうか
+            style: レタッチスタイル（"natural", "dramatic", "vintage", etc.）
+            
+        Yields:
+            検証済みのレタッチコマンド
+        """
+        try:
+            analysis_json = _serialize_analysis(analysis_result)
+            cache_key = (
+                await self._image_digest(image_path),
+                _analysis_digest(analysis_json),
+                style or "",
+                str(advanced),
+                instructions or ""
+            )
+        except Exception as e:
+            logger.error(f"レタッチコマンドのストリーム生成エラー: {e}")
+            return
+        
+        cached_commands = self._get_cached_commands(cache_key)
+        if cached_commands is not None:
+            logger.info(f"キャッシュからレタッチコマンドを取得: {len(cached_commands)} コマンド")
+            for cmd in cached_commands:
+                yield cmd
+            return
+        
+        prompt = self._build_prompt(analysis_json, instructions, advanced, style)
+        parser = _CommandStreamParser()
+        validated_commands = []
+        
+        logger.info("レタッチコマンドのストリーム生成を開始")
+        try:
+            async for chunk in self.model.generate_retouch_stream(image_path, analysis_result, prompt):
+                for cmd in _validate_commands(parser.feed(chunk)):
+                    validated_commands.append(cmd)
+                    yield cmd
+            
+            if not parser.found_array:
+                # コマンド配列が見つからない形式の場合はレスポンス全体をパースする
+                for cmd in _extract_and_validate(json.loads(parser.text)):
+                    validated_commands.append(cmd)
+                    yield cmd
+        except Exception as e:
+            logger.error(f"レタッチコマンドのストリーム生成エラー: {e}")
+            return
+        
+        # 配列が正常に閉じた（またはレスポンス全体をパースした）場合のみキャッシュする
+        if validated_commands and (parser.finished or not parser.found_array):
+            self._store_cached_commands(cache_key, validated_commands)
+        
+        logger.info(f"レタッチコマンドのストリーム生成完了: {len(validated_commands)} コマンド")
+    
     async def generate_with_custom_prompt(self, 
                                          image_path: str,
                                          analysis_result: Dict[str, Any], 
@@ -320,42 +984,31 @@ class RetouchCommandGenerator:
             レタッチコマンドのリスト
         """
         try:
-            # 分析結果をJSON文字列に変換
-            analysis_json = json.dumps(analysis_result, ensure_ascii=False, indent=2)
-            
-            # 最終プロンプトの構築
-            prompt = f"""
-            画像分析結果:
-            ```json
-            {analysis_json}
-            ```
+            # 分析結果をJSON文字列に変換（プロンプトとキャッシュキーで共用）
+            analysis_json = _serialize_analysis(analysis_result)
             
-            {custom_prompt}
+            # キャッシュの確認
+            cache_key = (
+                await self._image_digest(image_path),
+                _analysis_digest(analysis_json),
+                "custom",
+                custom_prompt
+            )
+            cached_commands = self._get_cached_commands(cache_key)
+            if cached_commands is not None:
+                logger.info(f"キャッシュからレタッチコマンドを取得: {len(cached_commands)} コマンド")
+                return cached_commands
             
-            上記の情報に基づいて、Photoshopで実行可能なレタッチコマンドをJSON形式で生成してください。
-            """
+            # 最終プロンプトの構築
+            prompt = _CUSTOM_PROMPT_TEMPLATE.substitute(
+                analysis_json=analysis_json,
+                custom_prompt=custom_prompt
+            )
             
             logger.info("カスタムプロンプトによるレタッチコマンド生成を開始")
             
             # モデルを使用してレタッチコマンドを生成
-            commands_data = self.model.generate_retouch(image_path, analysis_result, prompt)
-            
-            # コマンドリストを取得
-            if "commands" in commands_data:
-                commands = commands_data["commands"]
-            else:
-                commands = commands_data.get("retouch_commands", [])
-                if not commands:
-                    # フォールバック: トップレベルのリストを使用
-                    commands = list(commands_data.values()) if isinstance(commands_data, dict) else []
-            
-            # コマンドの検証
-            validated_commands = []
-            for cmd in commands:
-                if isinstance(cmd, dict) and "type" in cmd and "params" in cmd:
-                    validated_commands.append(cmd)
-                else:
-                    logger.warning(f"無効なコマンド形式をスキップ: {cmd}")
+            validated_commands = await self._generate_commands(cache_key, image_path, analysis_result, prompt)
             
             logger.info(f"カスタムプロンプトによるレタッチコマンド生成完了: {len(validated_commands)} コマンド")
             return validated_commands
@@ -408,24 +1061,10 @@ class RetouchCommandGenerator:
             レタッチコマンドのリスト
         """
         # ポートレートレタッチ用のカスタムプロンプト
-        portrait_prompt = f"""
-        この画像のポートレートレタッチを行ってください。
-        
-        美肌レタッチレベル: {beauty_level}/5（1=最小限、5=最大限）
-        個性の保持: {"必須" if preserve_identity else "任意"}
-        
-        以下の要素に注目してレタッチしてください：
-        1. 肌の質感改善（しわ、毛穴、にきびなどの軽減）
-        2. 肌のトーン均一化
-        3. 目の明るさと鮮明さの強調
-        4. 髪の毛の質感と色の改善
-        5. 顔の輪郭の微調整（必要な場合）
-        6. 全体的な照明とコントラストの最適化
-        7. 背景の改善または調整
-        
-        各調整について、具体的なPhotoshopコマンドとパラメータを提供してください。
-        美肌レタッチは自然な仕上がりを心がけ、過度な処理は避けてください。
-        """
+        portrait_prompt = _PORTRAIT_TEMPLATE.substitute(
+            beauty_level=beauty_level,
+            preserve_identity="必須" if preserve_identity else "任意"
+        )
         
         return await self.generate_with_custom_prompt(
             image_path=image_path,
@@ -453,24 +1092,11 @@ class RetouchCommandGenerator:
             レタッチコマンドのリスト
         """
         # 風景レタッチ用のカスタムプロンプト
-        landscape_prompt = f"""
-        この風景写真のレタッチを行ってください。
-        
-        スタイル: {style}
-        空の強調: {"あり" if enhance_sky else "なし"}
-        前景の強調: {"あり" if enhance_foreground else "なし"}
-        
-        以下の要素に注目してレタッチしてください：
-        1. 全体的な露出とコントラストの最適化
-        2. 色彩の強調と調整
-        3. 空の処理（色、コントラスト、雲の詳細）
-        4. 前景の処理（ディテール、コントラスト、色彩）
-        5. 中間領域の処理
-        6. 霞や大気遠近法の調整
-        7. 全体的な色調の統一
-        
-        各調整について、具体的なPhotoshopコマンドとパラメータを提供してください。
-        """
+        landscape_prompt = _LANDSCAPE_TEMPLATE.substitute(
+            style=style,
+            enhance_sky="あり" if enhance_sky else "なし",
+            enhance_foreground="あり" if enhance_foreground else "なし"
+        )
         
         return await self.generate_with_custom_prompt(
             image_path=image_path,
@@ -496,24 +1122,10 @@ class RetouchCommandGenerator:
             レタッチコマンドのリスト
         """
         # 商品レタッチ用のカスタムプロンプト
-        product_prompt = f"""
-        この商品写真のレタッチを行ってください。
-        
-        背景のクリーンアップ: {"あり" if clean_background else "なし"}
-        商品詳細の強調: {"あり" if enhance_details else "なし"}
-        
-        以下の要素に注目してレタッチしてください：
-        1. 商品の色彩と質感の正確な表現
-        2. 商品のディテールと鮮明さの強調
-        3. 適切な露出とコントラストの調整
-        4. 背景の処理（クリーンアップ、単色化、または適切な調整）
-        5. 商品のハイライトと影の最適化
-        6. 商品の輪郭の明確化
-        7. 全体的な商品の魅力向上
-        
-        各調整について、具体的なPhotoshopコマンドとパラメータを提供してください。
-        商品の実際の色や質感を正確に表現することを優先してください。
-        """
+        product_prompt = _PRODUCT_TEMPLATE.substitute(
+            clean_background="あり" if clean_background else "なし",
+            enhance_details="あり" if enhance_details else "なし"
+        )
         
         return await self.generate_with_custom_prompt(
             image_path=image_path,
@@ -6,95 +6,1336 @@ This module provides support for multiple LLM models for image analysis and reto
 
 import os
 import json
+import time
+import atexit
+import random
+from email.utils import parsedate_to_datetime
+import asyncio
+import hashlib
+import io
+import mmap
+import mimetypes
+from collections import OrderedDict, namedtuple
 from enum import Enum
-from typing import Dict, Any, Optional, List, Union
+from dataclasses import dataclass
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Tuple, Union, AsyncIterator, Type, Callable, Iterable, Protocol, FrozenSet
 import base64
-import requests
+import httpx
 from abc import ABC, abstractmethod
 import logging
 
+from .cache import cached_response, make_cache_key, get_response_cache
+
+try:
+    import orjson
+except ImportError:  # orjsonが利用できない場合は標準のjsonを使用
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # msgspecが利用できない場合はレスポンスを辞書としてデコード
+    msgspec = None
+
+try:
+    import aiohttp
+except ImportError:  # aiohttpが利用できない場合はhttpxトランスポートのみ使用
+    aiohttp = None
+
+try:
+    import h2  # noqa: F401  httpxのHTTP/2サポートに必要
+    HTTP2_AVAILABLE = True
+except ImportError:  # h2が利用できない場合はHTTP/1.1で接続
+    HTTP2_AVAILABLE = False
+
 # ロガーの設定
 logger = logging.getLogger(__name__)
 
-class ModelType(Enum):
-    """サポートされているLLMモデルタイプ"""
-    GPT4_VISION = "gpt-4-vision"
-    CLAUDE3_SONNET_VISION = "claude-3-sonnet"
-    GEMINI_PRO_VISION = "gemini-pro-vision"
-    CUSTOM = "custom"
+def _json_loads(data: Union[str, bytes]) -> Any:
+    """
+    JSONをパース（orjsonが利用可能な場合はorjsonを使用）
+    
+    Args:
+        data: JSON文字列またはバイト列
+        
+    Returns:
+        パース結果
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _json_dumps_bytes(obj: Any) -> bytes:
+    """
+    オブジェクトをUTF-8のJSONバイト列に変換（リクエストボディ用）
+    
+    Args:
+        obj: JSONシリアライズ可能なオブジェクト
+        
+    Returns:
+        JSONバイト列
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+def _json_dumps_indent(obj: Any) -> str:
+    """
+    オブジェクトをインデント付きのJSON文字列に変換（プロンプト埋め込み用）
+    
+    Args:
+        obj: JSONシリアライズ可能なオブジェクト
+        
+    Returns:
+        インデント付きJSON文字列
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(obj, indent=2)
+
+# 送信前に縮小する画像の長辺の上限（ピクセル、0以下で縮小しない）
+IMAGE_MAX_EDGE = int(os.environ.get("LLM_IMAGE_MAX_EDGE", 1024))
+
+# 縮小した画像をJPEGで再エンコードする際の画質
+IMAGE_JPEG_QUALITY = 85
+
+# APIに送信する元画像ファイルの最大サイズ（バイト）
+IMAGE_MAX_BYTES = int(os.environ.get("LLM_IMAGE_MAX_MB", 20)) * 1024 * 1024
+
+class InvalidImageError(ValueError):
+    """APIに送信できない画像（サイズ超過・破損・非対応形式）を表す例外"""
+    
+    def __init__(self, image_path: str, reason: str):
+        super().__init__(f"Invalid image: {image_path}: {reason}")
+        self.image_path = image_path
+        self.reason = reason
+
+class ProviderAPIError(Exception):
+    """プロバイダーAPIがエラーのステータスコードを返したことを表す例外"""
+    
+    def __init__(self, provider: str, status_code: int, error_text: str):
+        super().__init__(f"{provider} API error: {status_code} - {error_text}")
+        self.provider = provider
+        self.status_code = status_code
+
+@lru_cache(maxsize=256)
+def _verified_image_format(image_path: str, mtime_ns: int, size: int) -> Optional[str]:
+    """
+    Pillowで画像の整合性を検証し、形式を取得する
+    
+    mtime_nsとsizeはキャッシュキーの一部で、ファイルが更新された場合に再検証させるために使用します。
+    
+    Args:
+        image_path: 画像ファイルのパス
+        mtime_ns: ファイルの更新時刻（ナノ秒）
+        size: ファイルサイズ
+        
+    Returns:
+        画像形式（"JPEG"、"PNG"など）、または画像として読み込めない場合はNone
+    """
+    from PIL import Image
+    
+    try:
+        with Image.open(image_path) as image:
+            image_format = image.format
+            image.verify()
+        return image_format
+    except Exception as e:
+        logger.debug(f"画像の検証に失敗: {image_path}: {e}")
+        return None
+
+# 読み込み済み画像データ（パス、SHA-256、Base64文字列、MIMEタイプ、縮小して再エンコードしたかどうか）
+_ImagePayload = namedtuple("_ImagePayload", "path sha256 b64 mime prepared")
+
+def _prepare_image(image_path: str, max_edge: int = IMAGE_MAX_EDGE, quality: int = IMAGE_JPEG_QUALITY) -> Optional[bytes]:
+    """
+    長辺がmax_edgeを超える画像を縮小し、JPEGで再エンコードする
+    
+    Args:
+        image_path: 画像ファイルのパス
+        max_edge: 長辺の上限（ピクセル）
+        quality: JPEGの画質
+        
+    Returns:
+        縮小したJPEGデータ、または縮小が不要・不可能な場合はNone
+    """
+    if max_edge <= 0:
+        return None
+    
+    from PIL import Image, ImageOps
+    
+    try:
+        with Image.open(image_path) as image:
+            if max(image.size) <= max_edge:
+                return None
+            # JPEGはデコード時に縮小して読み込む
+            image.draft("RGB", (max_edge, max_edge))
+            # 再エンコードでEXIFが失われるため、向きを画素に反映しておく
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=quality, optimize=True)
+            return buffer.getvalue()
+    except (OSError, ValueError) as e:
+        logger.debug(f"画像を縮小できないため元のデータを送信します: {image_path}: {e}")
+        return None
+
+@lru_cache(maxsize=64)
+def _read_image_payload(image_path: str, mtime_ns: int, size: int, max_edge: int) -> _ImagePayload:
+    """
+    画像を読み込み、ハッシュとBase64文字列を計算する
+    
+    mtime_nsとsizeはキャッシュキーの一部で、ファイルが更新された場合に再読み込みさせるために使用します。
+    
+    Args:
+        image_path: 画像ファイルのパス
+        mtime_ns: ファイルの更新時刻（ナノ秒）
+        size: ファイルサイズ
+        max_edge: 送信する画像の長辺の上限（ピクセル）
+        
+    Returns:
+        画像データ（縮小した場合はJPEGのデータ）
+    """
+    prepared = _prepare_image(image_path, max_edge)
+    if prepared is not None:
+        return _ImagePayload(
+            path=image_path,
+            sha256=hashlib.sha256(prepared).hexdigest(),
+            b64=base64.b64encode(prepared).decode("ascii"),
+            mime="image/jpeg",
+            prepared=True
+        )
+    
+    # ファイルをメモリマップし、読み込み用のコピーを作らずにハッシュとBase64を計算する
+    with open(image_path, "rb") as image_file:
+        if size == 0:
+            data = image_file.read()
+            sha256 = hashlib.sha256(data).hexdigest()
+            encoded = base64.b64encode(data)
+        else:
+            with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                sha256 = hashlib.sha256(mapped).hexdigest()
+                encoded = base64.b64encode(mapped)
+    mime = mimetypes.guess_type(image_path)[0] or "image/jpeg"
+    return _ImagePayload(
+        path=image_path,
+        sha256=sha256,
+        b64=encoded.decode("ascii"),
+        mime=mime,
+        prepared=False
+    )
+
+def load_image_payload(image_path: str, max_edge: int = IMAGE_MAX_EDGE) -> _ImagePayload:
+    """
+    画像データを取得（同じファイルの再読み込みとBase64再エンコードはキャッシュで回避）
+    
+    Args:
+        image_path: 画像ファイルのパス
+        max_edge: 送信する画像の長辺の上限（ピクセル、0以下で縮小しない）
+        
+    Returns:
+        画像データ
+    """
+    stat = os.stat(image_path)
+    return _read_image_payload(os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, max_edge)
+
+def validate_image(image_path: str, allowed_formats: Optional[Iterable[str]] = None,
+                   max_bytes: int = IMAGE_MAX_BYTES, max_edge: int = IMAGE_MAX_EDGE) -> _ImagePayload:
+    """
+    APIに送信する画像データを取得し、整合性・サイズ・形式を検証する
+    
+    整合性は元のファイルで検証し、サイズと形式は縮小・再エンコード後の送信データで検証します。
+    大きな写真やTIFFなども、縮小してJPEGにした結果が条件を満たせば送信できます。
+    
+    Args:
+        image_path: 画像ファイルのパス
+        allowed_formats: 送信データに許可する画像形式（Noneの場合は形式を問わない）
+        max_bytes: 送信データのサイズの上限（バイト）
+        max_edge: 送信する画像の長辺の上限（ピクセル、0以下で縮小しない）
+        
+    Returns:
+        検証済みの画像データ
+        
+    Raises:
+        InvalidImageError: 画像が条件を満たさない場合
+    """
+    stat = os.stat(image_path)
+    abs_path = os.path.abspath(image_path)
+    image_format = _verified_image_format(abs_path, stat.st_mtime_ns, stat.st_size)
+    if image_format is None:
+        raise InvalidImageError(image_path, "not a readable image or the file is corrupted")
+    
+    payload = _read_image_payload(abs_path, stat.st_mtime_ns, stat.st_size, max_edge)
+    # Base64文字列の長さから、パディングを除いた送信データのバイト数を求める
+    payload_bytes = len(payload.b64) // 4 * 3 - payload.b64[-2:].count("=")
+    if payload_bytes > max_bytes:
+        raise InvalidImageError(image_path, f"image data size {payload_bytes} bytes exceeds {max_bytes} bytes")
+    # 縮小した画像はJPEGで再エンコードして送信する
+    payload_format = "JPEG" if payload.prepared else image_format
+    if allowed_formats is not None and payload_format not in allowed_formats:
+        raise InvalidImageError(image_path, f"unsupported format {payload_format}")
+    return payload
+
+# 画像の読み込み・縮小・エンコードを実行するスレッドプール（イベントループをブロックしないため）
+_IMAGE_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="llm-image")
+
+async def load_image_payload_async(image_path: str, max_edge: int = IMAGE_MAX_EDGE) -> _ImagePayload:
+    """
+    load_image_payloadをスレッドプールで実行して画像データを取得
+    
+    Args:
+        image_path: 画像ファイルのパス
+        max_edge: 送信する画像の長辺の上限（ピクセル、0以下で縮小しない）
+        
+    Returns:
+        画像データ
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_IMAGE_EXECUTOR, load_image_payload, image_path, max_edge)
+
+# 共有HTTPクライアント（接続プールをすべてのモデルで共有する）
+_CLIENT: Optional[httpx.AsyncClient] = None
+_CLIENT_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+def _get_client() -> httpx.AsyncClient:
+    """
+    共有の非同期HTTPクライアントを取得
+    
+    クライアントは実行中のイベントループに紐づくため、ループが変わった場合は作り直します。
+    
+    Returns:
+        httpx.AsyncClientインスタンス
+    """
+    global _CLIENT, _CLIENT_LOOP
+    loop = asyncio.get_running_loop()
+    if _CLIENT is None or _CLIENT.is_closed or _CLIENT_LOOP is not loop:
+        if not HTTP2_AVAILABLE:
+            logger.info("h2パッケージが見つからないため、HTTP/1.1で接続します")
+        # HTTP/2では同じプロバイダーへの並行リクエストを1本のTLS接続に多重化する
+        _CLIENT = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(60),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+        )
+        _CLIENT_LOOP = loop
+    return _CLIENT
+
+async def aclose_client() -> None:
+    """共有HTTPクライアントを閉じる（サーバーのシャットダウン時などに呼び出す）"""
+    global _CLIENT, _CLIENT_LOOP
+    client, _CLIENT, _CLIENT_LOOP = _CLIENT, None, None
+    if client is not None and not client.is_closed:
+        await client.aclose()
+    for transport in _TRANSPORTS.values():
+        await transport.aclose()
+
+def _close_client_at_exit() -> None:
+    """プロセス終了時に共有HTTPクライアントの接続を閉じる"""
+    if (_CLIENT is None or _CLIENT.is_closed) and not any(t.is_open for t in _TRANSPORTS.values()):
+        return
+    try:
+        if _CLIENT_LOOP is not None and not _CLIENT_LOOP.is_closed() and not _CLIENT_LOOP.is_running():
+            _CLIENT_LOOP.run_until_complete(aclose_client())
+        else:
+            asyncio.run(aclose_client())
+    except Exception as e:
+        logger.debug(f"HTTPクライアントのクローズに失敗: {e}")
+
+atexit.register(_close_client_at_exit)
+
+# トランスポートが返すレスポンス（ステータスコード、ヘッダー、ボディ、HTTPバージョン）
+_TransportResponse = namedtuple("_TransportResponse", "status_code headers content http_version")
+
+class Transport(Protocol):
+    """プロバイダーAPIへのPOSTリクエストを送信するトランスポート"""
+    
+    # 接続エラーやタイムアウトとして再試行する例外
+    errors: Tuple[Type[BaseException], ...]
+    
+    @property
+    def is_open(self) -> bool:
+        """接続を保持しているかどうか"""
+        ...
+    
+    async def post(self, url: str, headers: Dict[str, str], content: bytes) -> _TransportResponse:
+        """リクエストを送信し、ボディを読み込んだレスポンスを返す"""
+        ...
+    
+    async def aclose(self) -> None:
+        """保持している接続を閉じる"""
+        ...
+
+class HttpxTransport:
+    """共有httpxクライアント（HTTP/2）を使用するトランスポート"""
+    
+    errors = (httpx.TransportError,)
+    
+    @property
+    def is_open(self) -> bool:
+        """共有クライアントは_get_client側で管理する"""
+        return False
+    
+    async def post(self, url: str, headers: Dict[str, str], content: bytes) -> _TransportResponse:
+        """リクエストを送信し、ボディを読み込んだレスポンスを返す"""
+        response = await _get_client().post(url, headers=headers, content=content)
+        return _TransportResponse(response.status_code, response.headers, response.content, response.http_version)
+    
+    async def aclose(self) -> None:
+        """共有クライアントはaclose_clientで閉じる"""
+
+class AiohttpTransport:
+    """
+    aiohttpのセッションを使用するトランスポート
+    
+    HTTP/1.1のみですが、多数の同時リクエストではクライアント側のオーバーヘッドがhttpxより小さくなります。
+    """
+    
+    errors = (aiohttp.ClientError, asyncio.TimeoutError) if aiohttp is not None else ()
+    
+    def __init__(self):
+        self._session: Optional["aiohttp.ClientSession"] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    @property
+    def is_open(self) -> bool:
+        """セッションを保持しているかどうか"""
+        return self._session is not None and not self._session.closed
+    
+    def _get_session(self) -> "aiohttp.ClientSession":
+        """
+        セッションを取得（実行中のイベントループが変わった場合は作り直す）
+        
+        Returns:
+            aiohttp.ClientSessionインスタンス
+        """
+        loop = asyncio.get_running_loop()
+        if not self.is_open or self._loop is not loop:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=60)
+            )
+            self._loop = loop
+        return self._session
+    
+    async def post(self, url: str, headers: Dict[str, str], content: bytes) -> _TransportResponse:
+        """リクエストを送信し、ボディを読み込んだレスポンスを返す"""
+        async with self._get_session().post(url, headers=headers, data=content) as response:
+            body = await response.read()
+            return _TransportResponse(
+                response.status,
+                response.headers,
+                body,
+                f"HTTP/{response.version.major}.{response.version.minor}"
+            )
+    
+    async def aclose(self) -> None:
+        """セッションを閉じる"""
+        session, self._session, self._loop = self._session, None, None
+        if session is not None and not session.closed:
+            await session.close()
+
+# 利用可能なトランスポート
+_TRANSPORTS: Dict[str, Transport] = {"httpx": HttpxTransport()}
+if aiohttp is not None:
+    _TRANSPORTS["aiohttp"] = AiohttpTransport()
+
+# 使用するトランスポート（httpxまたはaiohttp）
+HTTP_TRANSPORT = os.environ.get("LLM_HTTP_TRANSPORT", "httpx")
+
+def _get_transport() -> Transport:
+    """
+    設定されたトランスポートを取得（利用できない場合はhttpx）
+    
+    Returns:
+        トランスポート
+    """
+    transport = _TRANSPORTS.get(HTTP_TRANSPORT)
+    if transport is None:
+        logger.warning(f"トランスポート {HTTP_TRANSPORT} は利用できないため、httpxを使用します")
+        transport = _TRANSPORTS[HTTP_TRANSPORT] = _TRANSPORTS["httpx"]
+    return transport
+
+class _RateLimiter:
+    """
+    一定期間あたりのリクエスト数を制限する非同期レートリミッター（リーキーバケット方式）
+    """
+    
+    def __init__(self, max_rate: float, time_period: float = 60.0):
+        """
+        初期化
+        
+        Args:
+            max_rate: 期間あたりの最大リクエスト数
+            time_period: 期間（秒）
+        """
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._level = 0.0
+        self._last_check = time.monotonic()
+    
+    async def acquire(self) -> None:
+        """リクエスト枠が空くまで待機して1件分を確保する"""
+        while True:
+            now = time.monotonic()
+            leaked = (now - self._last_check) * self.max_rate / self.time_period
+            self._level = max(0.0, self._level - leaked)
+            self._last_check = now
+            if self._level + 1 <= self.max_rate:
+                self._level += 1
+                return
+            await asyncio.sleep((self._level + 1 - self.max_rate) * self.time_period / self.max_rate)
+
+# プロバイダーごとのレートリミッター（QPM環境変数名 -> リミッター、未設定の場合はNone）
+_RATE_LIMITERS: Dict[str, Optional[_RateLimiter]] = {}
+
+def _get_rate_limiter(qpm_env: Optional[str]) -> Optional[_RateLimiter]:
+    """
+    環境変数で指定された1分あたりのリクエスト数に基づくレートリミッターを取得
+    
+    Args:
+        qpm_env: QPMを指定する環境変数名（例: "OPENAI_QPM"）
+        
+    Returns:
+        レートリミッター、または制限なしの場合はNone
+    """
+    if not qpm_env:
+        return None
+    if qpm_env not in _RATE_LIMITERS:
+        qpm = os.environ.get(qpm_env)
+        limiter = None
+        if qpm:
+            try:
+                limiter = _RateLimiter(float(qpm), 60.0)
+            except ValueError:
+                logger.warning(f"{qpm_env} の値が不正なため無視します: {qpm}")
+        _RATE_LIMITERS[qpm_env] = limiter
+    return _RATE_LIMITERS[qpm_env]
+
+# API呼び出しの最大試行回数
+API_MAX_ATTEMPTS = 6
+
+# 再試行の待機時間の上限（秒）
+API_MAX_RETRY_DELAY = 30.0
+
+# 再試行対象のHTTPステータスコード（レート制限とサーバー側の一時的なエラー）
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504, 529})
+
+def _retry_delay(attempt: int) -> float:
+    """
+    ジッター付き指数バックオフの待機時間を計算
+    
+    Args:
+        attempt: 試行回数（1から開始）
+        
+    Returns:
+        待機時間（秒）
+    """
+    return random.uniform(0, min(API_MAX_RETRY_DELAY, 2 ** attempt))
+
+def _retry_after_seconds(response: Union[httpx.Response, "_TransportResponse"]) -> Optional[float]:
+    """
+    Retry-Afterヘッダーから待機時間を取得
+    
+    Args:
+        response: HTTPレスポンス
+        
+    Returns:
+        待機時間（秒）、またはヘッダーがない場合はNone
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), API_MAX_RETRY_DELAY)
+
+@lru_cache(maxsize=None)
+def _env_key(var: str) -> Optional[str]:
+    """
+    APIキーを環境変数から取得（結果はプロセス内でキャッシュ）
+    
+    シークレットマネージャーなど別の取得元を使う場合はこの関数を差し替えてください。
+    
+    Args:
+        var: 環境変数名
+        
+    Returns:
+        APIキー、または設定されていない場合はNone
+    """
+    return os.environ.get(var) or None
+
+def refresh_api_keys() -> None:
+    """キャッシュ済みのAPIキーを破棄し、次回の取得時に環境変数から読み直させる"""
+    _env_key.cache_clear()
+
+class ModelType(Enum):
+    """サポートされているLLMモデルタイプ"""
+    GPT4_VISION = "gpt-4-vision"
+    CLAUDE3_SONNET_VISION = "claude-3-sonnet"
+    GEMINI_PRO_VISION = "gemini-pro-vision"
+    CUSTOM = "custom"
+
+class BaseVisionModel(ABC):
+    """ビジョンモデルの基底クラス"""
+    
+    # 1分あたりのリクエスト数の上限を指定する環境変数名
+    _qpm_env: Optional[str] = None
+    
+    # APIが受け付ける画像形式（Noneの場合は形式を問わない）
+    _image_formats: Optional[FrozenSet[str]] = None
+    
+    def __init__(self, api_key: Optional[str] = None):
+        """
+        ビジョンモデルの初期化
+        
+        Args:
+            api_key: APIキー（Noneの場合は環境変数から取得）
+        """
+        self.api_key = api_key or self._get_api_key_from_env()
+        # ウォームアップ（接続確立）済みかどうか
+        self._warmed = False
+        # バックグラウンドで実行中のウォームアップ（モデルごとに1つ）
+        self._warmup_task: Optional[asyncio.Task] = None
+    
+    @abstractmethod
+    def _get_api_key_from_env(self) -> str:
+        """環境変数からAPIキーを取得"""
+        pass
+    
+    def set_api_key(self, api_key: Optional[str] = None) -> None:
+        """
+        APIキーを更新（キーのローテーション用）
+        
+        Args:
+            api_key: 新しいAPIキー（Noneの場合は環境変数から読み直す）
+        """
+        if api_key is None:
+            refresh_api_keys()
+        self.api_key = api_key or self._get_api_key_from_env()
+    
+    def _warmup_request(self) -> Optional[Tuple[str, Dict[str, str]]]:
+        """
+        ウォームアップに使用する軽量なリクエストを取得
+        
+        Returns:
+            (URL, ヘッダー)のタプル、またはウォームアップ不要の場合はNone
+        """
+        return None
+    
+    async def warmup(self) -> None:
+        """
+        プロバイダーへの接続（TCP/TLS）を事前に確立する
+        
+        モデル一覧取得などの軽量なGETリクエストを送信し、共有クライアントに接続を保持させます。
+        失敗しても本番のリクエストには影響しないため、エラーはログ出力のみ行います。
+        """
+        if self._warmed:
+            return
+        request = self._warmup_request()
+        if request is not None:
+            url, headers = request
+            try:
+                await _get_client().get(url, headers=headers, timeout=5)
+                logger.debug(f"{self.__class__.__name__} の接続をウォームアップしました")
+            except Exception as e:
+                logger.debug(f"{self.__class__.__name__} のウォームアップに失敗: {e}")
+        self._warmed = True
+    
+    def start_warmup(self) -> None:
+        """
+        実行中のイベントループ上でバックグラウンドのウォームアップを開始する
+        
+        モデルインスタンスごとに1回だけ開始し、イベントループ外で呼び出された場合は何もしません。
+        """
+        if self._warmed or self._warmup_task is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._warmup_task = loop.create_task(self.warmup())
+        # 完了後は参照を外し、失敗やキャンセルで未完了の場合は次の呼び出しで再実行できるようにする
+        self._warmup_task.add_done_callback(self._clear_warmup_task)
+    
+    def _clear_warmup_task(self, task: asyncio.Task) -> None:
+        """完了したウォームアップタスクの参照を外す"""
+        if self._warmup_task is task:
+            self._warmup_task = None
+    
+    @abstractmethod
+    async def analyze_image(self, image_path: str, prompt: str) -> Dict[str, Any]:
+        """
+        画像を分析
+        
+        Args:
+            image_path: 画像ファイルのパス
+            prompt: 分析プロンプト
+            
+        Returns:
+            分析結果
+        """
+        pass
+    
+    @abstractmethod
+    async def generate_retouch(self, image_path: str, analysis: Dict[str, Any], instructions: str) -> Dict[str, Any]:
+        """
+        レタッチ手順を生成
+        
+        Args:
+            image_path: 画像ファイルのパス
+            analysis: 画像分析結果
+            instructions: レタッチ指示
+            
+        Returns:
+            レタッチ手順
+        """
+        pass
+    
+    async def generate_retouch_stream(self, image_path: str, analysis: Dict[str, Any], instructions: str) -> AsyncIterator[str]:
+        """
+        レタッチ手順をJSONテキストの断片として逐次生成
+        
+        デフォルト実装ではgenerate_retouchの結果を一つの断片として返します。
+        ストリーミングに対応したプロバイダーではオーバーライドしてください。
+        
+        Args:
+            image_path: 画像ファイルのパス
+            analysis: 画像分析結果
+            instructions: レタッチ指示
+            
+        Yields:
+            レスポンスJSONのテキスト断片
+        """
+        retouch_steps = await self.generate_retouch(image_path, analysis, instructions)
+        yield json.dumps(retouch_steps, ensure_ascii=False)
+    
+    async def _retouch_request(self, image_path: str, analysis: Dict[str, Any], instructions: str,
+                               stream: bool = False) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        """
+        レタッチ手順生成リクエストを組み立てる（ストリーミング対応プロバイダーで実装）
+        
+        Args:
+            image_path: 画像ファイルのパス
+            analysis: 画像分析結果
+            instructions: レタッチ指示
+            stream: ストリーミング用のリクエストを組み立てるかどうか
+            
+        Returns:
+            (エンドポイントURL, リクエストヘッダー, リクエストボディ)のタプル
+        """
+        raise NotImplementedError
+    
+    def _stream_delta(self, event: Dict[str, Any]) -> Optional[str]:
+        """
+        ストリーミングイベントから生成テキストの差分を取り出す（ストリーミング対応プロバイダーで実装）
+        
+        Args:
+            event: Server-Sent Eventsのdataをデコードしたオブジェクト
+            
+        Returns:
+            テキストの差分（含まれない場合はNone）
+        """
+        raise NotImplementedError
+    
+    async def _stream_retouch(self, image_path: str, analysis: Dict[str, Any], instructions: str,
+                              provider: str) -> AsyncIterator[str]:
+        """
+        レタッチ手順をストリーミングで生成し、テキスト断片を受信しながら返す
+        
+        generate_retouchと同じキーでレスポンスキャッシュを参照・保存するため、
+        どちらの経路で生成した結果も相互に再利用されます。
+        
+        Args:
+            image_path: 画像ファイルのパス
+            analysis: 画像分析結果
+            instructions: レタッチ指示
+            provider: エラーメッセージに使用するプロバイダー名
+            
+        Yields:
+            レスポンスJSONのテキスト断片
+        """
+        cache = get_response_cache()
+        if cache is not None:
+            await self._load_image(image_path)
+            key = self._response_cache_key("generate_retouch", image_path, analysis, instructions)
+            cached = await asyncio.to_thread(cache.get, key)
+            if cached is not None:
+                logger.debug("レスポンスキャッシュにヒット: generate_retouch_stream")
+                yield json.dumps(cached, ensure_ascii=False)
+                return
+        
+        url, headers, payload = await self._retouch_request(image_path, analysis, instructions, stream=True)
+        chunks = []
+        async for text in self._stream_post(url, headers, payload, provider):
+            chunks.append(text)
+            yield text
+        
+        # 受信完了後に全体をパースしてキャッシュに保存
+        if cache is not None:
+            try:
+                await asyncio.to_thread(cache.set, key, _json_loads("".join(chunks)))
+            except ValueError:
+                logger.warning(f"{provider} のストリーミング応答をJSONとして解析できないため、キャッシュに保存しません")
+    
+    async def analyze_and_generate(self, image_path: str, prompt: str, instructions: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        画像を分析し、その結果に基づいてレタッチ手順を生成
+        
+        画像の読み込みとエンコードは最初に一度だけ行い、両方のAPI呼び出しで共有します。
+        
+        Args:
+            image_path: 画像ファイルのパス
+            prompt: 分析プロンプト
+            instructions: レタッチ指示
+            
+        Returns:
+            (分析結果, レタッチ手順)のタプル
+        """
+        await self._load_image(image_path)
+        analysis = await self.analyze_image(image_path, prompt)
+        retouch_steps = await self.generate_retouch(image_path, analysis, instructions)
+        return analysis, retouch_steps
+    
+    async def analyze_batch(self, image_paths: List[str], prompt: str, concurrency: int = 8) -> List[Union[Dict[str, Any], BaseException]]:
+        """
+        複数の画像を同時実行数の上限付きで並行して分析
+        
+        Args:
+            image_paths: 画像ファイルのパスのリスト
+            prompt: 分析プロンプト
+            concurrency: 同時に実行するリクエストの最大数
+            
+        Returns:
+            image_pathsと同じ順序の分析結果のリスト（失敗した画像は例外オブジェクト）
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def _analyze_one(image_path: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.analyze_image(image_path, prompt)
+        
+        return await asyncio.gather(*map(_analyze_one, image_paths), return_exceptions=True)
+    
+    def _response_cache_key(self, method: str, image_path: str, *parts: Any) -> str:
+        """
+        レスポンスキャッシュのキーを計算
+        
+        Args:
+            method: 呼び出したメソッド名
+            image_path: 画像ファイルのパス
+            *parts: プロンプトや分析結果などの引数
+            
+        Returns:
+            キャッシュキー
+        """
+        return make_cache_key(load_image_payload(image_path).sha256, self.__class__.__name__, method, *parts)
+    
+    async def _post_json(self, url: str, headers: Dict[str, str], payload: Dict[str, Any], provider: str,
+                         response_type: Optional[type] = None) -> Any:
+        """
+        共有クライアントでJSONリクエストを送信し、レスポンスを取得
+        
+        Args:
+            url: エンドポイントURL
+            headers: リクエストヘッダー
+            payload: リクエストボディ
+            provider: エラーメッセージに使用するプロバイダー名
+            response_type: レスポンスをデコードするmsgspec.Struct（Noneの場合は辞書）
+            
+        Returns:
+            レスポンスJSON（response_typeを指定した場合はその構造体）
+        """
+        request_headers = {**headers, "Content-Type": "application/json"}
+        response = await self._post(url, request_headers, _json_dumps_bytes(payload), provider)
+        if response_type is not None:
+            return msgspec.json.decode(response.content, type=response_type)
+        return _json_loads(response.content)
+    
+    async def _post(self, url: str, headers: Dict[str, str], body: bytes, provider: str) -> "_TransportResponse":
+        """
+        レートリミッターと再試行を適用してトランスポートでリクエストを送信
+        
+        Args:
+            url: エンドポイントURL
+            headers: リクエストヘッダー
+            body: リクエストボディ
+            provider: エラーメッセージに使用するプロバイダー名
+            
+        Returns:
+            ステータスコード200のレスポンス
+        """
+        limiter = _get_rate_limiter(self._qpm_env)
+        transport = _get_transport()
+        
+        for attempt in range(1, API_MAX_ATTEMPTS + 1):
+            if limiter is not None:
+                await limiter.acquire()
+            
+            try:
+                response = await transport.post(url, headers, body)
+            except transport.errors as e:
+                # 接続エラーやタイムアウトは再試行する
+                if attempt == API_MAX_ATTEMPTS:
+                    raise
+                delay = _retry_delay(attempt)
+                logger.warning(f"{provider} API connection error: {e} (retry {attempt}/{API_MAX_ATTEMPTS - 1} in {delay:.1f}s)")
+                await asyncio.sleep(delay)
+                continue
+            
+            # 一時的なエラーはRetry-Afterまたは指数バックオフで待機して再試行する
+            if response.status_code in RETRYABLE_STATUS_CODES and attempt < API_MAX_ATTEMPTS:
+                delay = _retry_after_seconds(response)
+                if delay is None:
+                    delay = _retry_delay(attempt)
+                logger.warning(
+                    f"{provider} API error: {response.status_code} (retry {attempt}/{API_MAX_ATTEMPTS - 1} in {delay:.1f}s)"
+                )
+                await asyncio.sleep(delay)
+                continue
+            
+            # レスポンスの処理
+            if response.status_code != 200:
+                error_text = response.content.decode("utf-8", errors="replace")
+                logger.error(f"{provider} API error: {response.status_code} - {error_text}")
+                raise ProviderAPIError(provider, response.status_code, error_text)
+            
+            logger.debug(f"{provider} API response received over {response.http_version}")
+            return response
+    
+    async def _stream_post(self, url: str, headers: Dict[str, str], payload: Dict[str, Any], provider: str) -> AsyncIterator[str]:
+        """
+        共有クライアントでストリーミングリクエストを送信し、生成テキストを受信した順に返す
+        
+        最初の断片を返す前の一時的なエラーは_post_jsonと同様に再試行します。
+        
+        Args:
+            url: エンドポイントURL
+            headers: リクエストヘッダー
+            payload: リクエストボディ
+            provider: エラーメッセージに使用するプロバイダー名
+            
+        Yields:
+            生成テキストの断片
+        """
+        limiter = _get_rate_limiter(self._qpm_env)
+        body = _json_dumps_bytes(payload)
+        request_headers = {**headers, "Content-Type": "application/json", "Accept": "text/event-stream"}
+        started = False
+        
+        for attempt in range(1, API_MAX_ATTEMPTS + 1):
+            if limiter is not None:
+                await limiter.acquire()
+            
+            try:
+                async with _get_client().stream("POST", url, headers=request_headers, content=body) as response:
+                    # 一時的なエラーはRetry-Afterまたは指数バックオフで待機して再試行する
+                    if response.status_code in RETRYABLE_STATUS_CODES and attempt < API_MAX_ATTEMPTS:
+                        delay = _retry_after_seconds(response)
+                        if delay is None:
+                            delay = _retry_delay(attempt)
+                        logger.warning(
+                            f"{provider} API error: {response.status_code} (retry {attempt}/{API_MAX_ATTEMPTS - 1} in {delay:.1f}s)"
+                        )
+                    elif response.status_code != 200:
+                        await response.aread()
+                        logger.error(f"{provider} API error: {response.status_code} - {response.text}")
+                        raise ProviderAPIError(provider, response.status_code, response.text)
+                    else:
+                        async for line in response.aiter_lines():
+                            # Server-Sent Eventsのdata行のみを処理する
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[5:].strip()
+                            if data == "[DONE]":
+                                break
+                            if not data:
+                                continue
+                            text = self._stream_delta(_json_loads(data))
+                            if text:
+                                started = True
+                                yield text
+                        return
+            except httpx.TransportError as e:
+                # 断片を返し始めた後は再試行すると出力が重複するため、そのまま送出する
+                if started or attempt == API_MAX_ATTEMPTS:
+                    raise
+                delay = _retry_delay(attempt)
+                logger.warning(f"{provider} API connection error: {e} (retry {attempt}/{API_MAX_ATTEMPTS - 1} in {delay:.1f}s)")
+            
+            await asyncio.sleep(delay)
+    
+    async def _load_image(self, image_path: str) -> _ImagePayload:
+        """
+        画像の検証、読み込み、Base64エンコードをスレッドプールで実行
+        
+        結果はload_image_payloadのキャッシュに残るため、以降の同期的な取得はすぐに返ります。
+        不正な画像や送信できない画像はAPI呼び出しの前にInvalidImageErrorで失敗します。
+        
+        Args:
+            image_path: 画像ファイルのパス
+            
+        Returns:
+            画像データ
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_IMAGE_EXECUTOR, validate_image, image_path, self._image_formats)
+    
+    def _encode_image_base64(self, image_path: str) -> str:
+        """
+        画像をBase64エンコード
+        
+        Args:
+            image_path: 画像ファイルのパス
+            
+        Returns:
+            Base64エンコードされた画像データ
+        """
+        return load_image_payload(image_path).b64
+    
+    def _image_mime_type(self, image_path: str) -> str:
+        """
+        画像のMIMEタイプを取得
+        
+        Args:
+            image_path: 画像ファイルのパス
+            
+        Returns:
+            MIMEタイプ
+        """
+        return load_image_payload(image_path).mime
+
+# 分析結果とレタッチ指示を組み合わせたプロンプトのテンプレート
+_RETOUCH_PROMPT = """
+        Based on the following image analysis:
+        {analysis}
+        
+        And the user instructions:
+        {instructions}
+        
+        Generate detailed Photoshop retouch steps in JSON format.
+        Include specific parameter values for each adjustment.
+        """
 
-class BaseVisionModel(ABC):
-    """ビジョンモデルの基底クラス"""
+# 分析時にJSON形式の応答を促すためにプロンプトへ付加する指示
+_JSON_RESPONSE_SUFFIX = "\n\nRespond in JSON format."
+
+# 分析・レタッチ手順生成の最大出力トークン数
+ANALYSIS_MAX_TOKENS = 1000
+RETOUCH_MAX_TOKENS = 1500
+
+# 生成テキストまでの経路だけを定義したレスポンス構造体（未定義のフィールドはデコードせずに読み飛ばす）
+if msgspec is not None:
+    class _OpenAIMessage(msgspec.Struct):
+        content: str
     
-    def __init__(self, api_key: Optional[str] = None):
+    class _OpenAIChoice(msgspec.Struct):
+        message: _OpenAIMessage
+    
+    class _OpenAIResponse(msgspec.Struct):
+        choices: List[_OpenAIChoice]
+        
+        def text(self) -> str:
+            return self.choices[0].message.content
+    
+    class _AnthropicContent(msgspec.Struct):
+        text: str = ""
+    
+    class _AnthropicResponse(msgspec.Struct):
+        content: List[_AnthropicContent]
+        
+        def text(self) -> str:
+            return self.content[0].text
+    
+    class _GeminiPart(msgspec.Struct):
+        text: str = ""
+    
+    class _GeminiContent(msgspec.Struct):
+        parts: List[_GeminiPart]
+    
+    class _GeminiCandidate(msgspec.Struct):
+        content: _GeminiContent
+    
+    class _GeminiResponse(msgspec.Struct):
+        candidates: List[_GeminiCandidate]
+        
+        def text(self) -> str:
+            return self.candidates[0].content.parts[0].text
+else:
+    _OpenAIResponse = _AnthropicResponse = _GeminiResponse = None
+
+@dataclass(frozen=True)
+class ProviderSpec:
+    """ビジョンモデルプロバイダーごとのリクエスト形式を保持するデータクラス"""
+    name: str  # エラーメッセージに使用するプロバイダー名
+    api_key_env: str  # APIキーを読み込む環境変数
+    qpm_env: str  # 1分あたりの最大リクエスト数を読み込む環境変数
+    endpoint: Callable[[str, bool], str]  # (APIキー, ストリーミング) -> URL
+    auth_headers: Callable[[str], Dict[str, str]]  # APIキー -> 認証ヘッダー
+    image_part: Callable[[str, str], Dict[str, Any]]  # (MIMEタイプ, Base64) -> 画像パート
+    payload_builder: Callable[[str, Dict[str, Any], int, bool], Dict[str, Any]]  # (プロンプト, 画像パート, 最大トークン数, ストリーミング) -> ボディ
+    response_parser: Callable[[Dict[str, Any]], str]  # レスポンスJSON -> 生成テキスト
+    response_type: Optional[type]  # 生成テキストをtext()で返すmsgspec.Struct（msgspecがない場合はNone）
+    stream_delta: Callable[[Dict[str, Any]], Optional[str]]  # ストリーミングイベント -> テキストの差分
+    warmup_url: Callable[[str], str]  # APIキー -> ウォームアップ用URL
+    image_formats: FrozenSet[str]  # APIが受け付ける画像形式（Pillowの形式名）
+    analysis_suffix: str = ""  # 分析プロンプトに付加する指示
+
+def _openai_payload(prompt: str, image_part: Dict[str, Any], max_tokens: int, stream: bool) -> Dict[str, Any]:
+    """OpenAI Chat Completions APIのリクエストボディを構築"""
+    payload = {
+        "model": "gpt-4-vision-preview",
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    image_part
+                ]
+            }
+        ],
+        "max_tokens": max_tokens,
+        "response_format": {"type": "json_object"}
+    }
+    if stream:
+        payload["stream"] = True
+    return payload
+
+def _openai_stream_delta(event: Dict[str, Any]) -> Optional[str]:
+    """OpenAIのchat.completion.chunkからテキストの差分を取り出す"""
+    choices = event.get("choices")
+    if not choices:
+        return None
+    return choices[0].get("delta", {}).get("content")
+
+def _anthropic_headers(api_key: str) -> Dict[str, str]:
+    """Anthropic APIの認証ヘッダーを構築"""
+    return {
+        "x-api-key": api_key,
+        "anthropic-version": "2023-06-01"
+    }
+
+def _anthropic_payload(prompt: str, image_part: Dict[str, Any], max_tokens: int, stream: bool) -> Dict[str, Any]:
+    """Anthropic Messages APIのリクエストボディを構築"""
+    payload = {
+        "model": "claude-3-sonnet-20240229",
+        "max_tokens": max_tokens,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": prompt
+                    },
+                    image_part
+                ]
+            }
+        ],
+        "response_format": {"type": "json_object"}
+    }
+    if stream:
+        payload["stream"] = True
+    return payload
+
+def _anthropic_stream_delta(event: Dict[str, Any]) -> Optional[str]:
+    """Anthropicのcontent_block_deltaイベントからテキストの差分を取り出す"""
+    event_type = event.get("type")
+    if event_type == "error":
+        raise Exception(f"Anthropic API error: {event.get('error')}")
+    if event_type != "content_block_delta":
+        return None
+    return event.get("delta", {}).get("text")
+
+def _google_endpoint(api_key: str, stream: bool) -> str:
+    """Gemini APIのエンドポイントURLを構築（ストリーミングはSSE形式で応答するstreamGenerateContentを使用）"""
+    if stream:
+        return f"https://generativelanguage.googleapis.com/v1beta/models/gemini-pro-vision:streamGenerateContent?alt=sse&key={api_key}"
+    return f"https://generativelanguage.googleapis.com/v1beta/models/gemini-pro-vision:generateContent?key={api_key}"
+
+def _google_payload(prompt: str, image_part: Dict[str, Any], max_tokens: int, stream: bool) -> Dict[str, Any]:
+    """Gemini APIのリクエストボディを構築"""
+    return {
+        "contents": [
+            {
+                "parts": [
+                    {"text": prompt},
+                    image_part
+                ]
+            }
+        ],
+        "generation_config": {
+            "temperature": 0.4,
+            "top_p": 1,
+            "top_k": 32,
+            "max_output_tokens": max_tokens,
+            "response_mime_type": "application/json"
+        }
+    }
+
+def _google_stream_delta(event: Dict[str, Any]) -> Optional[str]:
+    """GenerateContentResponseの断片からテキストの差分を取り出す"""
+    candidates = event.get("candidates")
+    if not candidates:
+        return None
+    parts = candidates[0].get("content", {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts) or None
+
+# プロバイダーごとの設定
+_PROVIDERS: Dict[ModelType, ProviderSpec] = {
+    ModelType.GPT4_VISION: ProviderSpec(
+        name="OpenAI",
+        api_key_env="OPENAI_API_KEY",
+        qpm_env="OPENAI_QPM",
+        endpoint=lambda api_key, stream: "https://api.openai.com/v1/chat/completions",
+        auth_headers=lambda api_key: {"Authorization": f"Bearer {api_key}"},
+        image_part=lambda mime, data: {
+            "type": "image_url",
+            "image_url": {"url": f"data:{mime};base64,{data}", "detail": "high"}
+        },
+        payload_builder=_openai_payload,
+        response_parser=lambda result: result["choices"][0]["message"]["content"],
+        response_type=_OpenAIResponse,
+        stream_delta=_openai_stream_delta,
+        warmup_url=lambda api_key: "https://api.openai.com/v1/models",
+        image_formats=frozenset({"JPEG", "PNG", "GIF", "WEBP"})
+    ),
+    ModelType.CLAUDE3_SONNET_VISION: ProviderSpec(
+        name="Anthropic",
+        api_key_env="ANTHROPIC_API_KEY",
+        qpm_env="ANTHROPIC_QPM",
+        endpoint=lambda api_key, stream: "https://api.anthropic.com/v1/messages",
+        auth_headers=_anthropic_headers,
+        image_part=lambda mime, data: {
+            "type": "image",
+            "source": {"type": "base64", "media_type": mime, "data": data}
+        },
+        payload_builder=_anthropic_payload,
+        response_parser=lambda result: result["content"][0]["text"],
+        response_type=_AnthropicResponse,
+        stream_delta=_anthropic_stream_delta,
+        warmup_url=lambda api_key: "https://api.anthropic.com/v1/models",
+        image_formats=frozenset({"JPEG", "PNG", "GIF", "WEBP"}),
+        analysis_suffix=_JSON_RESPONSE_SUFFIX
+    ),
+    ModelType.GEMINI_PRO_VISION: ProviderSpec(
+        name="Google",
+        api_key_env="GOOGLE_API_KEY",
+        qpm_env="GOOGLE_QPM",
+        endpoint=_google_endpoint,
+        auth_headers=lambda api_key: {},
+        image_part=lambda mime, data: {"inline_data": {"mime_type": mime, "data": data}},
+        payload_builder=_google_payload,
+        response_parser=lambda result: result["candidates"][0]["content"]["parts"][0]["text"],
+        response_type=_GeminiResponse,
+        stream_delta=_google_stream_delta,
+        warmup_url=lambda api_key: f"https://generativelanguage.googleapis.com/v1beta/models?key={api_key}",
+        image_formats=frozenset({"JPEG", "PNG", "WEBP", "HEIF"}),
+        analysis_suffix=_JSON_RESPONSE_SUFFIX
+    )
+}
+
+class VisionModel(BaseVisionModel):
+    """ProviderSpecの設定に従ってリクエストを組み立てるビジョンモデル"""
+    
+    # サブクラスで既定のプロバイダー設定を指定する
+    spec: Optional[ProviderSpec] = None
+    
+    def __init__(self, api_key: Optional[str] = None, spec: Optional[ProviderSpec] = None):
         """
-        ビジョンモデルの初期化
+        初期化
         
         Args:
             api_key: APIキー（Noneの場合は環境変数から取得）
+            spec: プロバイダー設定（Noneの場合はクラスの既定値を使用）
         """
-        self.api_key = api_key or self._get_api_key_from_env()
+        if spec is not None:
+            self.spec = spec
+        if self.spec is None:
+            raise ValueError("ProviderSpec is not specified")
+        self._qpm_env = self.spec.qpm_env
+        self._image_formats = self.spec.image_formats
+        super().__init__(api_key)
     
-    @abstractmethod
     def _get_api_key_from_env(self) -> str:
         """環境変数からAPIキーを取得"""
-        pass
+        api_key = _env_key(self.spec.api_key_env)
+        if not api_key:
+            raise ValueError(f"{self.spec.api_key_env} environment variable is not set")
+        return api_key
     
-    @abstractmethod
-    def analyze_image(self, image_path: str, prompt: str) -> Dict[str, Any]:
+    def _warmup_request(self) -> Optional[Tuple[str, Dict[str, str]]]:
+        """モデル一覧エンドポイントでウォームアップ"""
+        return self.spec.warmup_url(self.api_key), self.spec.auth_headers(self.api_key)
+    
+    async def _image_part(self, image_path: str) -> Dict[str, Any]:
         """
-        画像を分析
+        リクエストに含める画像パートを構築
         
         Args:
             image_path: 画像ファイルのパス
-            prompt: 分析プロンプト
             
         Returns:
-            分析結果
+            Base64エンコードした画像を埋め込んだパート
         """
-        pass
+        payload = await self._load_image(image_path)
+        return self.spec.image_part(payload.mime, payload.b64)
     
-    @abstractmethod
-    def generate_retouch(self, image_path: str, analysis: Dict[str, Any], instructions: str) -> Dict[str, Any]:
+    async def _build_request(self, image_path: str, prompt: str, max_tokens: int,
+                             stream: bool = False) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
         """
-        レタッチ手順を生成
+        プロバイダーの形式でリクエストを組み立てる
         
         Args:
             image_path: 画像ファイルのパス
-            analysis: 画像分析結果
-            instructions: レタッチ指示
+            prompt: プロンプト
+            max_tokens: 最大出力トークン数
+            stream: ストリーミング用のリクエストを組み立てるかどうか
             
         Returns:
-            レタッチ手順
+            (エンドポイントURL, リクエストヘッダー, リクエストボディ)のタプル
         """
-        pass
+        image_part = await self._image_part(image_path)
+        headers = {"Content-Type": "application/json", **self.spec.auth_headers(self.api_key)}
+        payload = self.spec.payload_builder(prompt, image_part, max_tokens, stream)
+        return self.spec.endpoint(self.api_key, stream), headers, payload
     
-    def _encode_image_base64(self, image_path: str) -> str:
+    async def _request_text(self, url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> str:
         """
-        画像をBase64エンコード
+        リクエストを送信し、レスポンスから生成テキストを取り出す
+        
+        msgspecが利用できる場合は、生成テキストまでの経路だけを構造体として直接デコードします。
         
         Args:
-            image_path: 画像ファイルのパス
+            url: エンドポイントURL
+            headers: リクエストヘッダー
+            payload: リクエストボディ
             
         Returns:
-            Base64エンコードされた画像データ
+            生成テキスト
         """
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-
-class GPT4VisionModel(BaseVisionModel):
-    """GPT-4 Visionモデル"""
-    
-    def _get_api_key_from_env(self) -> str:
-        """環境変数からOpenAI APIキーを取得"""
-        api_key = os.environ.get("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable is not set")
-        return api_key
+        response_type = self.spec.response_type
+        if response_type is not None:
+            result = await self._post_json(url, headers, payload, self.spec.name, response_type)
+            return result.text()
+        result = await self._post_json(url, headers, payload, self.spec.name)
+        return self.spec.response_parser(result)
     
-    def analyze_image(self, image_path: str, prompt: str) -> Dict[str, Any]:
+    @cached_response
+    async def analyze_image(self, image_path: str, prompt: str) -> Dict[str, Any]:
         """
-        GPT-4 Visionを使用して画像を分析
+        画像を分析
         
         Args:
             image_path: 画像ファイルのパス
@@ -103,56 +1344,19 @@ class GPT4VisionModel(BaseVisionModel):
         Returns:
             分析結果
         """
-        # 画像をBase64エンコード
-        base64_image = self._encode_image_base64(image_path)
-        
-        # APIリクエストの準備
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        
-        payload = {
-            "model": "gpt-4-vision-preview",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                                "detail": "high"
-                            }
-                        }
-                    ]
-                }
-            ],
-            "max_tokens": 1000,
-            "response_format": {"type": "json_object"}
-        }
-        
-        # APIリクエストの送信
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=payload
+        url, headers, payload = await self._build_request(
+            image_path, prompt + self.spec.analysis_suffix, ANALYSIS_MAX_TOKENS
         )
         
-        # レスポンスの処理
-        if response.status_code != 200:
-            logger.error(f"OpenAI API error: {response.status_code} - {response.text}")
-            raise Exception(f"OpenAI API error: {response.status_code} - {response.text}")
-        
-        result = response.json()
-        analysis = json.loads(result["choices"][0]["message"]["content"])
+        # APIリクエストの送信
+        analysis = _json_loads(await self._request_text(url, headers, payload))
         
         return analysis
     
-    def generate_retouch(self, image_path: str, analysis: Dict[str, Any], instructions: str) -> Dict[str, Any]:
+    @cached_response
+    async def generate_retouch(self, image_path: str, analysis: Dict[str, Any], instructions: str) -> Dict[str, Any]:
         """
-        GPT-4 Visionを使用してレタッチ手順を生成
+        レタッチ手順を生成
         
         Args:
             image_path: 画像ファイルのパス
@@ -162,359 +1366,288 @@ class GPT4VisionModel(BaseVisionModel):
         Returns:
             レタッチ手順
         """
-        # 画像をBase64エンコード
-        base64_image = self._encode_image_base64(image_path)
-        
-        # APIリクエストの準備
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        
-        # 分析結果とレタッチ指示を組み合わせたプロンプト
-        prompt = f"""
-        Based on the following image analysis:
-        {json.dumps(analysis, indent=2)}
-        
-        And the user instructions:
-        {instructions}
-        
-        Generate detailed Photoshop retouch steps in JSON format.
-        Include specific parameter values for each adjustment.
-        """
-        
-        payload = {
-            "model": "gpt-4-vision-preview",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                                "detail": "high"
-                            }
-                        }
-                    ]
-                }
-            ],
-            "max_tokens": 1500,
-            "response_format": {"type": "json_object"}
-        }
+        url, headers, payload = await self._retouch_request(image_path, analysis, instructions)
         
         # APIリクエストの送信
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=payload
-        )
-        
-        # レスポンスの処理
-        if response.status_code != 200:
-            logger.error(f"OpenAI API error: {response.status_code} - {response.text}")
-            raise Exception(f"OpenAI API error: {response.status_code} - {response.text}")
-        
-        result = response.json()
-        retouch_steps = json.loads(result["choices"][0]["message"]["content"])
+        retouch_steps = _json_loads(await self._request_text(url, headers, payload))
         
         return retouch_steps
-
-class Claude3VisionModel(BaseVisionModel):
-    """Claude 3 Sonnet Visionモデル"""
-    
-    def _get_api_key_from_env(self) -> str:
-        """環境変数からAnthropicのAPIキーを取得"""
-        api_key = os.environ.get("ANTHROPIC_API_KEY")
-        if not api_key:
-            raise ValueError("ANTHROPIC_API_KEY environment variable is not set")
-        return api_key
     
-    def analyze_image(self, image_path: str, prompt: str) -> Dict[str, Any]:
+    async def generate_retouch_stream(self, image_path: str, analysis: Dict[str, Any], instructions: str) -> AsyncIterator[str]:
         """
-        Claude 3 Sonnetを使用して画像を分析
+        ストリーミング応答でレタッチ手順を逐次生成
         
         Args:
             image_path: 画像ファイルのパス
-            prompt: 分析プロンプト
+            analysis: 画像分析結果
+            instructions: レタッチ指示
             
-        Returns:
-            分析結果
+        Yields:
+            レスポンスJSONのテキスト断片
         """
-        # 画像をBase64エンコード
-        base64_image = self._encode_image_base64(image_path)
-        
-        # APIリクエストの準備
-        headers = {
-            "Content-Type": "application/json",
-            "x-api-key": self.api_key,
-            "anthropic-version": "2023-06-01"
-        }
-        
-        payload = {
-            "model": "claude-3-sonnet-20240229",
-            "max_tokens": 1000,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt + "\n\nRespond in JSON format."
-                        },
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": base64_image
-                            }
-                        }
-                    ]
-                }
-            ],
-            "response_format": {"type": "json_object"}
-        }
-        
-        # APIリクエストの送信
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=payload
-        )
-        
-        # レスポンスの処理
-        if response.status_code != 200:
-            logger.error(f"Anthropic API error: {response.status_code} - {response.text}")
-            raise Exception(f"Anthropic API error: {response.status_code} - {response.text}")
-        
-        result = response.json()
-        analysis = json.loads(result["content"][0]["text"])
-        
-        return analysis
+        async for text in self._stream_retouch(image_path, analysis, instructions, self.spec.name):
+            yield text
     
-    def generate_retouch(self, image_path: str, analysis: Dict[str, Any], instructions: str) -> Dict[str, Any]:
+    async def _retouch_request(self, image_path: str, analysis: Dict[str, Any], instructions: str,
+                               stream: bool = False) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
         """
-        Claude 3 Sonnetを使用してレタッチ手順を生成
+        レタッチ手順生成リクエストを組み立てる
         
         Args:
             image_path: 画像ファイルのパス
             analysis: 画像分析結果
             instructions: レタッチ指示
+            stream: ストリーミング用のリクエストを組み立てるかどうか
             
         Returns:
-            レタッチ手順
+            (エンドポイントURL, リクエストヘッダー, リクエストボディ)のタプル
         """
-        # 画像をBase64エンコード
-        base64_image = self._encode_image_base64(image_path)
-        
-        # APIリクエストの準備
-        headers = {
-            "Content-Type": "application/json",
-            "x-api-key": self.api_key,
-            "anthropic-version": "2023-06-01"
-        }
-        
-        # 分析結果とレタッチ指示を組み合わせたプロンプト
-        prompt = f"""
-        Based on the following image analysis:
-        {json.dumps(analysis, indent=2)}
+        prompt = _RETOUCH_PROMPT.format(analysis=_json_dumps_indent(analysis), instructions=instructions)
+        return await self._build_request(image_path, prompt, RETOUCH_MAX_TOKENS, stream)
+    
+    def _stream_delta(self, event: Dict[str, Any]) -> Optional[str]:
+        """ストリーミングイベントからテキストの差分を取り出す"""
+        return self.spec.stream_delta(event)
+
+class GPT4VisionModel(VisionModel):
+    """GPT-4 Visionモデル"""
+    
+    spec = _PROVIDERS[ModelType.GPT4_VISION]
+
+class Claude3VisionModel(VisionModel):
+    """Claude 3 Sonnet Visionモデル"""
+    
+    spec = _PROVIDERS[ModelType.CLAUDE3_SONNET_VISION]
+
+# Google Files APIにアップロードしたファイル（(APIキーのハッシュ, 画像のSHA-256) -> (ファイルURI, 有効期限)）
+# アップロードしたファイルはそのAPIキーからしか参照できないため、キーごとに分けて保持する
+_GEMINI_FILE_URIS: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+
+# アップロード済みファイルを再利用する期間（Files APIの保持期間48時間より短くする）
+GEMINI_FILE_TTL = 47 * 3600
+
+# アップロード済みファイルの最大キャッシュ数
+GEMINI_FILE_CACHE_SIZE = 128
+
+# アップロード済みファイルを参照できなかったことを表すステータスコード（権限なし・期限切れ）
+GEMINI_FILE_ERROR_STATUS_CODES = frozenset({403, 404})
+
+class GeminiVisionModel(VisionModel):
+    """Gemini Pro Visionモデル"""
+    
+    spec = _PROVIDERS[ModelType.GEMINI_PRO_VISION]
+    
+    async def _upload_image(self, image_path: str) -> Optional[str]:
+        """
+        Files APIに画像をアップロードし、ファイルURIを取得
         
-        And the user instructions:
-        {instructions}
+        同じAPIキーで同じ内容の画像は有効期限内であれば再アップロードせずにキャッシュ済みのURIを返します。
         
-        Generate detailed Photoshop retouch steps in JSON format.
-        Include specific parameter values for each adjustment.
+        Args:
+            image_path: 画像ファイルのパス
+            
+        Returns:
+            ファイルURI、またはアップロードに失敗した場合はNone
         """
+        payload = await self._load_image(image_path)
+        cache_key = (_api_key_digest(self.api_key), payload.sha256)
+        cached = _GEMINI_FILE_URIS.get(cache_key)
+        if cached is not None and cached[1] > time.time():
+            _GEMINI_FILE_URIS.move_to_end(cache_key)
+            return cached[0]
         
-        payload = {
-            "model": "claude-3-sonnet-20240229",
-            "max_tokens": 1500,
-            "messages": [
+        try:
+            # 縮小済みの場合もあるため、送信用の画像データから復元する
+            data = base64.b64decode(payload.b64)
+            
+            # レジュマブルアップロードの開始
+            start_response = await self._post(
+                f"https://generativelanguage.googleapis.com/upload/v1beta/files?key={self.api_key}",
                 {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": base64_image
-                            }
-                        }
-                    ]
-                }
-            ],
-            "response_format": {"type": "json_object"}
-        }
-        
-        # APIリクエストの送信
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=payload
-        )
-        
-        # レスポンスの処理
-        if response.status_code != 200:
-            logger.error(f"Anthropic API error: {response.status_code} - {response.text}")
-            raise Exception(f"Anthropic API error: {response.status_code} - {response.text}")
-        
-        result = response.json()
-        retouch_steps = json.loads(result["content"][0]["text"])
+                    "X-Goog-Upload-Protocol": "resumable",
+                    "X-Goog-Upload-Command": "start",
+                    "X-Goog-Upload-Header-Content-Length": str(len(data)),
+                    "X-Goog-Upload-Header-Content-Type": payload.mime,
+                    "Content-Type": "application/json"
+                },
+                _json_dumps_bytes({"file": {"display_name": os.path.basename(image_path)}}),
+                self.spec.name
+            )
+            upload_url = start_response.headers.get("x-goog-upload-url")
+            if not upload_url:
+                raise Exception("upload start failed: missing upload URL")
+            
+            # 画像データの送信と確定
+            upload_response = await self._post(
+                upload_url,
+                {
+                    "X-Goog-Upload-Offset": "0",
+                    "X-Goog-Upload-Command": "upload, finalize"
+                },
+                data,
+                self.spec.name
+            )
+            file_uri = _json_loads(upload_response.content)["file"]["uri"]
+        except Exception as e:
+            logger.warning(f"Google Files APIへのアップロードに失敗したためBase64で送信します: {e}")
+            return None
         
-        return retouch_steps
-
-class GeminiVisionModel(BaseVisionModel):
-    """Gemini Pro Visionモデル"""
+        _GEMINI_FILE_URIS[cache_key] = (file_uri, time.time() + GEMINI_FILE_TTL)
+        _GEMINI_FILE_URIS.move_to_end(cache_key)
+        if len(_GEMINI_FILE_URIS) > GEMINI_FILE_CACHE_SIZE:
+            _GEMINI_FILE_URIS.popitem(last=False)
+        return file_uri
     
-    def _get_api_key_from_env(self) -> str:
-        """環境変数からGoogle APIキーを取得"""
-        api_key = os.environ.get("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY environment variable is not set")
-        return api_key
+    def _forget_upload(self, image_path: str) -> None:
+        """
+        参照できなかったアップロード済みファイルをキャッシュから削除
+        
+        Args:
+            image_path: 画像ファイルのパス
+        """
+        cache_key = (_api_key_digest(self.api_key), load_image_payload(image_path).sha256)
+        _GEMINI_FILE_URIS.pop(cache_key, None)
     
-    def analyze_image(self, image_path: str, prompt: str) -> Dict[str, Any]:
+    async def _image_part(self, image_path: str, inline: bool = False) -> Dict[str, Any]:
         """
-        Gemini Pro Visionを使用して画像を分析
+        リクエストに含める画像パートを構築
         
         Args:
             image_path: 画像ファイルのパス
-            prompt: 分析プロンプト
+            inline: アップロードせずにBase64で埋め込むかどうか
             
         Returns:
-            分析結果
+            file_data（アップロード済み）またはinline_data（Base64）のパート
         """
-        # 画像をBase64エンコード
-        base64_image = self._encode_image_base64(image_path)
-        
-        # APIリクエストの準備
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "contents": [
-                {
-                    "parts": [
-                        {"text": prompt + "\n\nRespond in JSON format."},
-                        {
-                            "inline_data": {
-                                "mime_type": "image/jpeg",
-                                "data": base64_image
-                            }
-                        }
-                    ]
+        file_uri = None if inline else await self._upload_image(image_path)
+        if file_uri is not None:
+            payload = await self._load_image(image_path)
+            return {
+                "file_data": {
+                    "mime_type": payload.mime,
+                    "file_uri": file_uri
                 }
-            ],
-            "generation_config": {
-                "temperature": 0.4,
-                "top_p": 1,
-                "top_k": 32,
-                "max_output_tokens": 1000,
-                "response_mime_type": "application/json"
             }
-        }
-        
-        # APIリクエストの送信
-        response = requests.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/gemini-pro-vision:generateContent?key={self.api_key}",
-            headers=headers,
-            json=payload
-        )
-        
-        # レスポンスの処理
-        if response.status_code != 200:
-            logger.error(f"Google API error: {response.status_code} - {response.text}")
-            raise Exception(f"Google API error: {response.status_code} - {response.text}")
-        
-        result = response.json()
-        analysis = json.loads(result["candidates"][0]["content"]["parts"][0]["text"])
-        
-        return analysis
+        return await super()._image_part(image_path)
     
-    def generate_retouch(self, image_path: str, analysis: Dict[str, Any], instructions: str) -> Dict[str, Any]:
+    async def _build_request(self, image_path: str, prompt: str, max_tokens: int,
+                             stream: bool = False, inline: bool = False) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
         """
-        Gemini Pro Visionを使用してレタッチ手順を生成
+        Gemini APIの形式でリクエストを組み立てる
         
         Args:
             image_path: 画像ファイルのパス
-            analysis: 画像分析結果
-            instructions: レタッチ指示
+            prompt: プロンプト
+            max_tokens: 最大出力トークン数
+            stream: ストリーミング用のリクエストを組み立てるかどうか
+            inline: 画像をアップロードせずにBase64で埋め込むかどうか
             
         Returns:
-            レタッチ手順
+            (エンドポイントURL, リクエストヘッダー, リクエストボディ)のタプル
         """
-        # 画像をBase64エンコード
-        base64_image = self._encode_image_base64(image_path)
-        
-        # APIリクエストの準備
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        # 分析結果とレタッチ指示を組み合わせたプロンプト
-        prompt = f"""
-        Based on the following image analysis:
-        {json.dumps(analysis, indent=2)}
-        
-        And the user instructions:
-        {instructions}
-        
-        Generate detailed Photoshop retouch steps in JSON format.
-        Include specific parameter values for each adjustment.
+        image_part = await self._image_part(image_path, inline)
+        headers = {"Content-Type": "application/json", **self.spec.auth_headers(self.api_key)}
+        payload = self.spec.payload_builder(prompt, image_part, max_tokens, stream)
+        if "file_data" in image_part:
+            # アップロード済みファイルを参照できなかった場合にinline_dataで再送できるようにする
+            payload = _GeminiFilePayload(payload, image_path, prompt, max_tokens, stream)
+        return self.spec.endpoint(self.api_key, stream), headers, payload
+    
+    async def _inline_request(self, payload: "_GeminiFilePayload") -> Tuple[str, Dict[str, str], Dict[str, Any]]:
         """
+        アップロード済みファイルのキャッシュを破棄し、画像をinline_dataで埋め込んだリクエストを組み立てる
         
-        payload = {
-            "contents": [
-                {
-                    "parts": [
-                        {"text": prompt},
-                        {
-                            "inline_data": {
-                                "mime_type": "image/jpeg",
-                                "data": base64_image
-                            }
-                        }
-                    ]
-                }
-            ],
-            "generation_config": {
-                "temperature": 0.4,
-                "top_p": 1,
-                "top_k": 32,
-                "max_output_tokens": 1500,
-                "response_mime_type": "application/json"
-            }
-        }
-        
-        # APIリクエストの送信
-        response = requests.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/gemini-pro-vision:generateContent?key={self.api_key}",
-            headers=headers,
-            json=payload
-        )
+        Args:
+            payload: file_dataを参照するリクエストボディ
+            
+        Returns:
+            (エンドポイントURL, リクエストヘッダー, リクエストボディ)のタプル
+        """
+        logger.warning("Google Files APIのファイルを参照できないため、Base64で再送します")
+        self._forget_upload(payload.image_path)
+        return await self._build_request(payload.image_path, payload.prompt, payload.max_tokens, payload.stream, inline=True)
+    
+    async def _request_text(self, url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> str:
+        """
+        リクエストを送信し、ファイルを参照できない場合はinline_dataで再送する
         
-        # レスポンスの処理
-        if response.status_code != 200:
-            logger.error(f"Google API error: {response.status_code} - {response.text}")
-            raise Exception(f"Google API error: {response.status_code} - {response.text}")
+        Args:
+            url: エンドポイントURL
+            headers: リクエストヘッダー
+            payload: リクエストボディ
+            
+        Returns:
+            生成テキスト
+        """
+        try:
+            return await super()._request_text(url, headers, payload)
+        except ProviderAPIError as e:
+            if not isinstance(payload, _GeminiFilePayload) or e.status_code not in GEMINI_FILE_ERROR_STATUS_CODES:
+                raise
+        return await super()._request_text(*await self._inline_request(payload))
+    
+    async def _stream_post(self, url: str, headers: Dict[str, str], payload: Dict[str, Any], provider: str) -> AsyncIterator[str]:
+        """
+        ストリーミングリクエストを送信し、ファイルを参照できない場合はinline_dataで再送する
         
-        result = response.json()
-        retouch_steps = json.loads(result["candidates"][0]["content"]["parts"][0]["text"])
+        エラーは最初の断片を返す前に送出されるため、再送しても出力は重複しません。
         
-        return retouch_steps
+        Args:
+            url: エンドポイントURL
+            headers: リクエストヘッダー
+            payload: リクエストボディ
+            provider: エラーメッセージに使用するプロバイダー名
+            
+        Yields:
+            生成テキストの断片
+        """
+        try:
+            async for text in super()._stream_post(url, headers, payload, provider):
+                yield text
+            return
+        except ProviderAPIError as e:
+            if not isinstance(payload, _GeminiFilePayload) or e.status_code not in GEMINI_FILE_ERROR_STATUS_CODES:
+                raise
+        url, headers, payload = await self._inline_request(payload)
+        async for text in super()._stream_post(url, headers, payload, provider):
+            yield text
+
+class _GeminiFilePayload(dict):
+    """Files APIのファイルを参照するリクエストボディ（inline_dataでの再送に必要な引数を保持する）"""
+    
+    def __init__(self, payload: Dict[str, Any], image_path: str, prompt: str, max_tokens: int, stream: bool):
+        super().__init__(payload)
+        self.image_path = image_path
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.stream = stream
+
+# 生成済みモデルインスタンスのレジストリ（(モデルタイプ, APIキーのハッシュ) -> インスタンス）
+_MODEL_INSTANCES: "OrderedDict[Tuple[ModelType, str], BaseVisionModel]" = OrderedDict()
+
+# 保持するモデルインスタンスの最大数（APIキーの入れ替えで古いインスタンスが溜まらないようにする）
+MODEL_INSTANCE_CACHE_SIZE = 32
+
+def _api_key_digest(api_key: Optional[str]) -> str:
+    """APIキーをレジストリのキー用にハッシュ化（Noneは環境変数由来として扱う）"""
+    if api_key is None:
+        return "env"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+# モデルタイプと実装クラスの対応
+_MODEL_REGISTRY: Dict[ModelType, Type[BaseVisionModel]] = {
+    ModelType.GPT4_VISION: GPT4VisionModel,
+    ModelType.CLAUDE3_SONNET_VISION: Claude3VisionModel,
+    ModelType.GEMINI_PRO_VISION: GeminiVisionModel
+}
 
 def get_model(model_type: Union[ModelType, str], api_key: Optional[str] = None) -> BaseVisionModel:
     """
     指定されたタイプのモデルインスタンスを取得
     
+    同じモデルタイプとAPIキーの組み合わせに対しては同一のインスタンスを返すため、
+    HTTPセッション（keep-alive接続）がリクエスト間で再利用されます。
+    
     Args:
         model_type: モデルタイプ（ModelTypeまたは文字列）
         api_key: APIキー（Noneの場合は環境変数から取得）
@@ -523,16 +1656,61 @@ def get_model(model_type: Union[ModelType, str], api_key: Optional[str] = None)
         モデルインスタンス
     """
     if isinstance(model_type, str):
-        try:
-            model_type = ModelType(model_type)
-        except ValueError:
-            model_type = ModelType.GPT4_VISION  # デフォルト
-    
-    if model_type == ModelType.GPT4_VISION:
-        return GPT4VisionModel(api_key)
-    elif model_type == ModelType.CLAUDE3_SONNET_VISION:
-        return Claude3VisionModel(api_key)
-    elif model_type == ModelType.GEMINI_PRO_VISION:
-        return GeminiVisionModel(api_key)
-    else:
-        raise ValueError(f"Unsupported model type: {model_type}")
\ No newline at end of file
+        # 未知の文字列はデフォルト（GPT-4 Vision）として扱う
+        model_type = ModelType._value2member_map_.get(model_type, ModelType.GPT4_VISION)
+    
+    registry_key = (model_type, _api_key_digest(api_key))
+    model = _MODEL_INSTANCES.get(registry_key)
+    if model is None:
+        model_class = _MODEL_REGISTRY.get(model_type)
+        if model_class is None:
+            raise ValueError(f"Unsupported model type: {model_type}")
+        model = model_class(api_key)
+        _MODEL_INSTANCES[registry_key] = model
+        logger.debug(f"モデルインスタンスを作成しました: {model_type.value}")
+    _MODEL_INSTANCES.move_to_end(registry_key)
+    if len(_MODEL_INSTANCES) > MODEL_INSTANCE_CACHE_SIZE:
+        _MODEL_INSTANCES.popitem(last=False)
+    return model
+
+async def race(models: Iterable[Union[BaseVisionModel, ModelType, str]], method: str, *args: Any, **kwargs: Any) -> Any:
+    """
+    複数のモデルに同じリクエストを同時に送信し、最初に成功した結果を返す
+    
+    最初の結果が得られた時点で残りのリクエストはキャンセルします。
+    
+    Args:
+        models: モデルインスタンスまたはモデルタイプのリスト
+        method: 呼び出すメソッド名（"analyze_image"など）
+        *args: メソッドに渡す位置引数
+        **kwargs: メソッドに渡すキーワード引数
+        
+    Returns:
+        最初に成功したモデルの結果
+    """
+    instances = [model if isinstance(model, BaseVisionModel) else get_model(model) for model in models]
+    if not instances:
+        raise ValueError("No models specified")
+    
+    pending = {asyncio.ensure_future(getattr(model, method)(*args, **kwargs)) for model in instances}
+    errors = []
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                # 外部からキャンセルされたタスクは負けた候補として扱う
+                if task.cancelled():
+                    continue
+                error = task.exception()
+                if error is None:
+                    return task.result()
+                errors.append(error)
+                logger.warning(f"race: モデルの呼び出しに失敗しました: {error}")
+    finally:
+        for task in pending:
+            task.cancel()
+    
+    # すべてのモデルが失敗した場合は最初のエラーを送出する
+    if not errors:
+        raise RuntimeError("All model calls were cancelled")
+    raise errors[0]
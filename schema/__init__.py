@@ -127,4 +127,5 @@ class ThumbnailStreamRequest(BaseModel):
     height: int = Field(256, description="サムネイルの高さ")
     format: str = Field("jpeg", description="出力形式（jpeg, png）")
     quality: int = Field(80, description="画質（0-100）")
-    bridge_mode: str = Field("applescript", description="使用するブリッジモード")
\ No newline at end of file
+    bridge_mode: str = Field("applescript", description="使用するブリッジモード")
+    binary: bool = Field(False, description="画像データをBase64でJSONに含めず、結果の直後にバイナリフレームで送信するかどうか")
\ No newline at end of file
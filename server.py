@@ -7,6 +7,11 @@ import uuid
 import time
 from datetime import datetime
 
+try:
+    import uvloop
+except ImportError:  # uvloopが利用できない場合（Windowsなど）は標準のイベントループを使用
+    uvloop = None
+
 from photoshop_mcp_server.bridge import get_bridge
 from photoshop_mcp_server.schema import (
     OpenFileRequest, CloseFileRequest, SaveFileRequest,
@@ -20,6 +25,7 @@ from photoshop_mcp_server.schema import (
 
 # LLM自動レタッチモジュールのインポート
 from photoshop_mcp_server.llm_retouch import LLMRetouchManager
+from photoshop_mcp_server.llm_retouch.models import aclose_client
 
 # クラスターモジュールのインポート
 from photoshop_mcp_server.cluster.dispatcher import ClusterDispatcher, DispatcherConfig, Job, JobStatus
@@ -36,6 +42,11 @@ cluster_dispatcher: Optional[ClusterDispatcher] = None
 ws_clients: Set[WebSocket] = set()
 uxp_bridge = None
 
+@app.on_event("shutdown")
+async def shutdown_llm_client():
+    """LLM APIの共有HTTPクライアントを閉じる"""
+    await aclose_client()
+
 @app.post("/openFile", response_model=StatusResponse)
 async def open_file(body: OpenFileRequest):
     """PSDファイルを開く"""
@@ -263,14 +274,24 @@ async def generate_thumbnail_stream(websocket: WebSocket):
                     height=request.height,
                     format=request.format,
                     quality=request.quality,
-                    callback=send_progress
+                    callback=send_progress,
+                    return_bytes=request.binary
                 )
                 
-                # 最終結果を送信
-                await websocket.send_json({
-                    "type": "result",
-                    "data": result
-                })
+                if request.binary:
+                    # 画像データを除いた結果を送信し、画像はバイナリフレームでそのまま送信する
+                    thumbnail = result.pop("thumbnail", b"")
+                    await websocket.send_json({
+                        "type": "result",
+                        "data": result
+                    })
+                    await websocket.send_bytes(thumbnail)
+                else:
+                    # 最終結果を送信
+                    await websocket.send_json({
+                        "type": "result",
+                        "data": result
+                    })
                 
             except Exception as e:
                 logger.error(f"サムネイル生成エラー: {e}")
@@ -467,6 +488,19 @@ def init_uxp_bridge():
     except Exception as e:
         logger.error(f"UXPブリッジ初期化エラー: {e}")
 
+def _new_event_loop() -> asyncio.AbstractEventLoop:
+    """イベントループを作成し、現在のスレッドのイベントループとして設定する
+    
+    uvloopが利用可能であればuvloopのイベントループを使用し、
+    ブリッジのサブプロセス起動やソケット処理のオーバーヘッドを減らす。
+    
+    Returns:
+        作成したイベントループ
+    """
+    loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop
+
 def start_server(host: str = "127.0.0.1", port: int = 8000, init_uxp: bool = False, cluster_mode: bool = False, cluster_config: Dict[str, Any] = None):
     """サーバーを起動する"""
     import uvicorn
@@ -483,8 +517,8 @@ def start_server(host: str = "127.0.0.1", port: int = 8000, init_uxp: bool = Fal
         asyncio.create_task(cluster_dispatcher.start())
         logger.info(f"クラスターモードを有効化しました (ID: {config.cluster_id})")
     
-    # サーバー起動
-    uvicorn.run(app, host=host, port=port)
+    # サーバー起動（uvloopが利用可能であればuvloopのイベントループを使用する）
+    uvicorn.run(app, host=host, port=port, loop="uvloop" if uvloop is not None else "asyncio")
 
 def start_cluster_dispatcher(host: str = "0.0.0.0", port: int = 50051, routing_strategy: str = "least_busy", node_timeout: float = 60.0):
     """クラスターディスパッチャーを起動する"""
@@ -511,8 +545,8 @@ def start_cluster_dispatcher(host: str = "0.0.0.0", port: int = 50051, routing_s
     # ディスパッチャーを起動
     dispatcher = ClusterDispatcher(config)
     
-    # イベントループを取得
-    loop = asyncio.get_event_loop()
+    # イベントループを作成
+    loop = _new_event_loop()
     
     # ディスパッチャーを起動
     loop.run_until_complete(dispatcher.start())
@@ -543,8 +577,8 @@ def start_cluster_node(host: str = "0.0.0.0", port: int = 50052, dispatcher_addr
     # ノードを起動
     node = ClusterNode(config)
     
-    # イベントループを取得
-    loop = asyncio.get_event_loop()
+    # イベントループを作成
+    loop = _new_event_loop()
     
     # ノードを起動
     loop.run_until_complete(node.start())
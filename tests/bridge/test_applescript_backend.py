@@ -0,0 +1,45 @@
+import asyncio
+import json
+import platform
+import unittest
+
+from photoshop_mcp_server.bridge.applescript_backend import _OSASCRIPT_SERVER_JS
+
+
+@unittest.skipIf(platform.system() != "Darwin", "macOS専用のテスト")
+class TestOsascriptServer(unittest.IsolatedAsyncioTestCase):
+    """常駐osascriptのリクエスト処理のテスト"""
+    
+    async def asyncSetUp(self):
+        """テスト前の準備"""
+        self.proc = await asyncio.create_subprocess_exec(
+            "/usr/bin/osascript", "-l", "JavaScript", "-e", _OSASCRIPT_SERVER_JS,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+    
+    async def asyncTearDown(self):
+        """テスト後のクリーンアップ"""
+        self.proc.stdin.close()
+        await asyncio.wait_for(self.proc.wait(), timeout=5)
+    
+    async def test_multibyte_character_split_across_reads(self):
+        """多バイト文字の途中でパイプの読み込みが区切られても、リクエストを正しく処理すること"""
+        name = "レイヤー名"
+        line = json.dumps({"id": 1, "script": f'return "{name}"'}, ensure_ascii=False).encode("utf-8") + b"\n"
+        # 「レ」（3バイト）の1バイト目の直後で区切って送信する
+        split = line.index(name.encode("utf-8")) + 1
+        
+        self.proc.stdin.write(line[:split])
+        await self.proc.stdin.drain()
+        await asyncio.sleep(0.5)
+        self.proc.stdin.write(line[split:])
+        await self.proc.stdin.drain()
+        
+        response = json.loads(await asyncio.wait_for(self.proc.stdout.readline(), timeout=10))
+        self.assertEqual(response, {"id": 1, "stdout": name, "stderr": "", "returncode": 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
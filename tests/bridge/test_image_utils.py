@@ -0,0 +1,181 @@
+import io
+import os
+import struct
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from PIL import Image
+
+from photoshop_mcp_server.bridge import image_utils
+
+
+def _jpeg_bytes(width, height, color=(200, 100, 50)):
+    """テスト用のJPEGのバイト列を生成する"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def _thumbnail_resource_data(jpeg, width, height):
+    """サムネイルのイメージリソースのデータ（28バイトの情報とJPEG）を生成する"""
+    header = struct.pack(">IIIIIIHH", 1, width, height, width * 3, width * 3 * height, len(jpeg), 24, 1)
+    return header + jpeg
+
+
+def _psd_resource(resource_id, data, name=b""):
+    """イメージリソースを1件生成する（名前とデータは偶数バイトに揃える）"""
+    name_field = bytes([len(name)]) + name
+    if len(name_field) % 2:
+        name_field += b"\0"
+    padding = b"\0" if len(data) % 2 else b""
+    return b"8BIM" + struct.pack(">H", resource_id) + name_field + struct.pack(">I", len(data)) + data + padding
+
+
+def _psd_file(resources, resources_length=None):
+    """ヘッダー、空のカラーモードデータ、イメージリソースからなるPSDのバイト列を生成する"""
+    header = b"8BPS" + struct.pack(">H6xHIIHH", 1, 3, 600, 800, 8, 3)
+    if resources_length is None:
+        resources_length = len(resources)
+    return header + struct.pack(">I", 0) + struct.pack(">I", resources_length) + resources
+
+
+class TestPillowThumbnail(unittest.TestCase):
+    """Pillowによるサムネイル生成のテスト"""
+    
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+    
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.temp_dir.cleanup()
+    
+    def _resized_sizes(self, path, width, height):
+        """サムネイル生成時にresizeされた画像の大きさを記録する"""
+        sizes = []
+        original_resize = Image.Image.resize
+        
+        def spy_resize(image, *args, **kwargs):
+            sizes.append(image.size)
+            return original_resize(image, *args, **kwargs)
+        
+        with patch.object(Image.Image, "resize", spy_resize):
+            result = image_utils.pillow_thumbnail(path, width, height, "jpeg", 80, as_bytes=True)
+        return result, sizes
+    
+    def test_jpeg_is_draft_decoded(self):
+        """JPEGは縮小デコードされ、元の大きさで読み込まれないこと"""
+        path = os.path.join(self.temp_dir.name, "large.jpg")
+        Image.new("RGB", (4000, 3000), (200, 100, 50)).save(path, quality=90)
+        
+        (data, width, height), sizes = self._resized_sizes(path, 256, 256)
+        
+        self.assertEqual((width, height), (256, 192))
+        self.assertEqual(Image.open(io.BytesIO(data)).size, (256, 192))
+        self.assertEqual(len(sizes), 1)
+        self.assertLess(sizes[0][0], 4000)
+        self.assertGreaterEqual(sizes[0][0], 256)
+    
+    def test_exif_rotated_jpeg(self):
+        """EXIFで回転する画像は、回転後の向きで要求サイズに収まること"""
+        path = os.path.join(self.temp_dir.name, "rotated.jpg")
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        Image.new("RGB", (4000, 3000), (200, 100, 50)).save(path, quality=90, exif=exif)
+        
+        (data, width, height), sizes = self._resized_sizes(path, 256, 256)
+        
+        self.assertEqual((width, height), (192, 256))
+        self.assertLess(sizes[0][1], 4000)
+        self.assertGreaterEqual(sizes[0][1], 256)
+
+
+
+class TestReadPsdThumbnail(unittest.TestCase):
+    """PSDの埋め込みサムネイルの読み込みのテスト"""
+    
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+    
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.temp_dir.cleanup()
+    
+    def _write_psd(self, data, name="test.psd"):
+        """PSDのバイト列を一時ファイルに書き込む"""
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+    
+    def test_thumbnail_resource(self):
+        """0x040Cのリソースから埋め込みサムネイルのJPEGを取り出せること"""
+        jpeg = _jpeg_bytes(160, 120)
+        path = self._write_psd(_psd_file(_psd_resource(0x040C, _thumbnail_resource_data(jpeg, 160, 120))))
+        
+        self.assertEqual(image_utils.read_psd_thumbnail(path), (jpeg, False))
+    
+    def test_prefers_0x040c_over_bgr_resource(self):
+        """0x0409（BGR形式）と0x040Cの両方がある場合は0x040Cを使用すること"""
+        old_jpeg = _jpeg_bytes(80, 60, (50, 100, 200))
+        jpeg = _jpeg_bytes(160, 120)
+        resources = (_psd_resource(0x0409, _thumbnail_resource_data(old_jpeg, 80, 60))
+                     + _psd_resource(0x040C, _thumbnail_resource_data(jpeg, 160, 120)))
+        path = self._write_psd(_psd_file(resources))
+        
+        self.assertEqual(image_utils.read_psd_thumbnail(path), (jpeg, False))
+        
+        # 0x0409のみの場合はBGR形式として返す
+        path = self._write_psd(_psd_file(_psd_resource(0x0409, _thumbnail_resource_data(old_jpeg, 80, 60))), "old.psd")
+        self.assertEqual(image_utils.read_psd_thumbnail(path), (old_jpeg, True))
+    
+    def test_odd_length_resources_are_padded(self):
+        """奇数長の名前やデータを持つリソースの後ろにあるサムネイルも取り出せること"""
+        jpeg = _jpeg_bytes(160, 120)
+        resources = (_psd_resource(0x0400, b"abc", name=b"ab")
+                     + _psd_resource(0x0401, b"x", name=b"odd")
+                     + _psd_resource(0x040C, _thumbnail_resource_data(jpeg, 160, 120)))
+        path = self._write_psd(_psd_file(resources))
+        
+        self.assertEqual(image_utils.read_psd_thumbnail(path), (jpeg, False))
+    
+    def test_truncated_resources(self):
+        """イメージリソースが途中で切れているファイルでは例外を送出せずNoneを返すこと"""
+        jpeg = _jpeg_bytes(160, 120)
+        resource = _psd_resource(0x040C, _thumbnail_resource_data(jpeg, 160, 120))
+        
+        # リソースのサイズの途中で切れている
+        truncated = resource[:10]
+        path = self._write_psd(_psd_file(truncated, resources_length=len(resource)))
+        self.assertIsNone(image_utils.read_psd_thumbnail(path))
+        
+        # サムネイルの情報の途中で切れている
+        truncated = resource[:12 + 20]
+        path = self._write_psd(_psd_file(truncated, resources_length=len(resource)), "info.psd")
+        self.assertIsNone(image_utils.read_psd_thumbnail(path))
+        
+        # イメージリソースのセクションの長さがない
+        path = self._write_psd(_psd_file(b"")[:30], "header.psd")
+        self.assertIsNone(image_utils.read_psd_thumbnail(path))
+    
+    def test_not_psd(self):
+        """PSDのシグネチャがないファイルではNoneを返すこと"""
+        path = self._write_psd(_jpeg_bytes(16, 16), "image.psd")
+        self.assertIsNone(image_utils.read_psd_thumbnail(path))
+    
+    def test_pillow_thumbnail_uses_embedded_thumbnail(self):
+        """要求サイズ以上の埋め込みサムネイルはPillowで縮小し、小さい場合はPhotoshopに任せること"""
+        jpeg = _jpeg_bytes(160, 120)
+        path = self._write_psd(_psd_file(_psd_resource(0x040C, _thumbnail_resource_data(jpeg, 160, 120))))
+        
+        data, width, height = image_utils.pillow_thumbnail(path, 80, 80, "jpeg", 80, as_bytes=True)
+        self.assertEqual((width, height), (80, 60))
+        self.assertEqual(Image.open(io.BytesIO(data)).size, (80, 60))
+        
+        self.assertIsNone(image_utils.pillow_thumbnail(path, 320, 320, "jpeg", 80))
+
+
+if __name__ == '__main__':
+    unittest.main()
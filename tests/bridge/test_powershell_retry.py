@@ -0,0 +1,140 @@
+import asyncio
+import subprocess
+import sys
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from photoshop_mcp_server.bridge import powershell_backend
+from photoshop_mcp_server.bridge.powershell_backend import PowerShellBridge, _PowerShellHostExited, _is_transient_error
+
+
+class TestIsTransientError(unittest.TestCase):
+    """一時的なエラーの判定のテスト"""
+    
+    def test_transient_errors(self):
+        """Photoshopのビジー状態、タイムアウト、ホストの切断は一時的なエラーと判定すること"""
+        errors = [
+            TimeoutError("PowerShell script execution timed out after 30 seconds"),
+            ConnectionError("connection reset"),
+            _PowerShellHostExited("PowerShell host exited unexpectedly"),
+            BrokenPipeError(32, "Broken pipe"),
+            RuntimeError("Script execution failed: Call was rejected by callee. (Exception from HRESULT: 0x80010001 (RPC_E_CALL_REJECTED))"),
+            RuntimeError("Script execution failed: The message filter indicated that the application is busy. (0x8001010A)"),
+            RuntimeError("Script execution failed: RPC_E_SERVERCALL_RETRYLATER"),
+            RuntimeError("PowerShell script execution failed: The pipe is being closed."),
+        ]
+        for error in errors:
+            with self.subTest(error=error):
+                self.assertTrue(_is_transient_error(error))
+    
+    def test_permanent_errors(self):
+        """スクリプトの誤りなど、再実行しても成功しないエラーは一時的なエラーと判定しないこと"""
+        errors = [
+            RuntimeError("Script execution failed: SyntaxError: Expected: ;"),
+            RuntimeError("Script execution failed: Error 8800: General Photoshop error occurred."),
+            ValueError("invalid layer id"),
+            subprocess.CalledProcessError(1, "powershell.exe"),
+        ]
+        for error in errors:
+            with self.subTest(error=error):
+                self.assertFalse(_is_transient_error(error))
+
+
+class TestExecuteScriptRetry(unittest.IsolatedAsyncioTestCase):
+    """execute_scriptの再試行のテスト"""
+    
+    def setUp(self):
+        """テスト前の準備"""
+        self.bridge = PowerShellBridge(persistent=False)
+        self.sleep = AsyncMock()
+        patcher = patch.object(powershell_backend.asyncio, "sleep", new=self.sleep)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    async def test_retries_transient_errors(self):
+        """一時的なエラーは上限付きの指数バックオフで再試行すること"""
+        self.bridge.max_retries = 5
+        self.bridge.retry_delay = 1.0
+        self.bridge.max_retry_delay = 3.0
+        busy = ("", "The message filter indicated that the application is busy", 1)
+        run = AsyncMock(side_effect=[busy, busy, busy, busy, ('{"ok": true}', "", 0)])
+        
+        with patch.object(self.bridge, "_run_powershell_script", new=run):
+            result = await self.bridge.execute_script("app.activeDocument.name")
+        
+        self.assertEqual(result, {"ok": True})
+        self.assertEqual(run.await_count, 5)
+        # 揺らぎ（0〜0.1秒）を除いた待機時間は1, 2, 3（上限）, 3秒
+        delays = [call.args[0] for call in self.sleep.await_args_list]
+        for delay, expected in zip(delays, [1.0, 2.0, 3.0, 3.0]):
+            self.assertGreaterEqual(delay, expected)
+            self.assertLessEqual(delay, expected + 0.1)
+        self.assertEqual(self.bridge.error_counts, {"RuntimeError": 4})
+    
+    async def test_permanent_error_is_not_retried(self):
+        """スクリプトの誤りは再試行せずにすぐ送出すること"""
+        run = AsyncMock(return_value=("", "SyntaxError: Expected: ;", 1))
+        
+        with patch.object(self.bridge, "_run_powershell_script", new=run):
+            with self.assertRaisesRegex(RuntimeError, "SyntaxError"):
+                await self.bridge.execute_script("app.activeDocument.name(")
+        
+        self.assertEqual(run.await_count, 1)
+        self.sleep.assert_not_awaited()
+    
+    async def test_gives_up_after_max_retries(self):
+        """再試行の上限に達した場合は最後のエラーを送出すること"""
+        self.bridge.max_retries = 2
+        run = AsyncMock(side_effect=TimeoutError("PowerShell script execution timed out after 30 seconds"))
+        
+        with patch.object(self.bridge, "_run_powershell_script", new=run):
+            with self.assertRaises(TimeoutError):
+                await self.bridge.execute_script("app.activeDocument.name")
+        
+        self.assertEqual(run.await_count, 3)
+        self.assertEqual(self.sleep.await_count, 2)
+
+# 行単位のプロトコルを受け付けるが、要求にも停止の指示にも応答しない常駐ホスト
+_UNRESPONSIVE_HOST = "import sys\nfor line in sys.stdin:\n    pass\n"
+
+
+class TestHostRequestTimeout(unittest.IsolatedAsyncioTestCase):
+    """常駐ホストで要求がタイムアウトした場合のテスト"""
+    
+    def setUp(self):
+        """テスト前の準備"""
+        self.bridge = PowerShellBridge()
+        self.bridge.timeout = 1.0
+        self.fallback = AsyncMock()
+        patchers = [
+            patch.object(self.bridge, "_host_command", return_value=[sys.executable, "-c", _UNRESPONSIVE_HOST]),
+            patch.object(powershell_backend, "HOST_CANCEL_TIMEOUT", 0.05),
+            patch.object(powershell_backend.asyncio, "create_subprocess_exec", new=self.fallback),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    async def asyncTearDown(self):
+        """テスト後のクリーンアップ"""
+        await self.bridge.close()
+    
+    async def test_killed_host_does_not_disable_or_replay(self):
+        """停止できない要求のためにホストを強制終了しても、並行中の要求を再実行せず、常駐ホストも無効にしないこと"""
+        timed_out = asyncio.create_task(self.bridge._run_powershell_script("Start-Sleep 60"))
+        await asyncio.sleep(0.5)
+        concurrent_run = asyncio.create_task(self.bridge._run_powershell_script("Invoke-Action"))
+        
+        with self.assertRaisesRegex(RuntimeError, "timed out"):
+            await timed_out
+        stdout, stderr, returncode = await concurrent_run
+        
+        self.assertEqual((stdout, returncode), ("", 1))
+        self.assertIn("restarted", stderr)
+        self.assertFalse(powershell_backend._is_transient_error(RuntimeError(f"Script execution failed: {stderr}")))
+        self.assertTrue(self.bridge.persistent)
+        self.fallback.assert_not_awaited()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from photoshop_mcp_server.bridge import uxp_backend
+from photoshop_mcp_server.bridge.uxp_backend import UXPBridge
+
+
+class _FakeClient:
+    """送信したフレームを記録するWebSocketクライアント"""
+    
+    def __init__(self, error=None):
+        """初期化"""
+        self.frames = []
+        self.error = error
+        self.remote_address = ("127.0.0.1", 0)
+        self._closed = asyncio.Event()
+    
+    async def send(self, frame):
+        """フレームを記録する（errorを指定した場合は送出する）"""
+        if self.error is not None:
+            raise self.error
+        self.frames.append(frame)
+    
+    def close(self):
+        """接続を閉じ、受信ループを終了させる"""
+        self._closed.set()
+    
+    def __aiter__(self):
+        """受信メッセージのイテレーター（閉じるまでメッセージを返さない）"""
+        return self
+    
+    async def __anext__(self):
+        """接続が閉じるまで待機して終了する"""
+        await self._closed.wait()
+        raise StopAsyncIteration
+
+
+class TestCommandBatching(unittest.IsolatedAsyncioTestCase):
+    """送信キューのコマンドをまとめて送信する処理のテスト"""
+    
+    async def asyncSetUp(self):
+        """テスト前の準備"""
+        with patch.object(UXPBridge, "_start_server", new=AsyncMock()):
+            self.bridge = UXPBridge()
+        self.client = _FakeClient()
+        self.bridge._client_snapshot = (self.client,)
+    
+    async def asyncTearDown(self):
+        """テスト後のクリーンアップ"""
+        await self.bridge.stop()
+    
+    async def _send_commands(self, count):
+        """コマンドを同時に送信し、送信タスクを返す"""
+        tasks = [
+            asyncio.create_task(self.bridge._send_command("executeAction", {"index": i, "name": f"アクション{i}"}))
+            for i in range(count)
+        ]
+        # 書き込みタスクがキューを送信し終えるまで待つ
+        for _ in range(5):
+            await asyncio.sleep(0)
+        return tasks
+    
+    async def _reply(self, message_id, result):
+        """プラグインからの応答を受信する"""
+        await self.bridge._process_message(
+            self.client, json.dumps({"command": "action_result", "id": message_id, "result": result}))
+    
+    async def test_concurrent_commands_share_one_frame(self):
+        """同時に送信したコマンドは{"batch": [...]}の1フレームにまとめて送信すること"""
+        tasks = await self._send_commands(3)
+        
+        self.assertEqual(len(self.client.frames), 1)
+        self.assertIsInstance(self.client.frames[0], bytes)
+        self.assertEqual(json.loads(self.client.frames[0]), {"batch": [
+            {"command": "executeAction", "id": i + 1, "params": {"index": i, "name": f"アクション{i}"}}
+            for i in range(3)
+        ]})
+        
+        # 応答はメッセージIDごとに呼び出し元へ返す
+        for message_id in (3, 1, 2):
+            await self._reply(message_id, {"value": message_id})
+        results = await asyncio.gather(*tasks)
+        self.assertEqual([result["result"] for result in results], [{"value": 1}, {"value": 2}, {"value": 3}])
+    
+    async def test_single_command_is_not_wrapped(self):
+        """1件だけの場合はbatchで包まずに送信すること"""
+        task, = await self._send_commands(1)
+        
+        self.assertEqual(json.loads(self.client.frames[0]),
+                         {"command": "executeAction", "id": 1, "params": {"index": 0, "name": "アクション0"}})
+        await self._reply(1, True)
+        await task
+    
+    async def test_batch_size_limit(self):
+        """まとめるコマンドの合計サイズが上限に達した場合は次のフレームに分けること"""
+        frame_size = len(uxp_backend._command_frame("executeAction", 1, {"index": 0, "name": "アクション0"}))
+        with patch.object(uxp_backend, "OUTBOX_BATCH_BYTES", frame_size * 2):
+            tasks = await self._send_commands(5)
+        
+        batches = [json.loads(frame) for frame in self.client.frames]
+        self.assertEqual([len(batch["batch"]) for batch in batches[:2]], [2, 2])
+        self.assertEqual(batches[2]["id"], 5)
+        for message_id in range(1, 6):
+            await self._reply(message_id, True)
+        await asyncio.gather(*tasks)
+    
+    async def test_send_error_fails_every_batched_command(self):
+        """送信に失敗した場合は、まとめて送信したすべてのコマンドの呼び出し元に例外を返すこと"""
+        self.client.error = ConnectionError("closed")
+        tasks = await self._send_commands(3)
+        
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ConnectionError) for result in results))
+        self.assertEqual(self.bridge.pending_requests, {})
+
+
+
+class TestClientDisconnect(unittest.IsolatedAsyncioTestCase):
+    """プラグインの切断時に保留中のリクエストを失敗させる処理のテスト"""
+    
+    async def asyncSetUp(self):
+        """テスト前の準備"""
+        with patch.object(UXPBridge, "_start_server", new=AsyncMock()):
+            self.bridge = UXPBridge()
+        self.first = _FakeClient()
+        self.second = _FakeClient()
+        self.handlers = [asyncio.create_task(self.bridge._handle_client(client, "/")) for client in (self.first, self.second)]
+        await asyncio.sleep(0)
+    
+    async def asyncTearDown(self):
+        """テスト後のクリーンアップ"""
+        for client in (self.first, self.second):
+            client.close()
+        await asyncio.gather(*self.handlers)
+        await self.bridge.stop()
+    
+    async def test_disconnect_fails_only_requests_sent_to_that_client(self):
+        """他のプラグインが接続中でも、切断したプラグインに送信したリクエストはすぐに失敗すること"""
+        tasks = [asyncio.create_task(self.bridge._send_command("executeAction", {"index": i})) for i in range(2)]
+        for _ in range(5):
+            await asyncio.sleep(0)
+        self.assertEqual(len(self.first.frames), 2)
+        
+        # 画像データのバイナリフレームを待っている応答も失敗させる
+        await self.bridge._process_message(self.first, json.dumps(
+            {"command": "action_result", "id": 1, "binary": ["result", "thumbnail"], "result": {}}))
+        
+        self.first.close()
+        results = await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), timeout=1)
+        
+        self.assertTrue(all(isinstance(result, ConnectionError) for result in results))
+        self.assertEqual(self.bridge.pending_requests, {})
+        self.assertEqual(self.bridge._request_clients, {})
+        self.assertEqual(self.bridge._client_snapshot, (self.second,))
+        
+        # 以降のコマンドは接続中のプラグインに送信する
+        task = asyncio.create_task(self.bridge._send_command("executeAction", {"index": 2}))
+        for _ in range(5):
+            await asyncio.sleep(0)
+        self.assertEqual(json.loads(self.second.frames[-1])["id"], 3)
+        await self.bridge._process_message(self.second, json.dumps({"command": "action_result", "id": 3, "result": True}))
+        self.assertEqual((await task)["result"], True)
+        self.assertEqual(self.bridge._request_clients, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
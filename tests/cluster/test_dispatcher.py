@@ -0,0 +1,180 @@
+import asyncio
+import random
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from photoshop_mcp_server.cluster.dispatcher import (
+    ClusterDispatcher, DispatcherConfig, Job, JobStatus, Node, NodeStatus, RoutingStrategy,
+    NODE_HEAP_COMPACT_FACTOR, _average_latency_key, _load_factor_key
+)
+
+
+class TestHeapNodeSelection(unittest.TestCase):
+    """ヒープによるノード選択のテスト"""
+    
+    def setUp(self):
+        """テスト前の準備"""
+        self.rng = random.Random(1234)
+        self.dispatcher = ClusterDispatcher(DispatcherConfig())
+        self.job = Job(job_id="job", job_type="execute_command", payload=b"")
+        self.next_node = 0
+        for _ in range(8):
+            self._add_node()
+    
+    def _add_node(self):
+        """ランダムな同時実行数の上限を持つノードを登録する"""
+        node = Node(
+            node_id=f"node-{self.next_node}",
+            host="127.0.0.1",
+            port=50100 + self.next_node,
+            capabilities=[],
+            max_concurrent_jobs=self.rng.randint(1, 6),
+            status=NodeStatus.HEALTHY
+        )
+        self.next_node += 1
+        self.dispatcher._add_node(node)
+    
+    def _mutate(self):
+        """負荷・レイテンシ・状態・登録をランダムに変更する（ディスパッチャーと同じくヒープに反映する）"""
+        nodes = list(self.dispatcher.nodes.values())
+        node = self.rng.choice(nodes)
+        action = self.rng.random()
+        if action < 0.35:
+            node.active_jobs = self.rng.randint(0, node.max_concurrent_jobs)
+        elif action < 0.65:
+            node.update_latency(self.rng.choice([0.05, 0.1, 0.2, 0.5, 1.0]))
+        elif action < 0.85:
+            # 状態は比較する値を変えないため、ヒープは更新しない
+            node.status = self.rng.choice([NodeStatus.HEALTHY, NodeStatus.DEGRADED, NodeStatus.UNHEALTHY, NodeStatus.UNKNOWN])
+            return
+        elif action < 0.93 and len(nodes) > 2:
+            self.dispatcher._remove_node(node.node_id)
+            return
+        else:
+            self._add_node()
+            return
+        self.dispatcher._update_node_heaps(node)
+    
+    def _check_selection(self, strategy, key):
+        """ヒープから選択したノードの値が、全件からmin()で選択した値と一致することを確認する"""
+        self.dispatcher.config.routing_strategy = strategy
+        for step in range(2000):
+            self._mutate()
+            available = [node for node in self.dispatcher.nodes.values() if node.is_available]
+            selected = self.dispatcher._select_node(self.job, available)
+            if not available:
+                self.assertIsNone(selected)
+                continue
+            with self.subTest(step=step):
+                self.assertIn(selected, available)
+                self.assertEqual(key(selected), key(min(available, key=key)))
+    
+    def test_least_busy_matches_min(self):
+        """最も負荷の低いノードの選択がmin()と一致すること"""
+        self._check_selection(RoutingStrategy.LEAST_BUSY, _load_factor_key)
+    
+    def test_lowest_latency_matches_min(self):
+        """最も平均レイテンシの低いノードの選択がmin()と一致すること"""
+        self._check_selection(RoutingStrategy.LOWEST_LATENCY, _average_latency_key)
+    
+    def test_heaps_stay_bounded(self):
+        """古いエントリが溜まってもヒープはノード数に比例した大きさに保たれること"""
+        node = self.dispatcher.nodes["node-0"]
+        for i in range(1000):
+            node.active_jobs = i % (node.max_concurrent_jobs + 1)
+            node.update_latency(0.01 * (i % 7 + 1))
+            self.dispatcher._update_node_heaps(node)
+        
+        limit = NODE_HEAP_COMPACT_FACTOR * len(self.dispatcher.nodes) + 16
+        self.assertLessEqual(len(self.dispatcher._load_heap), limit)
+        self.assertLessEqual(len(self.dispatcher._latency_heap), limit)
+    
+    def test_unlisted_nodes_fall_back_to_min(self):
+        """ヒープに登録されていないノードしかない場合も全件から選択できること"""
+        node = Node(node_id="external", host="127.0.0.1", port=50999, capabilities=[],
+                    max_concurrent_jobs=2, status=NodeStatus.HEALTHY)
+        
+        self.assertIs(self.dispatcher._select_node(self.job, [node]), node)
+
+
+
+class TestJobDispatcherTask(unittest.IsolatedAsyncioTestCase):
+    """ディスパッチタスクのテスト"""
+    
+    async def asyncSetUp(self):
+        """テスト前の準備"""
+        self.dispatcher = ClusterDispatcher(DispatcherConfig())
+        self.node = Node(node_id="node", host="127.0.0.1", port=50100, capabilities=[],
+                         max_concurrent_jobs=1, status=NodeStatus.HEALTHY, active_jobs=1)
+        self.dispatcher._add_node(self.node)
+        self.assign = AsyncMock()
+        patcher = patch.object(self.dispatcher, "_assign_job_to_node", new=self.assign)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dispatcher.is_running = True
+        self.dispatcher._dispatch_task = asyncio.create_task(self.dispatcher._job_dispatcher_task())
+    
+    async def asyncTearDown(self):
+        """テスト後のクリーンアップ"""
+        self.dispatcher.is_running = False
+        self.dispatcher._dispatch_task.cancel()
+        await asyncio.gather(self.dispatcher._dispatch_task, return_exceptions=True)
+    
+    async def test_waits_for_available_node(self):
+        """空いているノードがない間はポーリングせずに待機し、ノードが空いた時点で割り当てること"""
+        job = Job(job_id="job", job_type="execute_command", payload=b"")
+        await self.dispatcher.add_job(job)
+        
+        yield_control = asyncio.sleep
+        
+        async def record_sleep(delay):
+            await yield_control(0)
+        
+        # ディスパッチタスクの待機を記録する（テスト側は元のasyncio.sleepで制御を渡す）
+        with patch.object(asyncio, "sleep", new=AsyncMock(side_effect=record_sleep)) as sleep:
+            for _ in range(10):
+                await yield_control(0)
+            # ノードの空きを待っている間は割り当ても再試行の待機も行わない
+            self.assign.assert_not_awaited()
+            sleep.assert_not_awaited()
+            self.assertEqual(len(self.dispatcher.job_queue), 1)
+            
+            # ジョブの完了でノードが空くと、待機中のディスパッチタスクが割り当てる
+            self.node.active_jobs = 0
+            self.dispatcher._update_node_heaps(self.node)
+            for _ in range(10):
+                await yield_control(0)
+        
+        self.assign.assert_awaited_once_with(job, self.node)
+        self.assertEqual(self.dispatcher.job_queue, [])
+
+
+class TestJobExecutionTasks(unittest.IsolatedAsyncioTestCase):
+    """ノードで実行するジョブのタスクのテスト"""
+    
+    async def test_failed_execution_releases_node(self):
+        """実行中のタスクが例外で終了した場合は、ジョブを失敗としてノードの割り当てを解放すること"""
+        dispatcher = ClusterDispatcher(DispatcherConfig())
+        node = Node(node_id="node", host="127.0.0.1", port=50100, capabilities=[],
+                    max_concurrent_jobs=1, status=NodeStatus.HEALTHY)
+        dispatcher._add_node(node)
+        job = Job(job_id="job", job_type="execute_command", payload=b"")
+        dispatcher.jobs[job.job_id] = job
+        
+        with patch.object(dispatcher, "_simulate_job_execution", new=AsyncMock(side_effect=RuntimeError("node lost"))):
+            await dispatcher._assign_job_to_node(job, node)
+            self.assertEqual(len(dispatcher._job_tasks), 1)
+            await asyncio.gather(*dispatcher._job_tasks, return_exceptions=True)
+            await asyncio.sleep(0)
+        
+        self.assertEqual(dispatcher._job_tasks, set())
+        self.assertEqual(job.status, JobStatus.FAILED)
+        self.assertEqual(job.error_message, "node lost")
+        self.assertEqual(dispatcher.total_jobs_failed, 1)
+        self.assertEqual(node.active_jobs, 0)
+        self.assertEqual(node.current_jobs, set())
+        self.assertTrue(node.is_available)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from photoshop_mcp_server.llm_retouch import cache as cache_module
+from photoshop_mcp_server.llm_retouch.cache import ResponseCache, SemanticCache
+
+
+class TestResponseCache(unittest.TestCase):
+    """永続レスポンスキャッシュのテスト"""
+    
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+    
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.temp_dir.cleanup()
+    
+    def test_expired_entry_is_not_returned(self):
+        """有効期限を過ぎたエントリはヒットしないこと"""
+        cache = ResponseCache(self.temp_dir.name, ttl=60)
+        with patch("time.time", return_value=1000.0):
+            cache.set("key", {"value": 1})
+        with patch("time.time", return_value=1059.0):
+            self.assertEqual(cache.get("key"), {"value": 1})
+        with patch("time.time", return_value=1061.0):
+            self.assertIsNone(cache.get("key"))
+        cache.close()
+    
+    def test_get_does_not_commit(self):
+        """読み込みではディスクへの書き込みを行わないこと"""
+        cache = ResponseCache(self.temp_dir.name)
+        cache.set("key", {"value": 1})
+        changes = cache._conn.total_changes
+        self.assertEqual(cache.get("key"), {"value": 1})
+        self.assertEqual(cache._conn.total_changes, changes)
+        self.assertIn("key", cache._accessed)
+        cache.close()
+    
+    def test_cache_is_disabled_by_default(self):
+        """環境変数を指定しない場合はレスポンスキャッシュが無効であること"""
+        with patch.dict(os.environ, {}, clear=False), \
+             patch.object(cache_module, "_response_cache", None), \
+             patch.object(cache_module, "_response_cache_initialized", False):
+            os.environ.pop("LLM_RESPONSE_CACHE", None)
+            self.assertIsNone(cache_module.get_response_cache())
+
+
+class _FakeEmbeddingModel:
+    """すべての指示を同じベクトルに変換する埋め込みモデル"""
+    
+    def __init__(self, model_name):
+        self.model_name = model_name
+    
+    def encode(self, text, normalize_embeddings=True):
+        return [1.0, 0.0, 0.0]
+
+
+@unittest.skipIf(cache_module.np is None, "numpyが必要なテスト")
+class TestSemanticCache(unittest.TestCase):
+    """意味的キャッシュのテスト"""
+    
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        patcher = patch.object(cache_module, "SentenceTransformer", _FakeEmbeddingModel)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = SemanticCache(self.temp_dir.name)
+    
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.cache._conn.close()
+        self.temp_dir.cleanup()
+    
+    def test_hit_is_isolated_from_callers(self):
+        """ヒットした結果や保存元のリストを変更しても、キャッシュの内容が変わらないこと"""
+        commands = [{"type": "brightness", "params": {"value": 10}}]
+        self.cache.set("scope", "make it brighter", commands)
+        commands.append({"type": "contrast", "params": {}})
+        
+        hit = self.cache.get("scope", "brighten the photo")
+        hit[0]["params"]["value"] = 99
+        hit.append({"type": "sharpen", "params": {}})
+        
+        self.assertEqual(
+            self.cache.get("scope", "brighten the photo"),
+            [{"type": "brightness", "params": {"value": 10}}]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
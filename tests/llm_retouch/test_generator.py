@@ -0,0 +1,230 @@
+import asyncio
+import codecs
+import json
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from photoshop_mcp_server.llm_retouch import generator as generator_module
+from photoshop_mcp_server.llm_retouch.generator import (
+    RetouchCommandGenerator, _CommandStreamParser, _extract_and_validate, _validate_commands
+)
+from photoshop_mcp_server.llm_retouch.models import ModelType, get_model
+
+
+class TestGenerateCoalescing(unittest.IsolatedAsyncioTestCase):
+    """同一内容の生成処理の統合のテスト"""
+    
+    def setUp(self):
+        """テスト前の準備"""
+        self.generator = RetouchCommandGenerator(ModelType.GPT4_VISION, api_key="test-key")
+        self.cache_key = ("image", "analysis", "prompt")
+    
+    async def test_owner_cancel_does_not_cancel_waiters(self):
+        """最初の呼び出し元がキャンセルされても、待機中の呼び出し元には結果が届くこと"""
+        started = asyncio.Event()
+        release = asyncio.Event()
+        calls = []
+        
+        async def fake_generate_retouch(image_path, analysis_result, prompt):
+            calls.append(image_path)
+            started.set()
+            await release.wait()
+            return {"commands": [{"type": "exposure", "params": {"value": 0.5}}]}
+        
+        with patch.object(self.generator.model, "generate_retouch", new=fake_generate_retouch), \
+             patch.object(self.generator.model, "warmup", new=AsyncMock()):
+            owner = asyncio.create_task(
+                self.generator._generate_commands(self.cache_key, "test.jpg", {}, "prompt"))
+            await started.wait()
+            waiter = asyncio.create_task(
+                self.generator._generate_commands(self.cache_key, "test.jpg", {}, "prompt"))
+            await asyncio.sleep(0)
+            
+            # 生成処理を開始した呼び出し元をキャンセル
+            owner.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await owner
+            
+            release.set()
+            commands = await waiter
+        
+        self.assertEqual(commands, [{"type": "exposure", "params": {"value": 0.5}}])
+        self.assertEqual(len(calls), 1)
+        self.assertNotIn(self.cache_key, self.generator._inflight)
+    
+    async def test_waiters_receive_model_error(self):
+        """モデルの例外が待機中の呼び出し元にも伝わり、実行中の一覧から取り除かれること"""
+        release = asyncio.Event()
+        
+        async def failing_generate_retouch(image_path, analysis_result, prompt):
+            await release.wait()
+            raise RuntimeError("model error")
+        
+        with patch.object(self.generator.model, "generate_retouch", new=failing_generate_retouch), \
+             patch.object(self.generator.model, "warmup", new=AsyncMock()):
+            first = asyncio.create_task(
+                self.generator._generate_commands(self.cache_key, "test.jpg", {}, "prompt"))
+            second = asyncio.create_task(
+                self.generator._generate_commands(self.cache_key, "test.jpg", {}, "prompt"))
+            await asyncio.sleep(0)
+            release.set()
+            results = await asyncio.gather(first, second, return_exceptions=True)
+        
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+        self.assertNotIn(self.cache_key, self.generator._inflight)
+
+
+
+class TestGeneratorWarmup(unittest.IsolatedAsyncioTestCase):
+    """接続のウォームアップのテスト"""
+    
+    async def test_warmup_runs_once_per_model(self):
+        """同じモデルを使うジェネレーターを複数生成しても、ウォームアップは1回だけ実行されること"""
+        model = get_model(ModelType.GPT4_VISION, api_key="warmup-key")
+        warmup = AsyncMock()
+        with patch.object(model, "warmup", new=warmup):
+            generators = [RetouchCommandGenerator(ModelType.GPT4_VISION, api_key="warmup-key") for _ in range(3)]
+            await model._warmup_task
+            # 完了時のコールバックの実行を待つ
+            await asyncio.sleep(0)
+        
+        self.assertTrue(all(generator.model is model for generator in generators))
+        warmup.assert_awaited_once()
+        self.assertIsNone(model._warmup_task)
+
+
+# ストリームのテストに使うコマンド（文字列中の括弧・エスケープ・マルチバイト文字を含む）
+STREAM_COMMANDS = [
+    {"type": "exposure", "params": {"value": 0.5}, "purpose": "明るさを補正 {調整}"},
+    {"type": "curves", "params": {"points": [[0, 0], [128, 140], [255, 255]]}, "purpose": "引用符 \"]}\" を含む"},
+    {"type": "hue_saturation", "params": {"saturation": -10}, "mask_instructions": "バックスラッシュ \\"},
+]
+
+STREAM_TEXT = (
+    "以下がレタッチコマンドです。\n```json\n"
+    + json.dumps({"analysis": {"note": "[ignored]"}, "commands": STREAM_COMMANDS, "summary": {"count": 3}}, ensure_ascii=False)
+    + "\n```"
+)
+
+
+class TestCommandStreamParser(unittest.TestCase):
+    """ストリーム中のコマンド配列のインクリメンタルパーサーのテスト"""
+    
+    def _parse_chunks(self, chunks):
+        """断片を順に与えて、取り出された要素をすべて返す"""
+        parser = _CommandStreamParser()
+        items = []
+        for chunk in chunks:
+            items.extend(parser.feed(chunk))
+        return parser, items
+    
+    def test_whole_text(self):
+        """一度に与えたテキストからコマンド配列の要素をすべて取り出せること"""
+        parser, items = self._parse_chunks([STREAM_TEXT])
+        
+        self.assertEqual(items, STREAM_COMMANDS)
+        self.assertTrue(parser.found_array)
+        self.assertTrue(parser.finished)
+        self.assertEqual(parser.text, STREAM_TEXT)
+    
+    def test_split_at_every_position(self):
+        """任意の位置で2つの断片に分割しても同じ要素を取り出せること"""
+        for index in range(len(STREAM_TEXT) + 1):
+            with self.subTest(index=index):
+                _, items = self._parse_chunks([STREAM_TEXT[:index], STREAM_TEXT[index:]])
+                self.assertEqual(items, STREAM_COMMANDS)
+    
+    def test_split_at_every_byte_boundary(self):
+        """UTF-8のバイト列を任意の位置で分割し、逐次デコードした断片を与えても同じ要素を取り出せること"""
+        data = STREAM_TEXT.encode("utf-8")
+        for index in range(len(data) + 1):
+            with self.subTest(index=index):
+                decoder = codecs.getincrementaldecoder("utf-8")()
+                chunks = [decoder.decode(data[:index]), decoder.decode(data[index:], final=True)]
+                _, items = self._parse_chunks(chunks)
+                self.assertEqual(items, STREAM_COMMANDS)
+    
+    def test_one_character_chunks(self):
+        """1文字ずつ与えた場合も、各要素が閉じた時点で1件ずつ取り出せること"""
+        parser = _CommandStreamParser()
+        counts = []
+        items = []
+        for ch in STREAM_TEXT:
+            parsed = parser.feed(ch)
+            counts.append(len(parsed))
+            items.extend(parsed)
+        
+        self.assertEqual(items, STREAM_COMMANDS)
+        self.assertEqual(max(counts), 1)
+    
+    def test_retouch_commands_key(self):
+        """retouch_commandsのキーで始まる配列も取り出せること"""
+        text = json.dumps({"retouch_commands": STREAM_COMMANDS[:1]}, ensure_ascii=False)
+        _, items = self._parse_chunks([text[:5], text[5:14], text[14:]])
+        
+        self.assertEqual(items, STREAM_COMMANDS[:1])
+    
+    def test_ignores_text_after_array(self):
+        """配列の終端以降に届いたテキストは要素として扱わないこと"""
+        text = json.dumps({"commands": STREAM_COMMANDS[:1]}) + '\n{"type": "extra", "params": {}}'
+        parser, items = self._parse_chunks([text])
+        
+        self.assertEqual(items, STREAM_COMMANDS[:1])
+        self.assertEqual(parser.feed('{"type": "late", "params": {}}'), [])
+
+
+class TestValidateCommands(unittest.TestCase):
+    """レタッチコマンドのスキーマ検証のテスト"""
+    
+    VALID_COMMANDS = [
+        {"type": "exposure", "params": {"value": 0.5}},
+        {"type": "curves", "params": {}, "purpose": "コントラスト", "order": 2, "layer_name": "Curves",
+         "blend_mode": "normal", "opacity": 80, "mask": True, "mask_instructions": "背景のみ"},
+        {"type": "levels", "params": {}, "opacity": 55.5, "extra": "未定義のキーは許可"},
+    ]
+    
+    INVALID_COMMANDS = [
+        {"params": {"value": 0.5}},
+        {"type": "exposure"},
+        {"type": 1, "params": {}},
+        {"type": "exposure", "params": []},
+        {"type": "exposure", "params": {}, "order": 1.5},
+        {"type": "exposure", "params": {}, "order": True},
+        {"type": "exposure", "params": {}, "opacity": False},
+        {"type": "exposure", "params": {}, "opacity": "80"},
+        {"type": "exposure", "params": {}, "mask": 1},
+        "exposure",
+        None,
+        [{"type": "exposure", "params": {}}],
+    ]
+    
+    def test_keeps_only_valid_commands(self):
+        """スキーマに適合するコマンドのみを元の順序で残すこと"""
+        commands = []
+        for valid, invalid in zip(self.VALID_COMMANDS, self.INVALID_COMMANDS):
+            commands.extend([invalid, valid])
+        commands.extend(self.INVALID_COMMANDS[len(self.VALID_COMMANDS):])
+        
+        self.assertEqual(_validate_commands(commands), self.VALID_COMMANDS)
+    
+    def test_fallback_validator(self):
+        """fastjsonschemaを使わない簡易バリデーターも同じ判定をすること"""
+        with patch.object(generator_module, "fastjsonschema", None):
+            is_valid = generator_module._compile_command_validator()
+        
+        self.assertTrue(all(is_valid(cmd) for cmd in self.VALID_COMMANDS))
+        self.assertFalse(any(is_valid(cmd) for cmd in self.INVALID_COMMANDS))
+    
+    def test_extract_and_validate(self):
+        """commands、retouch_commands、トップレベルの値の順にコマンドリストを探すこと"""
+        valid = self.VALID_COMMANDS[0]
+        invalid = self.INVALID_COMMANDS[0]
+        
+        self.assertEqual(_extract_and_validate({"commands": [valid, invalid]}), [valid])
+        self.assertEqual(_extract_and_validate({"retouch_commands": [invalid, valid]}), [valid])
+        self.assertEqual(_extract_and_validate([valid]), [valid])
+        self.assertEqual(_extract_and_validate({"commands": "exposure"}), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
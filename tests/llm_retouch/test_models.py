@@ -0,0 +1,299 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from collections import OrderedDict
+from email.utils import formatdate
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from PIL import Image
+
+from photoshop_mcp_server.llm_retouch import models
+from photoshop_mcp_server.llm_retouch.models import (
+    API_MAX_ATTEMPTS, API_MAX_RETRY_DELAY, BaseVisionModel, GeminiVisionModel, InvalidImageError, ModelType,
+    get_model, race, validate_image
+)
+
+API_FORMATS = frozenset({"JPEG", "PNG", "GIF", "WEBP"})
+
+
+class TestValidateImage(unittest.TestCase):
+    """APIに送信する画像の検証のテスト"""
+    
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+    
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        self.temp_dir.cleanup()
+    
+    def test_large_tiff_is_sent_after_preparation(self):
+        """元ファイルがサイズ上限・許可形式を満たさなくても、縮小後のJPEGが満たせば送信できること"""
+        path = os.path.join(self.temp_dir.name, "large.tif")
+        Image.effect_noise((2048, 2048), 64).convert("RGB").save(path)
+        self.assertGreater(os.path.getsize(path), 1024 * 1024)
+        
+        payload = validate_image(path, API_FORMATS, max_bytes=1024 * 1024, max_edge=1024)
+        
+        self.assertTrue(payload.prepared)
+        self.assertEqual(payload.mime, "image/jpeg")
+    
+    def test_unprepared_payload_is_checked(self):
+        """縮小しない画像は元のデータのサイズと形式で検証されること"""
+        path = os.path.join(self.temp_dir.name, "small.tif")
+        Image.new("RGB", (64, 64)).save(path)
+        
+        with self.assertRaises(InvalidImageError):
+            validate_image(path, API_FORMATS, max_edge=1024)
+        with self.assertRaises(InvalidImageError):
+            validate_image(path, None, max_bytes=16, max_edge=1024)
+    
+    def test_corrupted_image_is_rejected(self):
+        """画像として読み込めないファイルは縮小の前に失敗すること"""
+        path = os.path.join(self.temp_dir.name, "broken.jpg")
+        with open(path, "wb") as broken_file:
+            broken_file.write(b"\xff\xd8\xff\xe0not an image")
+        
+        with self.assertRaises(InvalidImageError):
+            validate_image(path, API_FORMATS)
+
+
+
+def _response(status_code, content=b"{}", headers=None):
+    """トランスポートが返すレスポンスを生成する"""
+    return models._TransportResponse(status_code, headers or {}, content, "HTTP/1.1")
+
+
+class TestPostJsonRetry(unittest.IsolatedAsyncioTestCase):
+    """プロバイダーAPIへのリクエストの再試行のテスト"""
+    
+    def setUp(self):
+        """テスト前の準備"""
+        self.model = get_model(ModelType.GPT4_VISION, api_key="retry-test-key")
+        self.transport = SimpleNamespace(post=AsyncMock(), errors=(ConnectionError,))
+        self.sleep = AsyncMock()
+        patchers = [
+            patch.object(models, "_get_transport", return_value=self.transport),
+            patch.object(models, "_get_rate_limiter", return_value=None),
+            patch.object(models, "_retry_delay", return_value=0.25),
+            patch.object(models.asyncio, "sleep", new=self.sleep),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    async def _post(self):
+        """テスト用のリクエストを送信する"""
+        return await self.model._post_json("https://api.example.com/v1", {"Authorization": "Bearer x"}, {"a": 1}, "Test")
+    
+    async def test_retry_after_is_honored(self):
+        """429と529はRetry-Afterの秒数だけ待機して再試行すること"""
+        self.transport.post.side_effect = [
+            _response(429, headers={"Retry-After": "2"}),
+            _response(529, headers={"Retry-After": "0.5"}),
+            _response(200, b'{"ok": true}'),
+        ]
+        
+        result = await self._post()
+        
+        self.assertEqual(result, {"ok": True})
+        self.assertEqual(self.transport.post.await_count, 3)
+        self.assertEqual([call.args[0] for call in self.sleep.await_args_list], [2.0, 0.5])
+    
+    async def test_backoff_without_retry_after(self):
+        """Retry-Afterがない場合や解釈できない場合は指数バックオフで待機すること"""
+        self.transport.post.side_effect = [
+            _response(529),
+            _response(429, headers={"Retry-After": "soon"}),
+            _response(200, b'{"ok": true}'),
+        ]
+        
+        await self._post()
+        
+        self.assertEqual([call.args[0] for call in self.sleep.await_args_list], [0.25, 0.25])
+    
+    async def test_zero_retry_after_is_not_backed_off(self):
+        """Retry-Afterが0や過去の日付の場合はバックオフせずにすぐ再試行すること"""
+        past_date = formatdate(models.time.time() - 60, usegmt=True)
+        self.transport.post.side_effect = [
+            _response(429, headers={"Retry-After": "0"}),
+            _response(503, headers={"Retry-After": past_date}),
+            _response(200, b'{"ok": true}'),
+        ]
+        
+        await self._post()
+        
+        self.assertEqual([call.args[0] for call in self.sleep.await_args_list], [0.0, 0.0])
+    
+    async def test_retry_after_is_capped(self):
+        """Retry-Afterの待機時間は上限で打ち切ること（HTTP日付形式を含む）"""
+        future_date = formatdate(models.time.time() + 3600, usegmt=True)
+        self.transport.post.side_effect = [
+            _response(429, headers={"Retry-After": "600"}),
+            _response(529, headers={"Retry-After": future_date}),
+            _response(200),
+        ]
+        
+        await self._post()
+        
+        self.assertEqual([call.args[0] for call in self.sleep.await_args_list], [API_MAX_RETRY_DELAY, API_MAX_RETRY_DELAY])
+    
+    async def test_gives_up_after_max_attempts(self):
+        """再試行の上限に達した場合は最後のエラーを送出すること"""
+        self.transport.post.return_value = _response(529, b"overloaded", {"Retry-After": "1"})
+        
+        with self.assertRaisesRegex(Exception, "Test API error: 529"):
+            await self._post()
+        
+        self.assertEqual(self.transport.post.await_count, API_MAX_ATTEMPTS)
+        self.assertEqual(self.sleep.await_count, API_MAX_ATTEMPTS - 1)
+    
+    async def test_client_error_is_not_retried(self):
+        """再試行対象でないステータスコードはすぐに送出すること"""
+        self.transport.post.return_value = _response(400, b"bad request")
+        
+        with self.assertRaisesRegex(Exception, "Test API error: 400"):
+            await self._post()
+        
+        self.assertEqual(self.transport.post.await_count, 1)
+        self.sleep.assert_not_awaited()
+    
+    async def test_connection_error_is_retried(self):
+        """接続エラーは指数バックオフで待機して再試行すること"""
+        self.transport.post.side_effect = [ConnectionError("reset"), _response(200, b'{"ok": true}')]
+        
+        self.assertEqual(await self._post(), {"ok": True})
+        self.assertEqual([call.args[0] for call in self.sleep.await_args_list], [0.25])
+
+
+
+GEMINI_TEXT_RESPONSE = b'{"candidates": [{"content": {"parts": [{"text": "{\\"ok\\": true}"}]}}]}'
+
+
+class TestGeminiFileUpload(unittest.IsolatedAsyncioTestCase):
+    """Google Files APIへのアップロードとinline_dataへのフォールバックのテスト"""
+    
+    def setUp(self):
+        """テスト前の準備"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.image_path = os.path.join(self.temp_dir.name, "photo.png")
+        Image.new("RGB", (32, 32), "red").save(self.image_path)
+        
+        self.transport = SimpleNamespace(post=AsyncMock(), errors=(ConnectionError,))
+        patchers = [
+            patch.object(models, "_GEMINI_FILE_URIS", new=OrderedDict()),
+            patch.object(models, "_get_transport", return_value=self.transport),
+            patch.object(models, "_get_rate_limiter", return_value=None),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    def _upload_responses(self, file_uri):
+        """アップロードの開始と確定のレスポンスを生成する"""
+        return [
+            _response(200, headers={"x-goog-upload-url": "https://upload.example.com/session"}),
+            _response(200, f'{{"file": {{"uri": "{file_uri}"}}}}'.encode()),
+        ]
+    
+    async def test_uploads_are_not_shared_across_api_keys(self):
+        """別のAPIキーのモデルには他のキーでアップロードしたファイルURIを渡さないこと"""
+        self.transport.post.side_effect = self._upload_responses("files/a") + self._upload_responses("files/b")
+        model_a = GeminiVisionModel(api_key="key-a")
+        model_b = GeminiVisionModel(api_key="key-b")
+        
+        self.assertEqual(await model_a._upload_image(self.image_path), "files/a")
+        self.assertEqual(await model_b._upload_image(self.image_path), "files/b")
+        # 同じキーではキャッシュ済みのURIを再利用する
+        self.assertEqual(await model_a._upload_image(self.image_path), "files/a")
+        self.assertEqual(self.transport.post.await_count, 4)
+    
+    async def test_inaccessible_file_falls_back_to_inline_data(self):
+        """ファイルを参照できない場合はキャッシュを破棄し、inline_dataで再送すること"""
+        self.transport.post.side_effect = self._upload_responses("files/stale") + [
+            _response(403, b"permission denied"),
+            _response(200, GEMINI_TEXT_RESPONSE),
+        ]
+        model = GeminiVisionModel(api_key="key-a")
+        
+        result = await model.analyze_image(self.image_path, "analyze")
+        
+        self.assertEqual(result, {"ok": True})
+        file_request, inline_request = [call.args[2] for call in self.transport.post.await_args_list[2:]]
+        self.assertIn(b'"file_data"', file_request)
+        self.assertIn(b'"inline_data"', inline_request)
+        self.assertNotIn(b'"file_data"', inline_request)
+        self.assertEqual(len(models._GEMINI_FILE_URIS), 0)
+
+
+class _RaceModel(BaseVisionModel):
+    """指定した結果を返すか、自身のタスクをキャンセルされた状態で終了するモデル"""
+    
+    def __init__(self, result=None, cancelled=False):
+        super().__init__(api_key="race-test-key")
+        self.result = result
+        self.cancelled = cancelled
+    
+    def _get_api_key_from_env(self):
+        return "race-test-key"
+    
+    async def analyze_image(self, image_path, prompt):
+        if self.cancelled:
+            raise asyncio.CancelledError()
+        await asyncio.sleep(0.01)
+        return self.result
+    
+    async def generate_retouch(self, image_path, analysis, instructions):
+        raise NotImplementedError
+
+
+class TestRace(unittest.IsolatedAsyncioTestCase):
+    """複数モデルへの同時リクエストのテスト"""
+    
+    async def test_cancelled_candidate_is_skipped(self):
+        """キャンセルされた候補は失敗した候補と同様に読み飛ばし、他のモデルの結果を返すこと"""
+        result = await race([_RaceModel(cancelled=True), _RaceModel({"ok": True})], "analyze_image", "photo.png", "analyze")
+        
+        self.assertEqual(result, {"ok": True})
+    
+    async def test_all_candidates_cancelled(self):
+        """すべての候補がキャンセルされた場合はCancelledError以外のエラーを送出すること"""
+        with self.assertRaisesRegex(RuntimeError, "cancelled"):
+            await race([_RaceModel(cancelled=True)], "analyze_image", "photo.png", "analyze")
+
+
+class TestGetModel(unittest.TestCase):
+    """モデルインスタンスのレジストリのテスト"""
+    
+    def setUp(self):
+        """テスト前の準備"""
+        patcher = patch.object(models, "_MODEL_INSTANCES", new=OrderedDict())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_same_key_returns_same_instance(self):
+        """同じモデルタイプとAPIキーには同一のインスタンスを返すこと"""
+        model = get_model(ModelType.GPT4_VISION, api_key="shared-key")
+        
+        self.assertIs(get_model("gpt-4-vision", api_key="shared-key"), model)
+        self.assertIsNot(get_model(ModelType.GPT4_VISION, api_key="other-key"), model)
+    
+    def test_rotated_keys_are_evicted(self):
+        """APIキーを入れ替え続けても、最近使われていないインスタンスから破棄して上限を守ること"""
+        with patch.object(models, "MODEL_INSTANCE_CACHE_SIZE", 3):
+            recent = get_model(ModelType.GPT4_VISION, api_key="key-0")
+            for i in range(1, 10):
+                get_model(ModelType.GPT4_VISION, api_key=f"key-{i}")
+                # 使用中のキーは破棄されない
+                self.assertIs(get_model(ModelType.GPT4_VISION, api_key="key-0"), recent)
+            
+            self.assertEqual(len(models._MODEL_INSTANCES), 3)
+            self.assertNotIn((ModelType.GPT4_VISION, models._api_key_digest("key-1")), models._MODEL_INSTANCES)
+            self.assertIn((ModelType.GPT4_VISION, models._api_key_digest("key-9")), models._MODEL_INSTANCES)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,7 @@ import time
 import logging
 from unittest.mock import patch
 
-from photoshop_mcp_server.bridge import get_bridge
+from photoshop_mcp_server.bridge import get_bridge, reset_bridge
 
 @unittest.skipIf(platform.system() != "Windows", "Windows専用のテスト")
 class TestWindowsIntegration(unittest.TestCase):
@@ -14,6 +14,8 @@ class TestWindowsIntegration(unittest.TestCase):
     
     def setUp(self):
         """テスト前の準備"""
+        # テストごとに新しいブリッジインスタンスを使用
+        reset_bridge("powershell")
         self.bridge = get_bridge("powershell")
         # テスト用の一時ディレクトリ
         self.temp_dir = tempfile.TemporaryDirectory()
@@ -143,10 +145,10 @@ class TestWindowsIntegration(unittest.TestCase):
         """エラー回復のテスト"""
         self.logger.info("エラー回復テスト開始")
         
-        # 最初は成功、2回目は失敗、3回目は成功するようにモックを設定
+        # 最初は成功、2回目は一時的なエラー（Photoshopがビジー）、3回目は成功するようにモックを設定
         mock_results = [
             ('{"status": "success", "message": "Test"}', '', 0),
-            ('', 'エラーが発生しました', 1),
+            ('', 'Call was rejected by callee. (RPC_E_SERVERCALL_RETRYLATER)', 1),
             ('{"status": "success", "message": "Recovered"}', '', 0)
         ]
         mock_run_script.side_effect = mock_results
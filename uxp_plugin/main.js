@@ -99,9 +99,34 @@ function updateConnectionStatus(status, text) {
 
 // 受信メッセージの処理
 async function handleIncomingMessage(message) {
+    let data;
     try {
         // JSONメッセージのパース
-        const data = JSON.parse(message);
+        data = JSON.parse(message);
+    } catch (error) {
+        logError(`メッセージ処理エラー: ${error.message}`);
+        console.error('メッセージ処理エラー:', error);
+        
+        if (wsConnection && wsConnection.isConnected()) {
+            wsConnection.send(JSON.stringify({ 
+                command: 'error', 
+                error: `メッセージ処理エラー: ${error.message}` 
+            }));
+        }
+        return;
+    }
+    
+    // サーバーは同時に送信するコマンドを{ batch: [...] }の1フレームにまとめるため、個別に処理する
+    if (Array.isArray(data.batch)) {
+        await Promise.all(data.batch.map(handleCommand));
+        return;
+    }
+    await handleCommand(data);
+}
+
+// コマンドの処理
+async function handleCommand(data) {
+    try {
         logInfo(`メッセージを受信: ${data.command}`);
 
         // コマンドの処理
@@ -112,11 +137,7 @@ async function handleIncomingMessage(message) {
                 
             case 'execute_action':
                 const result = await executePhotoshopAction(data.params);
-                wsConnection.send(JSON.stringify({ 
-                    command: 'action_result', 
-                    id: data.id, 
-                    result: result 
-                }));
+                sendActionResult(data.id, result);
                 break;
                 
             case 'get_document_info':
@@ -143,12 +164,42 @@ async function handleIncomingMessage(message) {
         if (wsConnection && wsConnection.isConnected()) {
             wsConnection.send(JSON.stringify({ 
                 command: 'error', 
+                id: data.id, 
                 error: `メッセージ処理エラー: ${error.message}` 
             }));
         }
     }
 }
 
+// アクション結果の送信
+// スクリプトの戻り値に含まれる画像データ（ArrayBuffer）はJSONに含めず、
+// 応答の直後にバイナリフレームで送信する（binaryには格納先のキーの経路を指定）
+function sendActionResult(id, result) {
+    const value = result && result.result;
+    if (value && typeof value === 'object') {
+        for (const key of Object.keys(value)) {
+            const data = value[key];
+            if (data instanceof ArrayBuffer || ArrayBuffer.isView(data)) {
+                value[key] = null;
+                wsConnection.send(JSON.stringify({ 
+                    command: 'action_result', 
+                    id: id, 
+                    result: result, 
+                    binary: ['result', 'result', key] 
+                }));
+                wsConnection.send(data);
+                return;
+            }
+        }
+    }
+    
+    wsConnection.send(JSON.stringify({ 
+        command: 'action_result', 
+        id: id, 
+        result: result 
+    }));
+}
+
 // ログ関数
 function logInfo(message) {
     addLogEntry(message, 'info');
@@ -51,6 +51,12 @@ async function executePhotoshopAction(params) {
             case 'executeJSX':
                 return await executeJSXScript(params.script);
                 
+            case 'exportLayer':
+                return await exportLayer(params.name, params.path, params.format);
+                
+            case 'generateThumbnail':
+                return await generateThumbnail(params.width, params.height, params.format, params.quality);
+                
             default:
                 throw new Error(`未サポートのアクション: ${params.actionType}`);
         }
@@ -187,6 +193,43 @@ async function createLayer(name, type = 'pixel') {
     }
 }
 
+/**
+ * ドキュメントを指定形式で保存（モーダルコンテキスト内で呼び出す）
+ * @param {Document} doc - 保存するドキュメント
+ * @param {string} format - 保存形式 ('jpg', 'png', 'psd')
+ * @param {string} path - 保存先パス
+ * @param {Object} options - 保存オプション
+ */
+async function saveDocumentAs(doc, format, path, options = {}) {
+    // 保存形式に基づいて処理を分岐
+    switch (format.toLowerCase()) {
+        case 'jpg':
+        case 'jpeg':
+            await doc.saveAs.jpg(path, {
+                quality: options.quality || 90,
+                embedColorProfile: options.embedColorProfile !== false
+            });
+            break;
+            
+        case 'png':
+            await doc.saveAs.png(path, {
+                compression: options.compression || 6,
+                embedColorProfile: options.embedColorProfile !== false
+            });
+            break;
+            
+        case 'psd':
+            await doc.saveAs.psd(path, {
+                embedColorProfile: options.embedColorProfile !== false,
+                maximizeCompatibility: options.maximizeCompatibility !== false
+            });
+            break;
+            
+        default:
+            throw new Error(`未サポートのエクスポート形式: ${format}`);
+    }
+}
+
 /**
  * ドキュメントをエクスポート
  * @param {string} format - エクスポート形式 ('jpg', 'png', 'psd')
@@ -205,33 +248,7 @@ async function exportDocument(format, path, options = {}) {
         
         // モーダルコンテキストで実行
         await executeAsModal(async () => {
-            // エクスポート形式に基づいて処理を分岐
-            switch (format.toLowerCase()) {
-                case 'jpg':
-                case 'jpeg':
-                    await doc.saveAs.jpg(path, {
-                        quality: options.quality || 90,
-                        embedColorProfile: options.embedColorProfile !== false
-                    });
-                    break;
-                    
-                case 'png':
-                    await doc.saveAs.png(path, {
-                        compression: options.compression || 6,
-                        embedColorProfile: options.embedColorProfile !== false
-                    });
-                    break;
-                    
-                case 'psd':
-                    await doc.saveAs.psd(path, {
-                        embedColorProfile: options.embedColorProfile !== false,
-                        maximizeCompatibility: options.maximizeCompatibility !== false
-                    });
-                    break;
-                    
-                default:
-                    throw new Error(`未サポートのエクスポート形式: ${format}`);
-            }
+            await saveDocumentAs(doc, format, path, options);
         }, { commandName: 'MCPドキュメントエクスポート' });
         
         return {
@@ -248,6 +265,67 @@ async function exportDocument(format, path, options = {}) {
     }
 }
 
+/**
+ * レイヤーを単独で表示した状態でエクスポート
+ * サーバーからはパラメータだけを受け取り、スクリプトを毎回送信・解析しない
+ * @param {string} name - エクスポートするレイヤー名
+ * @param {string} path - 保存先パス
+ * @param {string} format - エクスポート形式 ('png', 'jpg', 'psd')
+ * @returns {Object} - 実行結果
+ */
+async function exportLayer(name, path, format = 'png') {
+    try {
+        // アクティブなドキュメントがあるか確認
+        if (app.documents.length === 0) {
+            throw new Error('開いているドキュメントがありません');
+        }
+        
+        const doc = app.activeDocument;
+        const target = doc.layers.find(layer => layer.name === name);
+        if (!target) {
+            throw new Error(`レイヤーが見つかりません: ${name}`);
+        }
+        
+        format = (format || 'png').toLowerCase();
+        if (format !== 'jpg' && format !== 'jpeg' && format !== 'psd') {
+            // デフォルトはPNG
+            format = 'png';
+        }
+        
+        // モーダルコンテキストで実行
+        await executeAsModal(async () => {
+            // 他のレイヤーを非表示にする（表示状態を記録して最後に元に戻す）
+            const visibilityState = doc.layers.map(layer => layer.visible);
+            try {
+                doc.layers.forEach(layer => {
+                    layer.visible = (layer === target);
+                });
+                
+                await saveDocumentAs(doc, format, path, {
+                    quality: 12,
+                    compression: 0
+                });
+            } finally {
+                doc.layers.forEach((layer, i) => {
+                    layer.visible = visibilityState[i];
+                });
+            }
+        }, { commandName: 'MCPレイヤーエクスポート' });
+        
+        return {
+            success: true,
+            path: path,
+            format: format
+        };
+    } catch (error) {
+        console.error('レイヤーエクスポートエラー:', error);
+        return {
+            success: false,
+            error: error.message
+        };
+    }
+}
+
 /**
  * フィルターを適用
  * @param {string} filterType - フィルタータイプ
@@ -314,6 +392,75 @@ async function applyFilter(filterType, options = {}) {
     }
 }
 
+/**
+ * アクティブなドキュメントのサムネイルを生成
+ * サーバーからはパラメータだけを受け取り、スクリプトを毎回送信・解析しない
+ * @param {number} width - サムネイルの幅
+ * @param {number} height - サムネイルの高さ
+ * @param {string} format - 出力形式 ('jpeg', 'png')
+ * @param {number} quality - 画質 (0-100)
+ * @returns {Object} - 実行結果（resultに画像データとサイズ、画像データはバイナリフレームで送信される）
+ */
+async function generateThumbnail(width, height, format = 'jpeg', quality = 80) {
+    try {
+        // アクティブなドキュメントがあるか確認
+        if (app.documents.length === 0) {
+            throw new Error('開いているドキュメントがありません');
+        }
+        
+        const doc = app.activeDocument;
+        format = (format || 'jpeg').toLowerCase();
+        
+        // モーダルコンテキストで実行
+        const result = await executeAsModal(async () => {
+            // アスペクト比を維持したサイズを計算
+            const ratio = Math.min(width / doc.width, height / doc.height);
+            const newWidth = Math.round(doc.width * ratio);
+            const newHeight = Math.round(doc.height * ratio);
+            
+            // 複製して新しいサイズにリサイズ
+            const docCopy = await doc.duplicate();
+            try {
+                await docCopy.resizeImage(newWidth, newHeight, doc.resolution, constants.ResampleMethod.BICUBIC);
+                
+                // 画像データを取得（PNG以外はJPEG）
+                let imageData;
+                if (format === 'png') {
+                    imageData = await docCopy.saveToOE({
+                        format: 'image/png'
+                    });
+                } else {
+                    imageData = await docCopy.saveToOE({
+                        format: 'image/jpeg',
+                        quality: quality / 100
+                    });
+                }
+                
+                return {
+                    thumbnail: imageData,
+                    width: newWidth,
+                    height: newHeight,
+                    format: format
+                };
+            } finally {
+                // 複製を閉じる
+                await docCopy.closeWithoutSaving();
+            }
+        }, { commandName: 'MCPサムネイル生成' });
+        
+        return {
+            success: true,
+            result: result
+        };
+    } catch (error) {
+        console.error('サムネイル生成エラー:', error);
+        return {
+            success: false,
+            error: error.message
+        };
+    }
+}
+
 /**
  * JSXスクリプトを実行
  * @param {string} script - 実行するJSXスクリプト
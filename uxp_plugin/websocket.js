@@ -3,6 +3,27 @@
  * websocket.js - WebSocket通信の管理
  */
 
+/**
+ * 受信したフレームを文字列に変換
+ * @param {string|ArrayBuffer} data - 受信したデータ
+ * @returns {string} - UTF-8としてデコードした文字列
+ */
+function decodeMessage(data) {
+    if (typeof data === 'string') {
+        return data;
+    }
+    if (typeof TextDecoder !== 'undefined') {
+        return new TextDecoder('utf-8').decode(data);
+    }
+    // TextDecoderが利用できない環境では、UTF-8のバイト列をパーセントエンコードしてデコードする
+    const bytes = new Uint8Array(data);
+    let encoded = '';
+    for (let i = 0; i < bytes.length; i++) {
+        encoded += '%' + (bytes[i] < 16 ? '0' : '') + bytes[i].toString(16);
+    }
+    return decodeURIComponent(encoded);
+}
+
 /**
  * WebSocket接続を管理するクラス
  */
@@ -42,6 +63,8 @@ class WebSocketConnection {
         try {
             console.log(`WebSocket: ${this.url} に接続中...`);
             this.socket = new WebSocket(this.url);
+            // サーバーはJSONをUTF-8のバイナリフレームで送信するため、ArrayBufferで受け取る
+            this.socket.binaryType = 'arraybuffer';
             
             this.socket.onopen = (event) => {
                 console.log('WebSocket: 接続成功');
@@ -77,7 +100,7 @@ class WebSocketConnection {
             
             this.socket.onmessage = (event) => {
                 if (this._onMessageCallback) {
-                    this._onMessageCallback(event.data);
+                    this._onMessageCallback(decodeMessage(event.data));
                 }
             };
         } catch (error) {